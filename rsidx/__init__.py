@@ -10,25 +10,59 @@
 import builtins
 from contextlib import contextmanager
 from gzip import open as gzopen
+import io
 import sys
 
+from rsidx import metrics
+from rsidx import binary
+from rsidx import presence
+from rsidx import tabix
 from rsidx import index
 from rsidx import search
+from rsidx import aio
+from rsidx import reverse
+from rsidx import bench
+from rsidx import serve
 from rsidx import __main__
 from rsidx import cli
+from rsidx.search import RsidIndex
 
 
 @contextmanager
-def open(filename, mode):
-    if mode not in ("r", "w"):
+def open(filename, mode, threads=None):
+    """Open a plain text or gzip compressed file, or stdin/stdout for "-" or None.
+
+    If `threads` is greater than 1 and the file is BGZF compressed, it is decompressed on a
+    pool of `threads` threads ahead of the reader. Files ending in ".gz" are written in BGZF
+    format, which is readable as plain gzip, and are compressed on a pool of `threads` threads.
+    """
+    if mode not in ("r", "w", "rb", "wb"):
         raise ValueError('invalid mode "{}"'.format(mode))
     if filename in ["-", None]:
-        filehandle = sys.stdin if mode == "r" else sys.stdout
+        filehandle = sys.stdin if mode.startswith("r") else sys.stdout
+        if mode.endswith("b"):
+            filehandle = filehandle.buffer
         yield filehandle
     else:
         openfunc = builtins.open
+        if threads and threads > 1 and mode.startswith("r") and tabix.is_bgzf(filename):
+            with tabix.ThreadedBgzfReader(filename, threads=threads) as raw:
+                filehandle = io.BufferedReader(raw, buffer_size=1 << 20)
+                if not mode.endswith("b"):
+                    filehandle = io.TextIOWrapper(filehandle)
+                yield filehandle
+            return
+        if filename.endswith(".gz") and mode.startswith("w"):
+            with tabix.ThreadedBgzfWriter(filename, threads=threads or 1) as raw:
+                filehandle = io.BufferedWriter(raw, buffer_size=1 << 20)
+                if not mode.endswith("b"):
+                    filehandle = io.TextIOWrapper(filehandle)
+                with filehandle:
+                    yield filehandle
+            return
         if filename.endswith(".gz"):
             openfunc = gzopen
-            mode += "t"
+            if not mode.endswith("b"):
+                mode += "t"
         with openfunc(filename, mode) as filehandle:
             yield filehandle
@@ -8,7 +8,6 @@
 # -----------------------------------------------------------------------------
 
 from . import cli
-from importlib.metadata import version
 import sys
 
 
@@ -25,7 +24,7 @@ def main(args=None):
             cli.get_parser().parse_args(["-h"])
         args = cli.get_parser().parse_args()
 
-    versionmessage = "[rsidx] running version {}".format(version("rsidx"))
+    versionmessage = "[rsidx] running version {}".format(cli.get_version())
     print(versionmessage, file=sys.stderr)
     mainmethod = cli.mains[args.subcmd]
     mainmethod(args)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
+import rsidx
+from rsidx.index import check_index, connect
+from rsidx.tabix import TabixIndexCache
+import threading
+
+
+class AsyncIndex:
+    """Index handle for searches from an asyncio event loop, shared by any number of tasks.
+
+    Index lookups and VCF fetches are blocking, so they run on a bounded pool of `max_workers`
+    threads, each with its own read-only connection to the index. The tabix index of each VCF
+    file is parsed once and shared by all searches. Searches beyond the pool
+    size wait for a free worker. Each search streams records to the event loop through a
+    queue of at most `queue_size` lines, so a worker pauses when its consumer falls behind.
+    """
+
+    def __init__(
+        self,
+        vcf,
+        idx,
+        max_workers=4,
+        queue_size=1000,
+        immutable=False,
+        cache_size=None,
+        mmap_size=None,
+    ):
+        check_index(idx)
+        self.vcf = vcf
+        self.idx = idx
+        self.queue_size = queue_size
+        self._options = dict(
+            readonly=True,
+            immutable=immutable,
+            cache_size=cache_size,
+            mmap_size=mmap_size,
+            check_same_thread=False,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = list()
+        self._tbicache = TabixIndexCache()
+
+    def _connection(self):
+        dbconn = getattr(self._local, "dbconn", None)
+        if dbconn is None:
+            dbconn = connect(self.idx, **self._options)
+            with self._lock:
+                self._connections.append(dbconn)
+            self._local.dbconn = dbconn
+        return dbconn
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for dbconn in self._connections:
+                dbconn.close()
+            self._connections.clear()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def lookup(self, rsidlist):
+        """Return the distinct (chrom, coord) of the specified rsIDs, sorted by coordinate."""
+
+        def run():
+            return list(rsidx.search.lookup(self._connection(), rsidlist))
+
+        return await self._run(run)
+
+    async def search(self, rsidlist, header=False, found=None, gap=1000, batch_size=100000):
+        """Yield VCF records for the specified rsIDs, sorted by genomic coordinate.
+
+        See `rsidx.search.search` for a description of the arguments. The rsID list is read
+        by a worker thread, so it should not be an iterator bound to the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            if stop.is_set():
+                return
+            try:
+                dbconn = self._connection()
+                lines = rsidx.search.search(
+                    rsidlist,
+                    dbconn,
+                    self.vcf,
+                    header,
+                    found,
+                    gap,
+                    batch_size,
+                    tbicache=self._tbicache,
+                )
+                with closing(lines):
+                    for line in lines:
+                        put(line)
+                        if stop.is_set():
+                            break
+            finally:
+                if not stop.is_set():
+                    put(done)
+
+        future = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                line = await queue.get()
+                if line is done:
+                    break
+                yield line
+        finally:
+            stop.set()
+            while not queue.empty():
+                queue.get_nowait()
+            await future
+
+
+async def search(rsidlist, idx, vcffile, header=False, found=None, gap=1000, batch_size=100000):
+    """Yield VCF records for the specified rsIDs, sorted by genomic coordinate.
+
+    This opens a single-use index handle; services running many concurrent searches should
+    share an `AsyncIndex` instead.
+    """
+    async with AsyncIndex(vcffile, idx, max_workers=1) as index:
+        async for line in index.search(rsidlist, header, found, gap, batch_size):
+            yield line
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from contextlib import closing
+import json
+import math
+import os
+import platform
+import random
+import rsidx
+from rsidx.tabix import BgzfWriter, TabixIndexBuilder
+import sqlite3
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+
+VCF_HEADER = (
+    "##fileformat=VCFv4.1\n"
+    "##source=rsidx-bench\n"
+    '##INFO=<ID=RS,Number=1,Type=Integer,Description="dbSNP ID">\n'
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+
+
+def synthetic_rsids(rng, density=0.5, block=4096):
+    """Yield an endless stream of distinct rsIDs in a dbSNP-like order.
+
+    rsIDs increase by gaps drawn from a geometric distribution with mean `1 / density`, so
+    that a fraction `density` of integers is used, as in dbSNP. Each run of `block` rsIDs is
+    shuffled, so that rsID order is not coordinate order, while memory use stays constant.
+    """
+    logq = math.log(1.0 - density) if density < 1 else None
+    rsid = 0
+    while True:
+        rsids = list()
+        for _ in range(block):
+            gap = 1 if logq is None else 1 + int(math.log(1.0 - rng.random()) / logq)
+            rsid += gap
+            rsids.append(rsid)
+        rng.shuffle(rsids)
+        yield from rsids
+
+
+def synthetic_records(nrecords, nchroms=4, density=0.5, multi_rate=0.01, seed=None):
+    """Yield (chrom, pos, rsids, ref, alt) tuples for a synthetic, sorted dbSNP-like VCF.
+
+    rsIDs are streamed from `synthetic_rsids`, so memory use does not depend on the number of
+    records. Records are spaced a few bp apart, and a fraction `multi_rate` of records carry
+    two rsIDs.
+    """
+    rng = random.Random(seed)
+    rsids = synthetic_rsids(random.Random(rng.random()), density=density)
+    perchrom = -(-nrecords // nchroms)
+    bases = "ACGT"
+    chrom, pos = None, 0
+    for n in range(nrecords):
+        if n % perchrom == 0:
+            chrom = str(n // perchrom + 1)
+            pos = 10000
+        pos += rng.randint(1, 6)
+        ids = [next(rsids)]
+        if rng.random() < multi_rate:
+            ids.append(next(rsids))
+        ref = rng.choice(bases)
+        alt = rng.choice(bases.replace(ref, ""))
+        yield chrom, pos, ids, ref, alt
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` items from a stream of unknown length."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = list()
+        self.count = 0
+
+    def add(self, item):
+        self.count += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        n = self.rng.randrange(self.count)
+        if n < self.size:
+            self.items[n] = item
+
+
+def write_synthetic_vcf(
+    filename, nrecords, nchroms=4, density=0.5, multi_rate=0.01, seed=None, nsample=1000
+):
+    """Write a bgzipped synthetic VCF and its tabix index.
+
+    Returns a uniform random sample of `nsample` of its rsIDs, drawn by reservoir sampling so
+    that memory use does not depend on the number of records.
+    """
+    builder = TabixIndexBuilder()
+    reservoir = Reservoir(nsample, random.Random(seed))
+    records = synthetic_records(nrecords, nchroms, density, multi_rate, seed)
+    with BgzfWriter(filename) as writer:
+        writer.write(VCF_HEADER.encode())
+        for chrom, pos, rsids, ref, alt in records:
+            rsidstr = ";".join("rs{:d}".format(rsid) for rsid in rsids)
+            line = "{:s}\t{:d}\t{:s}\t{:s}\t{:s}\t.\t.\tRS={:d}\n".format(
+                chrom, pos, rsidstr, ref, alt, rsids[0]
+            )
+            line = line.encode()
+            start = writer.tell()
+            writer.write(line)
+            builder.add_line(line, start, writer.tell())
+            for rsid in rsids:
+                reservoir.add(rsid)
+    builder.write(filename + ".tbi")
+    return reservoir.items
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def run(workdir, nrecords=100000, nchroms=4, nqueries=1000, density=0.5, seed=42):
+    """Run the benchmark suite in the specified directory and return the results.
+
+    Index files left in the directory by a previous run are replaced.
+    """
+    rng = random.Random(seed)
+    vcffile = os.path.join(workdir, "bench.vcf.gz")
+    idxfile = os.path.join(workdir, "bench.rsidx")
+    binfile = os.path.join(workdir, "bench.bin.rsidx")
+    for filename in (idxfile, binfile):
+        if os.path.exists(filename):
+            os.unlink(filename)
+    rsids, seconds = timed(
+        write_synthetic_vcf,
+        vcffile,
+        nrecords,
+        nchroms=nchroms,
+        density=density,
+        seed=seed,
+        nsample=nqueries,
+    )
+    results = {"generate": {"records": nrecords, "seconds": seconds}}
+
+    def build():
+        with sqlite3.connect(idxfile) as dbconn, rsidx.open(vcffile, "rb") as vcffh:
+            rsidx.index.index(dbconn, vcffh, logint=float("inf"))
+        dbconn.close()
+
+    _, seconds = timed(build)
+    results["index"] = {
+        "records": nrecords,
+        "bytes": os.path.getsize(idxfile),
+        "seconds": seconds,
+        "records_per_second": rate(nrecords, seconds),
+    }
+
+    def build_binary():
+        with rsidx.open(vcffile, "rb") as vcffh:
+            rsidx.index.index_binary(binfile, vcffh, logint=float("inf"))
+
+    _, seconds = timed(build_binary)
+    results["binary_index"] = {
+        "records": nrecords,
+        "bytes": os.path.getsize(binfile),
+        "seconds": seconds,
+        "records_per_second": rate(nrecords, seconds),
+    }
+    queries = rng.sample(rsids, len(rsids))
+    queries = ["rs{:d}".format(rsid) for rsid in queries]
+
+    def single():
+        with rsidx.RsidIndex(vcffile, idxfile, maxsize=1) as idx:
+            for rsid in queries:
+                idx.coord(rsid)
+
+    _, seconds = timed(single)
+    results["single_lookup"] = {
+        "queries": len(queries),
+        "seconds": seconds,
+        "queries_per_second": rate(len(queries), seconds),
+    }
+    with closing(rsidx.index.connect(idxfile, readonly=True)) as dbconn:
+        coords, seconds = timed(lambda: list(rsidx.search.coords(queries, dbconn)))
+        results["batch_lookup"] = {
+            "queries": len(queries),
+            "matches": len(coords),
+            "seconds": seconds,
+            "queries_per_second": rate(len(queries), seconds),
+        }
+        lines, seconds = timed(lambda: list(rsidx.search.search(queries, dbconn, vcffile)))
+        results["fetch"] = {
+            "queries": len(queries),
+            "records": len(lines),
+            "seconds": seconds,
+            "queries_per_second": rate(len(queries), seconds),
+        }
+    with rsidx.binary.BinaryIndex(binfile) as binindex:
+        coords, seconds = timed(lambda: list(rsidx.search.coords(queries, binindex)))
+        results["binary_batch_lookup"] = {
+            "queries": len(queries),
+            "matches": len(coords),
+            "seconds": seconds,
+            "queries_per_second": rate(len(queries), seconds),
+        }
+    return results
+
+
+def main(args):
+    params = dict(
+        nrecords=args.records,
+        nchroms=args.chroms,
+        nqueries=args.queries,
+        density=args.density,
+        seed=args.seed,
+    )
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run(args.workdir, **params)
+    else:
+        with TemporaryDirectory() as workdir:
+            results = run(workdir, **params)
+    report = {
+        "rsidx": rsidx.cli.get_version(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    for name, result in results.items():
+        print("[rsidx::bench]", name, "{:.3f}s".format(result["seconds"]), file=sys.stderr)
+    with rsidx.open(args.out, "w") as out:
+        json.dump(report, out, indent=2)
+        print(file=out)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from array import array
+from bisect import bisect_left, bisect_right
+import builtins
+import mmap
+import os
+import struct
+import sys
+from tempfile import TemporaryDirectory
+
+
+MAGIC = b"RSIDXBIN"
+VERSION = 2
+HEADER = struct.Struct("<8sIIQIIQ")
+SEGMENT = struct.Struct("<QQ")
+MAX_UINT32 = (1 << 32) - 1
+
+
+def write_index(filename, rows, tmpdir=None):
+    """Write (rsid, chrom, coord) rows, sorted by rsID, to a binary rsidx index.
+
+    The file consists of a fixed-size header, a table of rsID segments, three column arrays,
+    and a dictionary of chromosome names. All values are little-endian. rsIDs are split into
+    a high and a low 32-bit word: each segment records a high word and the index of its first
+    record, and the rsID column holds only the low words. The coordinate column holds 32-bit
+    coordinates, and the chromosome column holds 8-bit chromosome IDs, or 16-bit IDs if there
+    are more than 256 chromosomes. A record takes 9 bytes.
+
+    The columns are staged in temporary files in `tmpdir` while the rows are read, so memory
+    use does not depend on the number of rows.
+    """
+    chromids = dict()
+    segments = list()
+    nrecords = 0
+    with TemporaryDirectory(dir=tmpdir) as dirname:
+        columns = [os.path.join(dirname, name) for name in ("rsid", "coord", "chrom")]
+        with builtins.open(columns[0], "wb") as lofh, builtins.open(
+            columns[1], "wb"
+        ) as coordfh, builtins.open(columns[2], "wb") as chromfh:
+            buffers = (array("I"), array("I"), array("H"))
+            for rsid, chrom, coord in rows:
+                high = rsid >> 32
+                if len(segments) == 0 or segments[-1][0] != high:
+                    segments.append((high, nrecords))
+                if chrom not in chromids:
+                    if len(chromids) > 0xFFFF:
+                        raise ValueError("binary indexes support at most 65536 chromosomes")
+                    chromids[chrom] = len(chromids)
+                if not 0 <= coord <= MAX_UINT32:
+                    raise ValueError("coordinate {} does not fit in 32 bits".format(coord))
+                buffers[0].append(rsid & MAX_UINT32)
+                buffers[1].append(coord)
+                buffers[2].append(chromids[chrom])
+                nrecords += 1
+                if len(buffers[0]) >= 1 << 20:
+                    write_buffers(buffers, (lofh, coordfh, chromfh))
+            write_buffers(buffers, (lofh, coordfh, chromfh))
+        chromwidth = 1 if len(chromids) <= 256 else 2
+        with builtins.open(filename, "wb") as fh:
+            fh.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0, 0))
+            for high, start in segments:
+                fh.write(SEGMENT.pack(high, start))
+            for column in columns[:2]:
+                copy_column(column, fh, "I", "I")
+            copy_column(columns[2], fh, "H", "B" if chromwidth == 1 else "H")
+            dictoffset = fh.tell()
+            for chrom in chromids:
+                name = chrom.encode()
+                fh.write(struct.pack("<H", len(name)))
+                fh.write(name)
+            fh.seek(0)
+            fh.write(
+                HEADER.pack(
+                    MAGIC, VERSION, len(chromids), nrecords, len(segments), chromwidth, dictoffset
+                )
+            )
+    return nrecords
+
+
+def write_buffers(buffers, handles):
+    for buffer, fh in zip(buffers, handles):
+        if sys.byteorder != "little":  # pragma: no cover
+            buffer.byteswap()
+        buffer.tofile(fh)
+        del buffer[:]
+
+
+def copy_column(filename, outfh, infmt, outfmt, blocksize=1 << 20):
+    """Copy a staged little-endian column into the index, narrowing it if needed."""
+    with builtins.open(filename, "rb") as fh:
+        while True:
+            data = fh.read(blocksize)
+            if len(data) == 0:
+                break
+            if infmt != outfmt:
+                values = array(infmt, data)
+                if sys.byteorder != "little":  # pragma: no cover
+                    values.byteswap()
+                data = array(outfmt, values).tobytes()
+            outfh.write(data)
+
+
+def is_binary_index(filename):
+    with builtins.open(filename, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def column(data, fmt):
+    """Return a native sequence view of a little-endian column of fixed-width integers."""
+    if sys.byteorder == "little" or fmt == "B":
+        return data.cast(fmt)
+    values = array(fmt, data)  # pragma: no cover
+    values.byteswap()  # pragma: no cover
+    return values  # pragma: no cover
+
+
+class BinaryIndex:
+    """Memory-mapped binary rsidx index.
+
+    Lookups are binary searches over the memory-mapped rsID column, so opening an index is
+    cheap and the OS page cache is shared by all processes searching the same file. Batches of
+    sorted query rsIDs are resolved with a merge join (see `lookup`).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = builtins.open(filename, "rb")
+        self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._mmap)
+        self._views = [data]
+        try:
+            header = HEADER.unpack_from(data)
+        except struct.error:
+            header = (None, None, 0, 0, 0, 0, 0)
+        magic, version, nchroms, nrecords, nsegments, chromwidth, dictoffset = header
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('"{}" is not a binary rsidx index'.format(filename))
+        self.nrecords = nrecords
+        self.chroms = list()
+        start = HEADER.size + nsegments * SEGMENT.size
+        pos = dictoffset
+        try:
+            if chromwidth not in (1, 2) or dictoffset != start + nrecords * (8 + chromwidth):
+                raise struct.error
+            for _ in range(nchroms):
+                (length,) = struct.unpack_from("<H", data, pos)
+                self.chroms.append(bytes(data[pos + 2 : pos + 2 + length]).decode())
+                pos += 2 + length
+            if pos != len(data):
+                raise struct.error
+        except struct.error:
+            self.close()
+            raise ValueError('binary index file "{}" is incomplete'.format(filename))
+        segments = [SEGMENT.unpack_from(data, HEADER.size + i * 16) for i in range(nsegments)]
+        self.highs = [high for high, _ in segments]
+        self.starts = [first for _, first in segments] + [nrecords]
+        columns = (
+            (start, start + 4 * nrecords, "I"),
+            (start + 4 * nrecords, start + 8 * nrecords, "I"),
+            (start + 8 * nrecords, dictoffset, "B" if chromwidth == 1 else "H"),
+        )
+        self.lows, self.coords, self.chromids = [
+            self._view(data[begin:end], fmt) for begin, end, fmt in columns
+        ]
+
+    def _view(self, data, fmt):
+        self._views.append(data)
+        view = column(data, fmt)
+        if isinstance(view, memoryview):
+            self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self.__dict__.pop("_views", [])):
+            view.release()
+        for attr in ("lows", "coords", "chromids"):
+            self.__dict__.pop(attr, None)
+        self._mmap.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.nrecords
+
+    def segment(self, high):
+        """Return the (start, end) record range of the rsIDs with the specified high word."""
+        i = bisect_left(self.highs, high)
+        if i < len(self.highs) and self.highs[i] == high:
+            return self.starts[i], self.starts[i + 1]
+        return 0, 0
+
+    def rsid(self, i):
+        """Return the rsID of the i-th record."""
+        high = self.highs[bisect_right(self.starts, i) - 1]
+        return high << 32 | self.lows[i]
+
+    def max_rsid(self):
+        return self.rsid(self.nrecords - 1) if self.nrecords > 0 else 0
+
+    def iter_rsids(self):
+        """Yield all rsIDs in the index in ascending order."""
+        for high, start, end in zip(self.highs, self.starts, self.starts[1:]):
+            base = high << 32
+            if base == 0:
+                yield from self.lows[start:end]
+            else:
+                yield from (base | low for low in self.lows[start:end])
+
+    def get(self, rsid):
+        """Return the (chrom, coord) of the specified rsID, or None if it is not indexed."""
+        lo, hi = self.segment(rsid >> 32)
+        low = rsid & MAX_UINT32
+        i = bisect_left(self.lows, low, lo, hi)
+        if i < hi and self.lows[i] == low:
+            return self.chroms[self.chromids[i]], self.coords[i]
+        return None
+
+    def lookup(self, rsids, outer=False):
+        """Yield (rsid, chrom, coord) for each indexed rsID in an ascending sequence of rsIDs.
+
+        This is a merge join of the sorted query against the sorted rsID column: each binary
+        search starts where the previous one ended, so that a batch of queries reads each
+        page of the column at most once. If `outer` is true, rsIDs that are not indexed are
+        also yielded, with a chrom and coord of None.
+        """
+        lows, coords, chromids, chroms = self.lows, self.coords, self.chromids, self.chroms
+        high, lo, hi = None, 0, 0
+        for rsid in rsids:
+            if rsid >> 32 != high:
+                high = rsid >> 32
+                lo, hi = self.segment(high)
+            low = rsid & MAX_UINT32
+            lo = bisect_left(lows, low, lo, hi)
+            if lo < hi and lows[lo] == low:
+                yield rsid, chroms[chromids[lo]], coords[lo]
+            elif outer:
+                yield rsid, None, None
+
+    def rows(self):
+        """Yield all (rsid, chrom, coord) rows in the index."""
+        chroms = self.chroms
+        return zip(self.iter_rsids(), (chroms[i] for i in self.chromids), self.coords)
@@ -9,10 +9,17 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from functools import lru_cache
 from importlib.metadata import version
 import rsidx
 
 
+@lru_cache(maxsize=None)
+def get_version():
+    """Return the installed rsidx version; the package metadata is only read once."""
+    return version("rsidx")
+
+
 def index_subparser(subparsers):
     cli = subparsers.add_parser("index")
     cli.add_argument(
@@ -35,18 +42,246 @@ def index_subparser(subparsers):
         metavar="M",
         help="activate sqlite3 " "memory map mode and specify mmap_size (in bytes)",
     )
-    cli.add_argument("vcf", help="sorted VCF file to index")
+    cli.add_argument(
+        "--format",
+        choices=["sqlite", "bin"],
+        default="sqlite",
+        help="index file format; the compact binary format is smaller and faster to search, "
+        "and is always built in bulk mode; default is sqlite",
+    )
+    cli.add_argument(
+        "-b",
+        "--bulk",
+        action="store_true",
+        help="presort records by rsID and load the index in a single pass; recommended for "
+        "very large VCF files",
+    )
+    cli.add_argument(
+        "--buffer-size",
+        type=int,
+        metavar="B",
+        default=10000000,
+        help="in bulk mode, sort records in memory in runs of B records, spilling each run to a "
+        "temporary file; default is 10000000",
+    )
+    cli.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        metavar="N",
+        default=1,
+        help="index a bgzipped and tabix-indexed VCF file, or multiple VCF files, using N "
+        "worker processes; in bulk mode, for binary indexes, or if the VCF has no tabix "
+        "index, decompress a bgzipped VCF file using N threads; default is 1",
+    )
+    cli.add_argument(
+        "--stats",
+        choices=["json", "text"],
+        help="when finished, print counts and the time spent in each stage of the build to "
+        "stderr, as a JSON object or as text",
+    )
+    cli.add_argument(
+        "--reverse",
+        action="store_true",
+        help="index rsIDs by genomic coordinate once the index is loaded, for fast reverse "
+        "lookups with rsidx lookup; not supported for binary indexes",
+    )
+    cli.add_argument(
+        "--merges",
+        metavar="FILE",
+        help="load a merge history FILE of old and current rsIDs (two whitespace-separated "
+        "columns), so that searches for merged rsIDs return the records of their current "
+        "rsIDs; not supported for binary indexes",
+    )
+    cli.add_argument(
+        "--presence",
+        action="store_true",
+        help="build a presence filter alongside the index, so that searches skip query rsIDs "
+        "that are not indexed without probing the index",
+    )
+    cli.add_argument(
+        "--offsets",
+        action="store_true",
+        help="record the BGZF virtual file offset of each rsID's record, so that searches seek "
+        "directly to each record without querying the tabix index; requires a single bgzipped "
+        "VCF file and is not supported for binary indexes or in bulk mode",
+    )
+    cli.add_argument(
+        "--checkpoint",
+        type=int,
+        metavar="N",
+        help="commit the index and record a checkpoint every N rsIDs, so that an interrupted "
+        "build can be resumed with --resume; the VCF is read on a single thread",
+    )
+    cli.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted checkpointed build of the index from its last checkpoint; "
+        "if the index does not exist, start a checkpointed build (every 1000000 rsIDs by "
+        "default)",
+    )
+    cli.add_argument(
+        "--tmpdir",
+        metavar="DIR",
+        help="write temporary files (bulk mode runs, parallel mode shards) to DIR; default is the "
+        "system temp directory",
+    )
+    cli.add_argument(
+        "vcf",
+        nargs="+",
+        help="sorted VCF file to index; multiple VCF files (such as one per chromosome) can be "
+        "indexed together and searched as if they were a single file",
+    )
     cli.add_argument("idx", help="index file to create")
 
 
+def update_subparser(subparsers):
+    cli = subparsers.add_parser("update")
+    cli.add_argument(
+        "-p",
+        "--policy",
+        choices=rsidx.index.POLICIES,
+        default="keep-old",
+        help="policy for rsIDs already indexed at a different coordinate: keep the indexed "
+        "coordinate, take the new coordinate, or record both; default is keep-old",
+    )
+    cli.add_argument(
+        "-r",
+        "--region",
+        metavar="REG",
+        help="add only records in the region REG (such as chr1:1000-2000) of a bgzipped and "
+        "tabix-indexed VCF file",
+    )
+    cli.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="update the index even if the VCF file is unchanged since it was indexed",
+    )
+    cli.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        metavar="N",
+        default=1,
+        help="decompress a bgzipped VCF file using N threads; default is 1",
+    )
+    cli.add_argument("vcf", help="sorted VCF file with records to add")
+    cli.add_argument("idx", help="existing index file to update")
+
+
+def lookup_subparser(subparsers):
+    cli = subparsers.add_parser("lookup")
+    cli.add_argument(
+        "-o",
+        "--out",
+        metavar="FILE",
+        help="write output to specified FILE; default is terminal (stdout)",
+    )
+    cli.add_argument(
+        "-r",
+        "--region",
+        metavar="REG",
+        action="append",
+        default=list(),
+        help="report rsIDs in the region REG, such as chr1:1000-2000, or chr1:1000-1000 for a "
+        "single position; can be specified multiple times",
+    )
+    cli.add_argument(
+        "--bed",
+        metavar="FILE",
+        help="report rsIDs in the regions of the specified BED FILE",
+    )
+    cli.add_argument("idx", help="rsidx index file")
+
+
+def bench_subparser(subparsers):
+    cli = subparsers.add_parser("bench")
+    cli.add_argument(
+        "-o",
+        "--out",
+        metavar="FILE",
+        help="write JSON results to specified FILE; default is terminal (stdout)",
+    )
+    cli.add_argument(
+        "-n",
+        "--records",
+        type=int,
+        metavar="N",
+        default=100000,
+        help="number of records in the synthetic VCF; default is 100000",
+    )
+    cli.add_argument(
+        "--chroms",
+        type=int,
+        metavar="C",
+        default=4,
+        help="number of chromosomes in the synthetic VCF; default is 4",
+    )
+    cli.add_argument(
+        "-q",
+        "--queries",
+        type=int,
+        metavar="Q",
+        default=1000,
+        help="number of rsIDs to look up and fetch; default is 1000",
+    )
+    cli.add_argument(
+        "--density",
+        type=float,
+        metavar="D",
+        default=0.5,
+        help="fraction of the rsID integer space used by the synthetic VCF; default is 0.5",
+    )
+    cli.add_argument(
+        "--seed",
+        type=int,
+        metavar="S",
+        default=42,
+        help="random seed for the synthetic VCF and queries; default is 42",
+    )
+    cli.add_argument(
+        "--workdir",
+        metavar="DIR",
+        help="write the synthetic VCF and index to DIR and keep them; by default they are "
+        "written to a temporary directory",
+    )
+
+
 def search_subparser(subparsers):
     cli = subparsers.add_parser("search")
     cli.add_argument("--header", action="store_true", help="print VCF headers")
+    cli.add_argument(
+        "--stats",
+        choices=["json", "text"],
+        help="when finished, print counts and the time spent in each stage of the search "
+        "(loading query rsIDs, index lookups, VCF fetches) to stderr, as a JSON object or as "
+        "text",
+    )
+    cli.add_argument(
+        "--coords-only",
+        action="store_true",
+        help="report the indexed coordinate of each rsID, without reading the VCF",
+    )
+    cli.add_argument(
+        "--coords-format",
+        choices=["tsv", "bed"],
+        default="tsv",
+        help="with --coords-only, print rsID, chromosome, and position as tab-separated values, "
+        "or print BED intervals; default is tsv",
+    )
     cli.add_argument(
         "-o",
         "--out",
         metavar="FILE",
-        help="write output to specified FILE; " "default is terminal (stdout)",
+        help="write output to specified FILE; a FILE ending in .gz is written in BGZF format; "
+        "default is terminal (stdout)",
+    )
+    cli.add_argument(
+        "--tabix",
+        action="store_true",
+        help="with --out FILE.gz, also write the tabix index FILE.gz.tbi in the same pass, so "
+        "that the output can be queried immediately",
     )
     cli.add_argument(
         "--file",
@@ -54,19 +289,151 @@ def search_subparser(subparsers):
         help="rsIDs are provided in a text file, one per line, "
         "rather than as command line arguments",
     )
-    cli.add_argument("vcf", help="sorted and indexed VCF file")
+    cli.add_argument(
+        "-g",
+        "--gap",
+        type=int,
+        metavar="G",
+        default=1000,
+        help="merge query coordinates within G bp of each other into a single region when "
+        "fetching records from the VCF; default is 1000",
+    )
+    cli.add_argument(
+        "-c",
+        "--cache-size",
+        type=int,
+        metavar="C",
+        help="modify default " "sqlite3 cache size (in KiB)",
+    )
+    cli.add_argument(
+        "-m",
+        "--mmap-size",
+        type=int,
+        metavar="M",
+        help="activate sqlite3 " "memory map mode and specify mmap_size (in bytes)",
+    )
+    cli.add_argument(
+        "--immutable",
+        action="store_true",
+        help="open the index as immutable, without file locking; use only if the index will "
+        "not be modified during the search",
+    )
+    cli.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        metavar="N",
+        default=100000,
+        help="resolve rsIDs and fetch VCF records in batches of N coordinates; memory use is "
+        "bounded by the batch size rather than the number of query rsIDs; default is 100000",
+    )
+    cli.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        metavar="N",
+        default=4,
+        help="for an index of multiple VCF files, fetch records from up to N files at a time; "
+        "compress .gz output on N threads; default is 4",
+    )
+    cli.add_argument(
+        "--aliases",
+        metavar="FILE",
+        help="write query rsIDs that were resolved through the index's merge history, and the "
+        "current rsIDs they were merged into, to FILE as tab-separated values",
+    )
+    cli.add_argument(
+        "--server",
+        metavar="ADDR",
+        help="forward the search to a running rsidx serve daemon at ADDR (unix:PATH or "
+        "HOST:PORT) that serves the index; --gap, --batch-size, --threads, and the index "
+        "options are ignored",
+    )
+    cli.add_argument(
+        "vcf",
+        help="sorted and indexed VCF file; for an index of multiple VCF files, the directory "
+        "containing the VCF files, or - to use the paths recorded in the index",
+    )
     cli.add_argument("idx", help="rsidx index file")
     cli.add_argument("rsid", nargs="+", help="rsID(s) to search")
 
 
+def serve_subparser(subparsers):
+    cli = subparsers.add_parser("serve")
+    cli.add_argument(
+        "-d",
+        "--dataset",
+        nargs=2,
+        action="append",
+        required=True,
+        metavar=("VCF", "IDX"),
+        help="serve searches of the specified VCF file and rsidx index; can be specified "
+        "multiple times",
+    )
+    cli.add_argument(
+        "-l",
+        "--listen",
+        metavar="ADDR",
+        default="127.0.0.1:8877",
+        help="listen on a Unix socket (unix:PATH) or a TCP address (HOST:PORT); default is "
+        "127.0.0.1:8877",
+    )
+    cli.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        metavar="N",
+        default=8,
+        help="keep up to N open connections to each index, answering up to N requests per "
+        "index concurrently; default is 8",
+    )
+    cli.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        metavar="N",
+        default=4,
+        help="for an index of multiple VCF files, fetch records from up to N files at a time; "
+        "default is 4",
+    )
+    cli.add_argument(
+        "-c",
+        "--cache-size",
+        type=int,
+        metavar="C",
+        help="modify default " "sqlite3 cache size (in KiB)",
+    )
+    cli.add_argument(
+        "-m",
+        "--mmap-size",
+        type=int,
+        metavar="M",
+        help="activate sqlite3 " "memory map mode and specify mmap_size (in bytes)",
+    )
+    cli.add_argument(
+        "--immutable",
+        action="store_true",
+        help="open the indexes as immutable, without file locking; use only if the indexes "
+        "will not be modified while the daemon is running",
+    )
+
+
 mains = {
     "index": rsidx.index.main,
     "search": rsidx.search.main,
+    "update": rsidx.index.update_main,
+    "lookup": rsidx.reverse.main,
+    "bench": rsidx.bench.main,
+    "serve": rsidx.serve.main,
 }
 
 subparser_funcs = {
     "index": index_subparser,
     "search": search_subparser,
+    "update": update_subparser,
+    "lookup": lookup_subparser,
+    "bench": bench_subparser,
+    "serve": serve_subparser,
 }
 
 
@@ -92,7 +459,7 @@ usage instructions.
     parser._positionals.title = "Subcommands"
     parser._optionals.title = "Global arguments"
     parser.add_argument(
-        "-v", "--version", action="version", version="rsidx v{}".format(version("rsidx"))
+        "-v", "--version", action="version", version="rsidx v{}".format(get_version())
     )
     subparsers = parser.add_subparsers(dest="subcmd", metavar="subcmd", help=subcommandstr)
     for func in subparser_funcs.values():
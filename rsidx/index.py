@@ -7,49 +7,963 @@
 # and is licensed under the BSD license: see LICENSE.txt.
 # -----------------------------------------------------------------------------
 
+import builtins
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import hashlib
+from heapq import merge
+import io
+from itertools import chain, islice
 import os
 import rsidx
+from rsidx.binary import BinaryIndex, is_binary_index, write_index
+from rsidx.metrics import Metrics, report_progress
+from rsidx.presence import build_presence, presence_file
+from rsidx.tabix import BgzfReader, TabixFile, TabixIndex, is_bgzf, parse_region
 import sqlite3
 import sys
+from tempfile import TemporaryDirectory
+import time
+from urllib.parse import quote
 
 
-def parse_vcf(vcfstream, updateint=1e6):
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+def connect(
+    idxfile,
+    readonly=False,
+    immutable=False,
+    cache_size=None,
+    mmap_size=None,
+    check_same_thread=True,
+):
+    """Open a connection to an rsidx index database.
+
+    Read-only connections (`mode=ro`) take no write locks, and immutable connections
+    (`immutable=1`) take no locks at all and skip change detection, so that many processes
+    can search the same index concurrently and share the OS page cache. An immutable
+    connection must only be used with an index that will not be modified while it is open.
+    The `cache_size` is in KiB, and the `mmap_size` is in bytes. See `sqlite3.connect` for a
+    description of `check_same_thread`.
+
+    If the file is a binary rsidx index, it is memory-mapped and a BinaryIndex is returned.
+    """
+    if os.path.isfile(idxfile) and is_binary_index(idxfile):
+        return BinaryIndex(idxfile)
+    if readonly or immutable:
+        params = "mode=ro&immutable=1" if immutable else "mode=ro"
+        uri = "file:{:s}?{:s}".format(quote(os.path.abspath(idxfile)), params)
+        dbconn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        dbconn = sqlite3.connect(idxfile, check_same_thread=check_same_thread)
+    if cache_size:
+        dbconn.execute("PRAGMA cache_size = -{:d}".format(cache_size))
+    if mmap_size:
+        dbconn.execute("PRAGMA mmap_size = {:d}".format(mmap_size))  # bytes
+    return dbconn
+
+
+BASELINE_COLUMNS = ["rsid", "chrom", "coord"]
+
+
+def table_columns(dbconn, table="rsid_to_coord"):
+    return [row[1] for row in dbconn.execute("PRAGMA table_info({:s})".format(table))]
+
+
+def check_index(idxfile):
+    """Raise a ValueError unless the specified file is a finalized rsidx index."""
+    if not os.path.isfile(idxfile):
+        raise ValueError('index file "{}" does not exist'.format(idxfile))
+    with builtins.open(idxfile, "rb") as fh:
+        magic = fh.read(len(SQLITE_MAGIC))
+    if is_binary_index(idxfile):
+        BinaryIndex(idxfile).close()
+        return
+    if magic != SQLITE_MAGIC:
+        raise ValueError('"{}" is not an rsidx index'.format(idxfile))
+    for suffix in ("-journal", "-wal"):
+        if os.path.exists(idxfile + suffix):
+            message = 'index file "{}" is incomplete or is being modified'.format(idxfile)
+            raise ValueError(message)
+    dbconn = connect(idxfile, readonly=True)
+    try:
+        tables = set(name for (name,) in dbconn.execute("SELECT name FROM sqlite_master"))
+        if "rsid_to_coord" not in tables:
+            raise ValueError('"{}" is not an rsidx index'.format(idxfile))
+        if "rsidx_meta" in tables:
+            query = "SELECT value FROM rsidx_meta WHERE key = 'complete'"
+            result = dbconn.execute(query).fetchone()
+            if result is None or result[0] != "1":
+                raise ValueError('index file "{}" is incomplete'.format(idxfile))
+        elif tables != {"rsid_to_coord"} or table_columns(dbconn) != BASELINE_COLUMNS:
+            # Indexes built before the completion flag have only the bare index table
+            raise ValueError('index file "{}" is incomplete'.format(idxfile))
+    finally:
+        dbconn.close()
+
+
+def finalize(dbconn, complete=True):
+    """Mark an index as complete, or as incomplete while it is being modified."""
+    c = dbconn.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS rsidx_meta (key TEXT PRIMARY KEY, value TEXT)")
+    c.execute(
+        "INSERT OR REPLACE INTO rsidx_meta VALUES ('complete', ?)", ("1" if complete else "0",)
+    )
+    dbconn.commit()
+
+
+def create_coord_index(dbconn):
+    """Index the rows of an index by (chrom, coord) for reverse lookups.
+
+    Building the secondary index after the rows are loaded is much faster than maintaining
+    it during the load.
+    """
+    dbconn.execute("CREATE INDEX IF NOT EXISTS rsid_by_coord ON rsid_to_coord (chrom, coord)")
+    dbconn.commit()
+
+
+def read_merges(instream):
+    """Yield (old, current) rsID pairs from a merge history file.
+
+    Each line has the old rsID and the rsID it was merged into, separated by whitespace,
+    with or without the "rs" prefix; any further columns are ignored, as are blank lines and
+    lines beginning with "#".
+    """
+    for line in instream:
+        if line.startswith("#") or line.strip() == "":
+            continue
+        values = line.split(None, 2)
+        try:
+            old, current = [
+                int(value[2:] if value.startswith("rs") else value) for value in values[:2]
+            ]
+        except ValueError:
+            raise ValueError('invalid merge history line "{}"'.format(line.rstrip()))
+        yield old, current
+
+
+def load_merges(dbconn, instream, maxdepth=64):
+    """Load a merge history file into the `rsid_merges` table of an index.
+
+    Chains of merges are collapsed so that each old rsID maps directly to its current rsID,
+    and searches resolve merged rsIDs with a single lookup. Merges that form a cycle, or a
+    chain longer than `maxdepth`, are dropped with a warning. Returns the number of old rsIDs
+    in the table.
+
+    The table is loaded in a single transaction, committed with the completion flag (see
+    `finalize`), so an invalid merge history file leaves the index unchanged.
+    """
+    c = dbconn.cursor()
+    if not dbconn.in_transaction:
+        c.execute("BEGIN")
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS rsid_merges ("
+        "old INTEGER PRIMARY KEY, current INTEGER NOT NULL)"
+    )
+    try:
+        c.executemany("INSERT OR REPLACE INTO rsid_merges VALUES (?,?)", read_merges(instream))
+    except ValueError:
+        dbconn.rollback()
+        raise
+    c.execute("DELETE FROM rsid_merges WHERE old = current")
+    collapse = (
+        "UPDATE rsid_merges SET current = "
+        "(SELECT m.current FROM rsid_merges AS m WHERE m.old = rsid_merges.current) "
+        "WHERE current IN (SELECT old FROM rsid_merges)"
+    )
+    for depth in range(maxdepth):
+        if c.execute(collapse).rowcount == 0:
+            break
+    unresolved = c.execute(
+        "SELECT m.old FROM rsid_merges AS m JOIN rsid_merges AS n ON n.old = m.current"
+    ).fetchall()
+    c.executemany("DELETE FROM rsid_merges WHERE old = ?", unresolved)
+    if len(unresolved) > 0:
+        message = "dropped {:d} merged rsIDs with circular merge histories".format(len(unresolved))
+        print("[rsidx::index] WARNING:", message, file=sys.stderr)
+    c.execute("DELETE FROM rsid_merges WHERE old = current")
+    (nmerges,) = c.execute("SELECT COUNT(*) FROM rsid_merges").fetchone()
+    finalize(dbconn)
+    return nmerges
+
+
+def checksum(filename, blocksize=1 << 20):
+    md5 = hashlib.md5()
+    with builtins.open(filename, "rb") as fh:
+        for block in iter(lambda: fh.read(blocksize), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def file_metadata(vcffile, checksums=True):
+    """Return the path, size, mtime, and checksums of a VCF file and its tabix index.
+
+    Checksums require a full pass over the file; with `checksums=False` they are None.
+    """
+    tbifile = vcffile + ".tbi"
+    stat = os.stat(vcffile)
+    path = os.path.abspath(vcffile)
+    if not checksums:
+        return path, stat.st_size, stat.st_mtime, None, None
+    tbisum = checksum(tbifile) if os.path.exists(tbifile) else None
+    return path, stat.st_size, stat.st_mtime, checksum(vcffile), tbisum
+
+
+def create_sources_table(dbconn):
+    dbconn.execute(
+        "CREATE TABLE IF NOT EXISTS rsidx_sources ("
+        "path TEXT PRIMARY KEY, "
+        "size INTEGER, "
+        "mtime REAL, "
+        "vcf_md5 TEXT, "
+        "tbi_md5 TEXT)"
+    )
+
+
+def record_source(dbconn, vcffile, checksums=False):
+    """Record the metadata of a VCF file that has been added to the index.
+
+    Index builds record only the size and mtime of the file; `rsidx update` also records
+    checksums, so that a copy of an indexed file can be recognized by its content.
+    """
+    create_sources_table(dbconn)
+    dbconn.execute(
+        "INSERT OR REPLACE INTO rsidx_sources VALUES (?,?,?,?,?)",
+        file_metadata(vcffile, checksums=checksums),
+    )
+    dbconn.commit()
+
+
+def source_unchanged(dbconn, vcffile):
+    """Determine whether a VCF file has already been added to the index.
+
+    The size and mtime of the file are compared first. The checksums of the VCF file and its
+    tabix index are computed only if they differ from what was recorded, and a file of the
+    same size was recorded with checksums.
+    """
+    create_sources_table(dbconn)
+    path = os.path.abspath(vcffile)
+    stat = os.stat(vcffile)
+    query = "SELECT size, mtime FROM rsidx_sources WHERE path = ?"
+    if dbconn.execute(query, (path,)).fetchone() == (stat.st_size, stat.st_mtime):
+        return True
+    query = "SELECT 1 FROM rsidx_sources WHERE size = ? AND vcf_md5 IS NOT NULL"
+    if dbconn.execute(query, (stat.st_size,)).fetchone() is None:
+        return False
+    path, size, mtime, vcfsum, tbisum = file_metadata(vcffile)
+    query = "SELECT 1 FROM rsidx_sources WHERE size = ? AND vcf_md5 = ? AND tbi_md5 IS ?"
+    return dbconn.execute(query, (size, vcfsum, tbisum)).fetchone() is not None
+
+
+def progress_event(nvariants, nrows, nbytes, starttime, done=False):
+    return {
+        "variants": nvariants,
+        "rsids": nrows,
+        "bytes": nbytes,
+        "elapsed": time.perf_counter() - starttime,
+        "done": done,
+    }
+
+
+def parse_vcf(vcfstream, updateint=1e6, on_progress=report_progress):
+    """Parse VCF lines, yielding (rsid, chrom, coord) rows.
+
+    A progress event (see `rsidx.metrics.Metrics`) is passed to `on_progress` every
+    `updateint` lines and when parsing is complete.
+    """
     threshold = updateint
+    starttime = time.perf_counter()
+    nrows = 0
+    nbytes = 0
+    n = -1
     for n, line in enumerate(vcfstream):
+        nbytes += len(line)
         if line.startswith("#"):
             continue
         chromstr, posstr, rsids, *values = line.split("\t")
         for rsid in rsids.split(";"):
             if not rsid.startswith("rs"):
                 continue
+            nrows += 1
             yield int(rsid[2:]), chromstr, int(posstr)
         if n >= threshold:
             threshold += updateint
             if threshold == updateint * 10:
                 updateint = threshold
-            print("[rsidx::index] processed", n, "variants", file=sys.stderr)
+            on_progress(progress_event(n, nrows, nbytes, starttime))
+    on_progress(progress_event(n + 1, nrows, nbytes, starttime, done=True))
+
+
+def read_buffers(vcfstream, bufsize=1 << 22):
+    """Yield lists of complete lines read from a binary stream in large buffers."""
+    remainder = b""
+    while True:
+        buffer = vcfstream.read(bufsize)
+        if not buffer:
+            break
+        lines = (remainder + buffer).split(b"\n")
+        remainder = lines.pop()
+        yield lines
+    if remainder:
+        yield [remainder]
+
 
+def parse_vcf_bytes(
+    vcfstream, updateint=1e6, batch_size=10000, bufsize=1 << 22, on_progress=report_progress
+):
+    """Parse a binary VCF stream, yielding lists of (rsid, chrom, coord) rows.
 
-def index(dbconn, vcffh, cache_size=None, mmap_size=None, logint=1e6):
+    This is a faster alternative to `parse_vcf`. The stream is read in large buffers, lines
+    are not decoded, and only the CHROM, POS, and ID columns are split from each line. Rows
+    are yielded in batches of approximately `batch_size` for use with `executemany`.
+    """
+    threshold = updateint
+    starttime = time.perf_counter()
+    chroms = dict()
+    batch = list()
+    n = -1
+    nrows = 0
+    nbytes = 0
+    for lines in read_buffers(vcfstream, bufsize=bufsize):
+        nbytes += sum(map(len, lines)) + len(lines)
+        for line in lines:
+            n += 1
+            if line.startswith(b"#"):
+                continue
+            chrombytes, posbytes, rsids = line.split(b"\t", 3)[:3]
+            chrom = chroms.get(chrombytes)
+            if chrom is None:
+                chrom = chroms.setdefault(chrombytes, chrombytes.decode())
+            for rsid in rsids.split(b";"):
+                if rsid.startswith(b"rs"):
+                    batch.append((int(rsid[2:]), chrom, int(posbytes)))
+            if n >= threshold:
+                threshold += updateint
+                if threshold == updateint * 10:
+                    updateint = threshold
+                on_progress(progress_event(n, nrows + len(batch), nbytes, starttime))
+        if len(batch) >= batch_size:
+            nrows += len(batch)
+            yield batch
+            batch = list()
+    nrows += len(batch)
+    if len(batch) > 0:
+        yield batch
+    on_progress(progress_event(n + 1, nrows, nbytes, starttime, done=True))
+
+
+def parse_vcf_offsets(vcflines, updateint=1e6, on_progress=report_progress):
+    """Parse (virtual offset, line) pairs, yielding (rsid, chrom, coord, voffset) rows.
+
+    The pairs are those of `rsidx.tabix.BgzfReader.offset_lines`, so that each row records
+    the BGZF virtual file offset of the record it was parsed from.
+    """
+    threshold = updateint
+    starttime = time.perf_counter()
+    chroms = dict()
+    nrows = 0
+    nbytes = 0
+    n = -1
+    for n, (vo, line) in enumerate(vcflines):
+        nbytes += len(line)
+        if line.startswith(b"#"):
+            continue
+        chrombytes, posbytes, rsids = line.split(b"\t", 3)[:3]
+        chrom = chroms.get(chrombytes)
+        if chrom is None:
+            chrom = chroms.setdefault(chrombytes, chrombytes.decode())
+        for rsid in rsids.split(b";"):
+            if rsid.startswith(b"rs"):
+                nrows += 1
+                yield int(rsid[2:]), chrom, int(posbytes), vo
+        if n >= threshold:
+            threshold += updateint
+            if threshold == updateint * 10:
+                updateint = threshold
+            on_progress(progress_event(n, nrows, nbytes, starttime))
+    on_progress(progress_event(n + 1, nrows, nbytes, starttime, done=True))
+
+
+def parse(vcffh, updateint=1e6, metrics=None):
+    """Parse a VCF file handle or an iterable of lines.
+
+    The fast bytes-level parser is used if the file handle is in binary mode. If `metrics`
+    is given, progress events are passed to it and parsing time is recorded as "parse".
+    """
+    on_progress = report_progress if metrics is None else metrics.progress
+    if isinstance(vcffh, io.TextIOBase) or not hasattr(vcffh, "read"):
+        rows = parse_vcf(vcffh, updateint=updateint, on_progress=on_progress)
+        return rows if metrics is None else metrics.timed(rows, "parse")
+    batches = parse_vcf_bytes(vcffh, updateint=updateint, on_progress=on_progress)
+    if metrics is not None:
+        batches = metrics.timed(batches, "parse")
+    return chain.from_iterable(batches)
+
+
+def write_run(rows, dirname, runnum):
+    runfile = os.path.join(dirname, "run{:d}.tsv".format(runnum))
+    with open(runfile, "w") as fh:
+        for rsid, chrom, coord in rows:
+            print(rsid, chrom, coord, sep="\t", file=fh)
+    return runfile
+
+
+def read_run(runfile):
+    with open(runfile, "r") as fh:
+        for line in fh:
+            rsid, chrom, coord = line.rstrip("\n").split("\t")
+            yield int(rsid), chrom, int(coord)
+
+
+def sort_rows(rows, dirname, buffer_size=1e7):
+    """Sort (rsid, chrom, coord) rows by rsID, keeping the first occurrence of each rsID.
+
+    Rows are sorted in memory in runs of `buffer_size` rows. If the input does not fit in a
+    single run, each sorted run is spilled to a temporary file in `dirname` and the runs are
+    merged. Sorting is stable and runs are merged in input order, so when an rsID occurs more
+    than once the row that appeared first in the input is the one retained.
+    """
+    rows = iter(rows)
+    runs = list()
+    while True:
+        run = list(islice(rows, int(buffer_size)))
+        if len(run) == 0:
+            break
+        run.sort(key=lambda row: row[0])
+        runs.append(run)
+        if len(run) < buffer_size:
+            break
+        runs[-1] = write_run(run, dirname, len(runs))
+    runs = [read_run(run) if isinstance(run, str) else run for run in runs]
+    lastrsid = None
+    for row in merge(*runs, key=lambda row: row[0]):
+        if row[0] == lastrsid:
+            continue
+        lastrsid = row[0]
+        yield row
+
+
+def bulk_load(dbconn, rows, buffer_size=1e7, tmpdir=None):
+    """Load rows into the index table in ascending rsID order in a single transaction."""
+    c = dbconn.cursor()
+    c.execute("PRAGMA journal_mode = OFF")
+    c.execute("PRAGMA synchronous = OFF")
+    with TemporaryDirectory(dir=tmpdir) as dirname:
+        sortedrows = sort_rows(rows, dirname, buffer_size=buffer_size)
+        c.executemany("INSERT INTO rsid_to_coord VALUES (?,?,?)", sortedrows)
+        dbconn.commit()
+
+
+def create_table(dbconn, cache_size=None, mmap_size=None, sources=False, offsets=False):
+    """Create the index table, marked as incomplete in the same transaction.
+
+    Every build calls `finalize` once it is done, so `check_index` refuses a partially built
+    index whatever the build mode.
+    """
     c = dbconn.cursor()
+    extra = ""
+    if sources:
+        extra += ", source INTEGER NOT NULL DEFAULT 0"
+    if offsets:
+        extra += ", voffset INTEGER NULL DEFAULT NULL"
+    if cache_size:
+        c.execute("PRAGMA cache_size = -{:d}".format(cache_size))
+    if mmap_size:
+        c.execute("PRAGMA mmap_size = {:d}".format(mmap_size))  # bytes
+    if not dbconn.in_transaction:
+        c.execute("BEGIN")
     c.execute(
         "CREATE TABLE rsid_to_coord ("
         "rsid INTEGER PRIMARY KEY, "
         "chrom TEXT NULL DEFAULT NULL, "
-        "coord INTEGER NOT NULL DEFAULT 0)"
+        "coord INTEGER NOT NULL DEFAULT 0{:s})".format(extra)
     )
+    if sources:
+        c.execute("CREATE TABLE rsidx_files (id INTEGER PRIMARY KEY, path TEXT NOT NULL)")
+    finalize(dbconn, complete=False)
+    return c
+
+
+def index(
+    dbconn,
+    vcffh,
+    cache_size=None,
+    mmap_size=None,
+    logint=1e6,
+    bulk=False,
+    buffer_size=1e7,
+    tmpdir=None,
+    metrics=None,
+):
+    """Index a VCF file.
+
+    If `metrics` (a `rsidx.metrics.Metrics` object) is given, the number of variants, rsIDs,
+    and bytes parsed and the time spent parsing, inserting, committing, and finalizing are
+    recorded in it.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    c = create_table(dbconn, cache_size=cache_size, mmap_size=mmap_size)
+    vcfstream = parse(vcffh, updateint=logint, metrics=metrics)
+    starttime = time.perf_counter()
+    if bulk:
+        bulk_load(dbconn, vcfstream, buffer_size=buffer_size, tmpdir=tmpdir)
+    else:
+        c.executemany("INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?)", vcfstream)
+    elapsed = time.perf_counter() - starttime
+    metrics.add_time("insert", elapsed - metrics.timings.get("parse", 0.0))
+    with metrics.timer("commit"):
+        dbconn.commit()
+    with metrics.timer("finalize"):
+        finalize(dbconn)
+
+
+def index_offsets(dbconn, vcffile, cache_size=None, mmap_size=None, logint=1e6, metrics=None):
+    """Index a bgzipped VCF file, recording the virtual file offset of each rsID's record.
+
+    With offsets in the index, searches seek directly to each record rather than querying
+    the tabix index and scanning the overlapping BGZF chunks.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    c = create_table(dbconn, cache_size=cache_size, mmap_size=mmap_size, offsets=True)
+    with BgzfReader(vcffile) as reader:
+        rows = parse_vcf_offsets(
+            reader.offset_lines(), updateint=logint, on_progress=metrics.progress
+        )
+        starttime = time.perf_counter()
+        c.executemany(
+            "INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?,?)", metrics.timed(rows, "parse")
+        )
+        elapsed = time.perf_counter() - starttime
+    metrics.add_time("insert", elapsed - metrics.timings.get("parse", 0.0))
+    with metrics.timer("commit"):
+        dbconn.commit()
+    with metrics.timer("finalize"):
+        finalize(dbconn)
+
+
+def has_table(dbconn, table):
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return dbconn.execute(query, (table,)).fetchone() is not None
+
+
+def read_checkpoint(dbconn, vcffile):
+    """Return whether the build records offsets and the position of the last line indexed.
+
+    Raises a ValueError if the index has no checkpoint or if the VCF file has changed.
+    """
+    if not has_table(dbconn, "rsidx_checkpoint"):
+        raise ValueError("index has no checkpoint to resume from")
+    query = "SELECT path, size, mtime, offsets, position FROM rsidx_checkpoint"
+    path, size, mtime, offsets, position = dbconn.execute(query).fetchone()
+    stat = os.stat(vcffile)
+    if (path, size, mtime) != (os.path.abspath(vcffile), stat.st_size, stat.st_mtime):
+        message = 'VCF file "{}" is not the file, or has changed since, the build was started'
+        raise ValueError(message.format(vcffile))
+    return bool(offsets), position
+
+
+def resume_lines(vcffile, position=None):
+    """Yield (position, line) pairs for the lines of a VCF file after the specified position.
+
+    For a bgzipped VCF, the position of a line is its virtual file offset; otherwise it is the
+    line number. If `position` is None, all lines are yielded.
+    """
+    with ExitStack() as stack:
+        if is_bgzf(vcffile):
+            reader = stack.enter_context(BgzfReader(vcffile))
+            lines = reader.offset_lines(position or 0)
+        else:
+            lines = enumerate(stack.enter_context(rsidx.open(vcffile, "rb")))
+            lines = islice(lines, position, None)
+        if position is not None:
+            next(lines, None)
+        yield from lines
+
+
+def index_checkpointed(
+    dbconn,
+    vcffile,
+    checkpoint=1e6,
+    resume=False,
+    cache_size=None,
+    mmap_size=None,
+    offsets=False,
+    logint=1e6,
+    metrics=None,
+):
+    """Index a VCF file, committing periodically so that an interrupted build can be resumed.
+
+    The rows for approximately every `checkpoint` rsIDs are committed along with the position
+    of the last VCF line indexed, which is recorded in the `rsidx_checkpoint` table. The index
+    is marked incomplete until the build is finished. If `resume` is true, the build continues
+    from the checkpoint of an interrupted build of the same VCF file. During the build, the
+    index uses a write-ahead log with normal synchronous writes, so that commits are cheap and
+    a crash loses at most the rows since the last checkpoint. If `offsets` is true, the VCF
+    must be bgzipped and the virtual offset of each record is recorded as in `index_offsets`.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    if resume:
+        offsets, position = read_checkpoint(dbconn, vcffile)
+    else:
+        if offsets and not is_bgzf(vcffile):
+            raise ValueError('offsets require a bgzipped VCF file, "{}" is not'.format(vcffile))
+        position = None
+        create_table(dbconn, offsets=offsets)
+        stat = os.stat(vcffile)
+        dbconn.execute(
+            "CREATE TABLE rsidx_checkpoint ("
+            "path TEXT, size INTEGER, mtime REAL, offsets INTEGER, position INTEGER)"
+        )
+        dbconn.execute(
+            "INSERT INTO rsidx_checkpoint VALUES (?,?,?,?,NULL)",
+            (os.path.abspath(vcffile), stat.st_size, stat.st_mtime, offsets),
+        )
+        finalize(dbconn, complete=False)
     if cache_size:
-        c.execute("PRAGMA cache_size = -{:d}".format(cache_size))
+        dbconn.execute("PRAGMA cache_size = -{:d}".format(cache_size))
     if mmap_size:
-        c.execute("PRAGMA mmap_size = {:d}".format(mmap_size))  # bytes
-    dbconn.commit()
+        dbconn.execute("PRAGMA mmap_size = {:d}".format(mmap_size))  # bytes
+    dbconn.execute("PRAGMA journal_mode = WAL")
+    dbconn.execute("PRAGMA synchronous = NORMAL")
+    insert = "INSERT OR IGNORE INTO rsid_to_coord VALUES ({:s})".format(
+        "?,?,?,?" if offsets else "?,?,?"
+    )
+    c = dbconn.cursor()
+
+    def commit(batch, position):
+        with metrics.timer("insert"):
+            c.executemany(insert, batch)
+            c.execute("UPDATE rsidx_checkpoint SET position = ?", (position,))
+        with metrics.timer("commit"):
+            dbconn.commit()
+        metrics.add("checkpoints")
+
+    lines = resume_lines(vcffile, position)
+    rows = parse_vcf_offsets(lines, updateint=logint, on_progress=metrics.progress)
+    batch = list()
+    for row in metrics.timed(rows, "parse"):
+        if len(batch) >= checkpoint and row[3] != position:
+            commit(batch, position)
+            batch = list()
+        batch.append(row if offsets else row[:3])
+        position = row[3]
+    commit(batch, position)
+    with metrics.timer("finalize"):
+        c.execute("DROP TABLE rsidx_checkpoint")
+        dbconn.commit()
+        dbconn.execute("PRAGMA journal_mode = DELETE")
+        finalize(dbconn)
+
+
+def has_offsets(dbconn):
+    """Return True if the index records the virtual file offset of each rsID's record."""
+    return "voffset" in table_columns(dbconn)
+
+
+def offsets_match(dbconn, vcffile):
+    """Determine whether the record offsets of an index apply to a VCF file.
+
+    Offsets are only valid for the exact bgzipped file they were recorded from; the same
+    records compressed again land at different offsets. The size and mtime of the file are
+    compared with those recorded when the index was built.
+    """
+    if not has_table(dbconn, "rsidx_sources"):
+        return False
+    stat = os.stat(vcffile)
+    query = "SELECT 1 FROM rsidx_sources WHERE size = ? AND mtime = ?"
+    return dbconn.execute(query, (stat.st_size, stat.st_mtime)).fetchone() is not None
+
+
+def index_binary(idxfile, vcffh, logint=1e6, buffer_size=1e7, tmpdir=None, metrics=None):
+    """Index a VCF file in the compact binary format.
+
+    Records are sorted by rsID as in bulk mode, keeping the first occurrence of each rsID,
+    and written as fixed-width columns. See `rsidx.binary.write_index` for a description of
+    the format.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    vcfstream = parse(vcffh, updateint=logint, metrics=metrics)
+    starttime = time.perf_counter()
+    with TemporaryDirectory(dir=tmpdir) as dirname:
+        rows = sort_rows(vcfstream, dirname, buffer_size=buffer_size)
+        nrecords = write_index(idxfile, rows, tmpdir=tmpdir)
+    elapsed = time.perf_counter() - starttime
+    metrics.add_time("sort_and_write", elapsed - metrics.timings.get("parse", 0.0))
+    return nrecords
+
+
+POLICIES = ("keep-old", "take-new", "record-both")
+
+
+def update(dbconn, vcffh, policy="keep-old", logint=1e6, vcffile=None):
+    """Add the rsIDs from an additional VCF file to an existing index.
+
+    When an rsID in the new VCF is already in the index at a different coordinate, the
+    conflict is resolved according to the policy: "keep-old" keeps the indexed coordinate,
+    "take-new" replaces it with the new coordinate, and "record-both" keeps the indexed
+    coordinate and records the new coordinate in the `rsid_alt_coord` table, which is
+    consulted by searches. Within the new VCF, the first occurrence of each rsID wins.
+    The path of the new VCF file must be given as `vcffile` when updating an index of
+    multiple VCF files. Returns the number of new rsIDs and the number of conflicts.
+
+    The new VCF is parsed into a temporary table before the index is modified, and the index
+    rows are written in the same transaction as the completion flag (see `finalize`), so a
+    failed update leaves the index unchanged.
+    """
+    if policy not in POLICIES:
+        raise ValueError('invalid conflict policy "{}"'.format(policy))
+    sharded = is_sharded(dbconn)
+    if sharded and vcffile is None:
+        raise ValueError("VCF file path required to update an index of multiple VCF files")
+    c = dbconn.cursor()
+    c.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS rsidx_update ("
+        "rsid INTEGER PRIMARY KEY, "
+        "chrom TEXT NULL DEFAULT NULL, "
+        "coord INTEGER NOT NULL DEFAULT 0)"
+    )
+    c.execute("DELETE FROM temp.rsidx_update")
+    vcfstream = parse(vcffh, updateint=logint)
+    c.executemany("INSERT OR IGNORE INTO temp.rsidx_update VALUES (?,?,?)", vcfstream)
+    columns = "u.rsid, u.chrom, u.coord"
+    target = "rsid_to_coord (rsid, chrom, coord)"
+    params = tuple()
+    if sharded:
+        columns += ", ?"
+        target = "rsid_to_coord (rsid, chrom, coord, source)"
+        params = (register_file(dbconn, vcffile, commit=False),)
+    query = (
+        "SELECT COUNT(*) FROM temp.rsidx_update AS u "
+        "LEFT JOIN rsid_to_coord AS r ON r.rsid = u.rsid WHERE r.rsid IS NULL"
+    )
+    (nnew,) = c.execute(query).fetchone()
+    conflicts = (
+        "SELECT {:s} FROM temp.rsidx_update AS u "
+        "JOIN rsid_to_coord AS r ON r.rsid = u.rsid "
+        "WHERE r.chrom IS NOT u.chrom OR r.coord != u.coord"
+    ).format(columns)
+    (nconflicts,) = c.execute("SELECT COUNT(*) FROM ({:s})".format(conflicts), params).fetchone()
+    rows = "SELECT {:s} FROM temp.rsidx_update AS u".format(columns)
+    if policy == "take-new":
+        c.execute("INSERT OR REPLACE INTO {:s} {:s}".format(target, rows), params)
+    else:
+        if policy == "record-both":
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS rsid_alt_coord ("
+                "rsid INTEGER NOT NULL, "
+                "chrom TEXT NULL DEFAULT NULL, "
+                "coord INTEGER NOT NULL DEFAULT 0, {:s}"
+                "PRIMARY KEY (rsid, chrom, coord)) WITHOUT ROWID".format(
+                    "source INTEGER NOT NULL DEFAULT 0, " if params else ""
+                )
+            )
+            c.execute("INSERT OR IGNORE INTO rsid_alt_coord {:s}".format(conflicts), params)
+        c.execute("INSERT OR IGNORE INTO {:s} {:s}".format(target, rows), params)
+    finalize(dbconn)
+    c.execute("DROP TABLE temp.rsidx_update")
+    return nnew, nconflicts
+
+
+def update_main(args):
+    try:
+        check_index(args.idx)
+    except ValueError as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    if is_binary_index(args.idx):
+        print("[rsidx] ERROR: binary indexes cannot be updated", file=sys.stderr)
+        raise SystemExit(1)
+    with sqlite3.connect(args.idx) as dbconn:
+        if args.region is None and not args.force and source_unchanged(dbconn, args.vcf):
+            message = 'VCF file "{:s}" is unchanged since it was indexed, skipping'
+            print("[rsidx::update]", message.format(args.vcf), file=sys.stderr)
+            return
+        if args.region:
+            with TabixFile(args.vcf) as tbx:
+                lines = (line.decode() for line in tbx.query([parse_region(args.region)]))
+                nnew, nconflicts = update(dbconn, lines, policy=args.policy, vcffile=args.vcf)
+        else:
+            with rsidx.open(args.vcf, "rb", threads=args.threads) as vcffh:
+                nnew, nconflicts = update(dbconn, vcffh, policy=args.policy, vcffile=args.vcf)
+            record_source(dbconn, args.vcf, checksums=True)
+    dbconn.close()
+    if os.path.exists(presence_file(args.idx)):
+        build_presence(args.idx)
+    message = "added {:d} new rsIDs, resolved {:d} conflicts with policy {:s}"
+    print("[rsidx::update]", message.format(nnew, nconflicts, args.policy), file=sys.stderr)
+
+
+def partition(tbi, nparts):
+    """Split a bgzipped VCF into (start, end) virtual offset intervals for parallel indexing.
+
+    The first interval starts at the beginning of the file (header lines are skipped by the
+    parser) and the last interval is open ended.
+    """
+    offsets = tbi.boundaries()
+    if len(offsets) > nparts:
+        step = len(offsets) / nparts
+        offsets = [offsets[int(i * step)] for i in range(nparts)]
+    starts = [0] + [vo for vo in offsets if vo > 0]
+    ends = starts[1:] + [None]
+    return list(zip(starts, ends))
+
+
+def database_path(dbconn):
+    """Return the path of the main database file of a connection."""
+    for seq, name, path in dbconn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+
+
+def is_sharded(dbconn):
+    """Determine whether an index records the source VCF file of each row."""
+    return "source" in table_columns(dbconn)
+
 
-    vcfstream = parse_vcf(vcffh, updateint=logint)
-    c.executemany("INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?)", vcfstream)
+def register_file(dbconn, vcffile, commit=True):
+    """Add a VCF file to the source files of an index and return its ID.
+
+    The path is stored relative to the directory of the index file.
+    """
+    idxdir = os.path.dirname(os.path.abspath(database_path(dbconn)))
+    path = os.path.relpath(os.path.abspath(vcffile), idxdir)
+    c = dbconn.execute("INSERT INTO rsidx_files (path) VALUES (?)", (path,))
+    if commit:
+        dbconn.commit()
+    return c.lastrowid
+
+
+def source_paths(dbconn, vcfdir=None):
+    """Return a mapping of source file IDs to VCF file paths for an index of multiple VCFs.
+
+    Recorded paths are resolved relative to the directory of the index file. If `vcfdir` is
+    specified, the VCF files are instead looked up by name in that directory.
+    """
+    query = "SELECT id, path FROM rsidx_files ORDER BY id"
+    if vcfdir is not None:
+        return {
+            source: os.path.join(vcfdir, os.path.basename(path))
+            for source, path in dbconn.execute(query)
+        }
+    idxdir = os.path.dirname(database_path(dbconn))
+    return {source: os.path.join(idxdir, path) for source, path in dbconn.execute(query)}
+
+
+def merge_shard(dbconn, shardfile, source=None):
+    """Merge an index shard into the index; rsIDs already in the index are kept."""
+    c = dbconn.cursor()
+    c.execute("ATTACH DATABASE ? AS shard", (shardfile,))
+    if source is None:
+        c.execute("INSERT OR IGNORE INTO rsid_to_coord SELECT * FROM shard.rsid_to_coord")
+    else:
+        query = (
+            "INSERT OR IGNORE INTO rsid_to_coord "
+            "SELECT rsid, chrom, coord, ? FROM shard.rsid_to_coord"
+        )
+        c.execute(query, (source,))
     dbconn.commit()
+    c.execute("DETACH DATABASE shard")
+    os.unlink(shardfile)
+
+
+def index_file(vcffile, shardfile):
+    with rsidx.open(vcffile, "rb") as vcffh, sqlite3.connect(shardfile) as dbconn:
+        c = create_table(dbconn)
+        vcfstream = parse(vcffh, updateint=float("inf"))
+        c.executemany("INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?)", vcfstream)
+        dbconn.commit()
+    dbconn.close()
+    return shardfile
+
+
+def index_multi(dbconn, vcffiles, threads=1, cache_size=None, mmap_size=None, tmpdir=None):
+    """Index multiple VCF files, such as one VCF file per chromosome, in a single index.
+
+    The index records the source file of each row, so that searches can fetch records from
+    the appropriate file; paths are stored relative to the index file. Each VCF file is
+    indexed into its own shard by a pool of `threads` worker processes, and the shards are
+    merged in the order the files are given: if an rsID occurs in more than one file, the
+    first occurrence wins.
+    """
+    create_table(dbconn, cache_size=cache_size, mmap_size=mmap_size, sources=True)
+    with TemporaryDirectory(dir=tmpdir) as dirname:
+        shardfiles = [
+            os.path.join(dirname, "shard{:d}.sqlite3".format(i)) for i in range(len(vcffiles))
+        ]
+        with ProcessPoolExecutor(max_workers=threads) as pool:
+            shards = pool.map(index_file, vcffiles, shardfiles)
+            for vcffile, shardfile in zip(vcffiles, shards):
+                source = register_file(dbconn, vcffile)
+                merge_shard(dbconn, shardfile, source=source)
+                print("[rsidx::index] indexed", vcffile, file=sys.stderr)
+    finalize(dbconn)
+
+
+def index_partition(vcffile, start, end, shardfile, offsets=False):
+    with BgzfReader(vcffile) as reader, sqlite3.connect(shardfile) as dbconn:
+        c = create_table(dbconn, offsets=offsets)
+        if offsets:
+            lines = reader.offset_lines(start, end)
+            vcfstream = parse_vcf_offsets(lines, updateint=float("inf"))
+            c.executemany("INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?,?)", vcfstream)
+        else:
+            lines = (line.decode() for line in reader.lines(start, end))
+            vcfstream = parse_vcf(lines, updateint=float("inf"))
+            c.executemany("INSERT OR IGNORE INTO rsid_to_coord VALUES (?,?,?)", vcfstream)
+        dbconn.commit()
+    dbconn.close()
+    return shardfile
+
+
+def index_parallel(
+    dbconn,
+    vcffile,
+    threads,
+    cache_size=None,
+    mmap_size=None,
+    tmpdir=None,
+    chunks_per_thread=4,
+    offsets=False,
+):
+    """Index a bgzipped and tabix-indexed VCF file using a pool of worker processes.
+
+    The VCF is split into intervals using the tabix index, each worker indexes one interval
+    into its own shard, and the shards are merged in file order. Duplicate rsIDs are resolved
+    exactly as in a serial build: the first occurrence in the file wins. If `offsets` is
+    true, the virtual file offset of each record is recorded as in `index_offsets`.
+    """
+    tbi = TabixIndex(vcffile + ".tbi")
+    intervals = partition(tbi, threads * chunks_per_thread)
+    create_table(dbconn, cache_size=cache_size, mmap_size=mmap_size, offsets=offsets)
+    with TemporaryDirectory(dir=tmpdir) as dirname:
+        shardfiles = [
+            os.path.join(dirname, "shard{:d}.sqlite3".format(i)) for i in range(len(intervals))
+        ]
+        vcffiles = [vcffile] * len(intervals)
+        starts, ends = zip(*intervals)
+        with ProcessPoolExecutor(max_workers=threads) as pool:
+            for n, shardfile in enumerate(
+                pool.map(
+                    index_partition,
+                    vcffiles,
+                    starts,
+                    ends,
+                    shardfiles,
+                    [offsets] * len(intervals),
+                )
+            ):
+                merge_shard(dbconn, shardfile)
+                print("[rsidx::index] merged shard", n + 1, "of", len(intervals), file=sys.stderr)
+    finalize(dbconn)
 
 
 def main(args):
+    if args.resume or args.checkpoint:
+        check_checkpoint(args)
+    if args.resume and os.path.exists(args.idx):
+        resume(args)
+        return
     if os.path.exists(args.idx):
         message = 'WARNING: index file "{:s}" exists'.format(args.idx)
         if args.force:
@@ -63,6 +977,201 @@ def main(args):
         print("[rsidx]", message, file=sys.stderr)
         if not args.force:
             raise SystemExit
-    with rsidx.open(args.vcf, "r") as vcffh:
+    if args.reverse and args.format == "bin":
+        print("[rsidx] ERROR: binary indexes do not support reverse lookups", file=sys.stderr)
+        raise SystemExit(1)
+    if args.merges and args.format == "bin":
+        print("[rsidx] ERROR: binary indexes do not support merge histories", file=sys.stderr)
+        raise SystemExit(1)
+    if args.offsets:
+        check_offsets(args)
+    if args.merges:
+        check_merges(args)
+    if os.path.exists(presence_file(args.idx)):
+        os.unlink(presence_file(args.idx))
+    metrics = Metrics()
+    build(args, metrics)
+    post_build(args, metrics)
+
+
+def post_build(args, metrics):
+    if args.reverse:
+        with metrics.timer("coord_index"), sqlite3.connect(args.idx) as dbconn:
+            create_coord_index(dbconn)
+        dbconn.close()
+        print("[rsidx::index] built coordinate index for reverse lookups", file=sys.stderr)
+    if args.merges:
+        dbconn = sqlite3.connect(args.idx)
+        try:
+            with metrics.timer("merges"), dbconn, rsidx.open(args.merges, "r") as fh:
+                nmerges = load_merges(dbconn, fh)
+        except ValueError as error:
+            print("[rsidx] ERROR:", error, file=sys.stderr)
+            raise SystemExit(1)
+        finally:
+            dbconn.close()
+        print("[rsidx::index] loaded", nmerges, "merged rsIDs", file=sys.stderr)
+    if args.presence:
+        with metrics.timer("presence"):
+            build_presence(args.idx)
+    if args.stats:
+        metrics.report(fmt=args.stats, prefix="[rsidx::index]")
+
+
+def check_offsets(args):
+    message = None
+    if args.format == "bin":
+        message = "binary indexes do not support --offsets"
+    elif args.bulk:
+        message = "--offsets is not supported in bulk mode"
+    elif isinstance(args.vcf, list) and len(args.vcf) > 1:
+        message = "--offsets supports a single VCF file"
+    else:
+        vcffile = args.vcf[0] if isinstance(args.vcf, list) else args.vcf
+        if not os.path.isfile(vcffile) or not is_bgzf(vcffile):
+            message = '--offsets requires a bgzipped VCF file, "{}" is not'.format(vcffile)
+    if message is not None:
+        print("[rsidx] ERROR:", message, file=sys.stderr)
+        raise SystemExit(1)
+
+
+def check_merges(args):
+    """Validate a merge history file before the build, so a bad line cannot waste it."""
+    try:
+        with rsidx.open(args.merges, "r") as fh:
+            for _ in read_merges(fh):
+                pass
+    except (OSError, ValueError) as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+
+
+def check_checkpoint(args):
+    message = None
+    vcffiles = args.vcf if isinstance(args.vcf, list) else [args.vcf]
+    if args.format == "bin":
+        message = "binary indexes do not support --checkpoint or --resume"
+    elif args.bulk:
+        message = "--checkpoint and --resume are not supported in bulk mode"
+    elif len(vcffiles) > 1:
+        message = "--checkpoint and --resume support a single VCF file"
+    elif not os.path.isfile(vcffiles[0]):
+        message = '--checkpoint and --resume require a VCF file, "{}" is not'.format(vcffiles[0])
+    if message is not None:
+        print("[rsidx] ERROR:", message, file=sys.stderr)
+        raise SystemExit(1)
+
+
+def resume(args):
+    """Resume an interrupted checkpointed build, then run the post-build steps."""
+    args.vcf = args.vcf[0] if isinstance(args.vcf, list) else args.vcf
+    if args.merges:
+        check_merges(args)
+    metrics = Metrics()
+    dbconn = sqlite3.connect(args.idx)
+    try:
+        index_checkpointed(
+            dbconn,
+            args.vcf,
+            checkpoint=args.checkpoint or 1000000,
+            resume=True,
+            cache_size=args.cache_size,
+            mmap_size=args.mmap_size,
+            metrics=metrics,
+        )
+        with metrics.timer("record_source"):
+            record_source(dbconn, args.vcf)
+    except ValueError as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        dbconn.close()
+    print("[rsidx::index] resumed and completed the build", file=sys.stderr)
+    post_build(args, metrics)
+
+
+def build(args, metrics):
+    vcffiles = args.vcf if isinstance(args.vcf, list) else [args.vcf]
+    if len(vcffiles) > 1:
+        if args.format == "bin":
+            print("[rsidx] ERROR: binary indexes support a single VCF file", file=sys.stderr)
+            raise SystemExit(1)
+        with metrics.timer("build"), sqlite3.connect(args.idx) as dbconn:
+            index_multi(
+                dbconn,
+                vcffiles,
+                threads=args.threads,
+                cache_size=args.cache_size,
+                mmap_size=args.mmap_size,
+                tmpdir=args.tmpdir,
+            )
+            for vcffile in vcffiles:
+                record_source(dbconn, vcffile)
+        return
+    args.vcf = vcffiles[0]
+    if args.checkpoint or args.resume:
+        with sqlite3.connect(args.idx) as dbconn:
+            index_checkpointed(
+                dbconn,
+                args.vcf,
+                checkpoint=args.checkpoint or 1000000,
+                cache_size=args.cache_size,
+                mmap_size=args.mmap_size,
+                offsets=args.offsets,
+                metrics=metrics,
+            )
+            with metrics.timer("record_source"):
+                record_source(dbconn, args.vcf)
+        return
+    if args.format == "bin":
+        with rsidx.open(args.vcf, "rb", threads=args.threads) as vcffh:
+            index_binary(
+                args.idx,
+                vcffh,
+                buffer_size=args.buffer_size,
+                tmpdir=args.tmpdir,
+                metrics=metrics,
+            )
+        return
+    if args.threads > 1 and not args.bulk:
+        if os.path.exists(args.vcf + ".tbi"):
+            with metrics.timer("build"), sqlite3.connect(args.idx) as dbconn:
+                index_parallel(
+                    dbconn,
+                    args.vcf,
+                    args.threads,
+                    cache_size=args.cache_size,
+                    mmap_size=args.mmap_size,
+                    tmpdir=args.tmpdir,
+                    offsets=args.offsets,
+                )
+                record_source(dbconn, args.vcf)
+            return
+        message = 'WARNING: no tabix index for "{:s}", using threads for decompression only'
+        print("[rsidx]", message.format(args.vcf), file=sys.stderr)
+    if args.offsets:
+        with sqlite3.connect(args.idx) as dbconn:
+            index_offsets(
+                dbconn,
+                args.vcf,
+                cache_size=args.cache_size,
+                mmap_size=args.mmap_size,
+                metrics=metrics,
+            )
+            with metrics.timer("record_source"):
+                record_source(dbconn, args.vcf)
+        return
+    with rsidx.open(args.vcf, "rb", threads=args.threads) as vcffh:
         with sqlite3.connect(args.idx) as dbconn:
-            index(dbconn, vcffh, cache_size=args.cache_size, mmap_size=args.mmap_size)
+            index(
+                dbconn,
+                vcffh,
+                cache_size=args.cache_size,
+                mmap_size=args.mmap_size,
+                bulk=args.bulk,
+                buffer_size=args.buffer_size,
+                tmpdir=args.tmpdir,
+                metrics=metrics,
+            )
+            with metrics.timer("record_source"):
+                record_source(dbconn, args.vcf)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+
+def report_progress(event):
+    """Default progress callback: print periodic progress events from the VCF parser."""
+    if event["done"]:
+        return
+    elapsed = max(event["elapsed"], 1e-9)
+    message = "[rsidx::index] processed {:d} variants, {:d} rsIDs ({:.0f} rsIDs per second)"
+    print(
+        message.format(event["variants"], event["rsids"], event["rsids"] / elapsed),
+        file=sys.stderr,
+    )
+
+
+class Metrics:
+    """Counters and stage timings collected during an index build or a search.
+
+    Pass an instance as the `metrics` argument of `rsidx.index.index` or
+    `rsidx.search.search`. Stage timings are cumulative wall clock seconds; for example, a
+    search reports the time spent loading query rsIDs, resolving them in the index, and
+    fetching VCF records separately. Each progress event from the VCF parser is passed to
+    `on_progress`: a dict with the number of variants, rsIDs, and bytes parsed so far, the
+    elapsed time in seconds, and whether parsing is done. By default, periodic progress is
+    printed to stderr; pass `on_progress=None` to disable it.
+    """
+
+    def __init__(self, on_progress=report_progress):
+        self.on_progress = on_progress
+        self.counters = dict()
+        self.timings = dict()
+        self._start = time.perf_counter()
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, iterable, name):
+        """Iterate over `iterable`, adding the time spent producing each item to a stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def progress(self, event):
+        for key in ("variants", "rsids", "bytes"):
+            self.counters[key] = event[key]
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self._start
+        rates = dict()
+        for name, count in self.counters.items():
+            if elapsed > 0:
+                rates[name + "_per_second"] = count / elapsed
+        return {
+            "elapsed": elapsed,
+            "counters": dict(self.counters),
+            "timings": dict(self.timings),
+            "rates": rates,
+        }
+
+    def report(self, out=None, fmt="json", prefix="[rsidx]"):
+        """Print the metrics, by default to stderr, as a JSON object or as readable lines."""
+        out = out if out is not None else sys.stderr
+        values = self.as_dict()
+        if fmt == "json":
+            print(json.dumps(values, sort_keys=True), file=out)
+            return
+        print(prefix, "elapsed {:.3f}s".format(values["elapsed"]), file=out)
+        for name, seconds in sorted(values["timings"].items()):
+            print(prefix, "{:s}: {:.3f}s".format(name, seconds), file=out)
+        for name, count in sorted(values["counters"].items()):
+            print(prefix, "{:s}: {:d}".format(name, count), file=out)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import builtins
+from math import ceil, log
+import mmap
+import os
+from rsidx.binary import BinaryIndex, is_binary_index
+import sqlite3
+import struct
+import sys
+
+
+MAGIC = b"RSIDXPRE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQIQq")
+BITMAP = 0
+BLOOM = 1
+MASK64 = (1 << 64) - 1
+
+
+def presence_file(idxfile):
+    return idxfile + ".presence"
+
+
+def mix(rsid):
+    """Scramble the bits of an rsID (the splitmix64 finalizer)."""
+    z = (rsid * 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def bloom_bits(rsid, nbits, nhashes):
+    h = mix(rsid)
+    h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+    return [(h1 + i * h2) % nbits for i in range(nhashes)]
+
+
+def write_presence(idxfile, rsids, nrsids, maxrsid, fp_rate=0.01):
+    """Write a presence filter for the specified rsIDs alongside an index file.
+
+    The filter is a bitmap over the rsID integer space if that is smaller than a Bloom filter
+    with the specified false positive rate, as it is for dense sets of rsIDs such as dbSNP.
+    The size and modification time of the index file are recorded so that the filter is
+    ignored if the index is later modified.
+    """
+    nbloom = max(8, ceil(-nrsids * log(fp_rate) / log(2) ** 2))
+    if maxrsid + 1 <= nbloom:
+        kind, nbits, nhashes = BITMAP, maxrsid + 1, 0
+    else:
+        kind, nbits = BLOOM, nbloom
+        nhashes = max(1, round(nbloom / max(nrsids, 1) * log(2)))
+    bits = bytearray((nbits + 7) // 8)
+    for rsid in rsids:
+        if kind == BITMAP:
+            bits[rsid >> 3] |= 1 << (rsid & 7)
+        else:
+            for bit in bloom_bits(rsid, nbits, nhashes):
+                bits[bit >> 3] |= 1 << (bit & 7)
+    stat = os.stat(idxfile)
+    with builtins.open(presence_file(idxfile), "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, kind, nbits, nhashes, stat.st_size, stat.st_mtime_ns))
+        fh.write(bits)
+
+
+def build_presence(idxfile, fp_rate=0.01):
+    """Build the presence filter for an existing index file of either format."""
+    if is_binary_index(idxfile):
+        with BinaryIndex(idxfile) as binindex:
+            nrsids = len(binindex)
+            rsids = binindex.iter_rsids()
+            write_presence(idxfile, rsids, nrsids, binindex.max_rsid(), fp_rate=fp_rate)
+            rsids.close()
+    else:
+        dbconn = sqlite3.connect(idxfile)
+        query = "SELECT COUNT(*), COALESCE(MAX(rsid), 0) FROM rsid_to_coord"
+        nrsids, maxrsid = dbconn.execute(query).fetchone()
+        rsids = (rsid for (rsid,) in dbconn.execute("SELECT rsid FROM rsid_to_coord"))
+        write_presence(idxfile, rsids, nrsids, maxrsid, fp_rate=fp_rate)
+        dbconn.close()
+    print("[rsidx::index] built presence filter for", nrsids, "rsIDs", file=sys.stderr)
+
+
+class PresenceFilter:
+    """Memory-mapped set of the rsIDs in an index, for dropping unindexed rsIDs from queries.
+
+    Membership tests have no false negatives. With a Bloom filter, a small fraction of
+    unindexed rsIDs are reported present; they are simply looked up in the index as usual.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = builtins.open(filename, "rb")
+        try:
+            self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fh.close()
+            raise ValueError('presence filter "{}" is incomplete'.format(filename))
+        fields = HEADER.unpack_from(self._mmap) if len(self._mmap) >= HEADER.size else None
+        if fields is None or fields[0] != MAGIC or fields[1] != VERSION:
+            self.close()
+            raise ValueError('"{}" is not an rsidx presence filter'.format(filename))
+        magic, version, self.kind, self.nbits, self.nhashes, self.size, self.mtime = fields
+        if len(self._mmap) != HEADER.size + (self.nbits + 7) // 8:
+            self.close()
+            raise ValueError('presence filter "{}" is incomplete'.format(filename))
+
+    def close(self):
+        self._mmap.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _test(self, bit):
+        return self._mmap[HEADER.size + (bit >> 3)] >> (bit & 7) & 1
+
+    def __contains__(self, rsid):
+        if self.kind == BITMAP:
+            return rsid < self.nbits and self._test(rsid) == 1
+        return all(self._test(bit) for bit in bloom_bits(rsid, self.nbits, self.nhashes))
+
+
+def load_presence(idxfile):
+    """Open the presence filter of an index file, or return None if it has none.
+
+    A filter that is older than the index is ignored with a warning.
+    """
+    if not idxfile or not os.path.isfile(presence_file(idxfile)):
+        return None
+    try:
+        presence = PresenceFilter(presence_file(idxfile))
+    except ValueError as error:
+        print("[rsidx::search] WARNING:", error, file=sys.stderr)
+        return None
+    stat = os.stat(idxfile)
+    if (presence.size, presence.mtime) != (stat.st_size, stat.st_mtime_ns):
+        presence.close()
+        message = 'presence filter for "{}" is out of date, ignoring'.format(idxfile)
+        print("[rsidx::search] WARNING:", message, file=sys.stderr)
+        return None
+    return presence
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import rsidx
+from rsidx.binary import BinaryIndex
+from rsidx.index import check_index, connect
+from rsidx.tabix import parse_region
+import sys
+
+
+def read_bed(instream):
+    """Yield (chrom, start, end) regions from a BED file, as 1-based closed coordinates."""
+    for line in instream:
+        if line.startswith(("#", "track", "browser")) or line.strip() == "":
+            continue
+        values = line.split("\t", 3)
+        try:
+            chrom, start, end = values[0], int(values[1]) + 1, int(values[2])
+        except (IndexError, ValueError):
+            raise ValueError('invalid BED line "{}"'.format(line.rstrip()))
+        if end < start:
+            continue
+        yield chrom, start, end
+
+
+def merge_regions(regions):
+    """Sort (chrom, start, end) regions and merge those that overlap or are adjacent."""
+    merged = list()
+    for chrom, start, end in sorted(regions):
+        if merged and merged[-1][0] == chrom and start <= merged[-1][2] + 1:
+            merged[-1][2] = max(merged[-1][2], end)
+            continue
+        merged.append([chrom, start, end])
+    return [tuple(region) for region in merged]
+
+
+def has_coord_index(dbconn):
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'rsid_by_coord'"
+    return dbconn.execute(query).fetchone() is not None
+
+
+def lookup_regions(dbconn, regions):
+    """Yield (chrom, coord, rsid) for each indexed rsID in the specified regions.
+
+    Regions are (chrom, start, end) tuples of 1-based closed coordinates. They are merged
+    before querying, so that each stretch of the genome is covered by a single range scan,
+    and results are yielded sorted by coordinate. Range scans use the (chrom, coord) index
+    built by `rsidx index --reverse`; without it, each scan reads the whole index.
+    """
+    query = (
+        "SELECT chrom, coord, rsid FROM rsid_to_coord "
+        "WHERE chrom = ? AND coord BETWEEN ? AND ? ORDER BY coord, rsid"
+    )
+    c = dbconn.cursor()
+    try:
+        for region in merge_regions(regions):
+            yield from c.execute(query, region)
+    finally:
+        c.close()
+
+
+def main(args):
+    try:
+        regions = [parse_region(region) for region in args.region]
+        if args.bed:
+            with rsidx.open(args.bed, "r") as fh:
+                regions.extend(read_bed(fh))
+        check_index(args.idx)
+    except ValueError as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    if len(regions) == 0:
+        print("[rsidx] ERROR: no regions specified, use --region or --bed", file=sys.stderr)
+        raise SystemExit(1)
+    conn = connect(args.idx, readonly=True)
+    if isinstance(conn, BinaryIndex):
+        conn.close()
+        print("[rsidx] ERROR: binary indexes do not support reverse lookups", file=sys.stderr)
+        raise SystemExit(1)
+    if not has_coord_index(conn):
+        message = "index has no coordinate index, scanning the entire index for each region; "
+        message += "rebuild the index with --reverse for fast reverse lookups"
+        print("[rsidx::lookup] WARNING:", message, file=sys.stderr)
+    with rsidx.open(args.out, "w") as out:
+        for chrom, coord, rsid in lookup_regions(conn, regions):
+            print(chrom, coord, "rs{:d}".format(rsid), sep="\t", file=out)
+    conn.close()
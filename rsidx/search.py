@@ -7,10 +7,32 @@
 # and is licensed under the BSD license: see LICENSE.txt.
 # -----------------------------------------------------------------------------
 
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
+from heapq import merge
+from itertools import chain, count, groupby, islice
+import os
 import rsidx
-import sqlite3
-from subprocess import Popen, PIPE
+from rsidx.binary import BinaryIndex
+from rsidx.index import (
+    check_index,
+    connect,
+    database_path,
+    has_offsets,
+    has_table,
+    is_sharded,
+    offsets_match,
+    read_run,
+    source_paths,
+    write_run,
+)
+from rsidx.metrics import Metrics
+from rsidx.presence import load_presence
+from rsidx.tabix import BgzfReader, TabixFile
 import sys
+from tempfile import TemporaryDirectory
 
 
 def trim_rsid(rsid):
@@ -20,55 +42,869 @@ def trim_rsid(rsid):
     return rsidstr
 
 
-def filter_by_rsid(instream, rsidlist, header=False):
+MAX_RSID = (1 << 63) - 1
+
+
+def parse_rsid(rsid):
+    """Convert an rsID to an integer, or return None if it is not a valid rsID.
+
+    Valid rsIDs are non-negative and fit in a 64-bit signed SQLite integer.
+    """
+    try:
+        value = int(trim_rsid(rsid))
+        if not 0 <= value <= MAX_RSID:
+            raise ValueError(rsid)
+        return value
+    except ValueError:
+        print('[rsidx::search] WARNING: skipping invalid rsID "{}"'.format(rsid), file=sys.stderr)
+        return None
+
+
+_tablenum = count()
+
+
+@contextmanager
+def query_table(dbconn, rsidlist, metrics=None):
+    """Load the specified rsIDs into a temporary table for joining against the index.
+
+    The query rsIDs are streamed into the table rather than being formatted into an SQL
+    statement, so memory use does not depend on the number of query rsIDs. Yields the
+    connection to query, the name of the query table, and the name of the index table, which
+    includes alternate coordinates recorded by `rsidx update`. Binary indexes have no tables;
+    see `matches`.
+
+    If the index has a presence filter, query rsIDs that are not indexed are marked in the
+    `present` column of the query table, and queries skip them without probing the index.
+    The time spent loading the query table is recorded in `metrics` as "load_query".
+
+    The `current` column of the query table holds the rsID to join against the index. It is
+    the query rsID itself unless the index has a merge history (see `rsidx.index.load_merges`)
+    and the query rsID is not indexed but was merged into another rsID, which takes its place.
+    """
+    if isinstance(dbconn, BinaryIndex):
+        raise ValueError("binary indexes do not support query tables")
+    metrics = metrics if metrics is not None else Metrics(on_progress=None)
+    indextable = "rsid_to_coord"
+    presence = load_presence(database_path(dbconn))
+    merges = has_table(dbconn, "rsid_merges")
+    if has_table(dbconn, "rsid_alt_coord"):
+        columns = "rsid, chrom, coord, source" if is_sharded(dbconn) else "rsid, chrom, coord"
+        altcolumns = columns
+        if has_offsets(dbconn):
+            columns += ", voffset"
+            altcolumns += ", NULL AS voffset"
+        indextable = (
+            "(SELECT {:s} FROM rsid_to_coord UNION ALL SELECT {:s} FROM rsid_alt_coord)"
+        ).format(columns, altcolumns)
+    tablenum = next(_tablenum)
+    table = "temp.rsidx_query{:d}".format(tablenum)
+    dbconn.execute(
+        "CREATE TABLE {:s} ("
+        "rsid INTEGER PRIMARY KEY, present INTEGER NOT NULL, current INTEGER NOT NULL)".format(
+            table
+        )
+    )
+    try:
+        with metrics.timer("load_query"):
+            rsids = (rsid for rsid in map(parse_rsid, rsidlist) if rsid is not None)
+            rows = ((rsid, presence is None or rsid in presence, rsid) for rsid in rsids)
+            dbconn.executemany("INSERT OR IGNORE INTO {:s} VALUES (?,?,?)".format(table), rows)
+            if merges:
+                dbconn.execute(
+                    "UPDATE {0:s} SET present = 1, current = "
+                    "(SELECT m.current FROM rsid_merges AS m WHERE m.old = {0:s}.rsid) "
+                    "WHERE rsid IN (SELECT old FROM rsid_merges) "
+                    "AND rsid NOT IN (SELECT rsid FROM rsid_to_coord)".format(table)
+                )
+        yield dbconn, table, indextable
+    finally:
+        dbconn.execute("DROP TABLE IF EXISTS {:s}".format(table))
+        dbconn.commit()
+        if presence is not None:
+            presence.close()
+
+
+def sort_rsids(rsids, dirname, buffer_size=1e6):
+    """Yield the distinct rsIDs of an iterable of integer rsIDs in ascending order.
+
+    rsIDs are sorted in memory in runs of `buffer_size` rsIDs. If the input does not fit in a
+    single run, each sorted run is spilled to a temporary file in `dirname` and the runs are
+    merged, as in `rsidx.index.sort_rows`.
+    """
+    rsids = iter(rsids)
+    runs = list()
+    while True:
+        run = list(islice(rsids, int(buffer_size)))
+        if len(run) == 0:
+            break
+        full = len(run) == buffer_size
+        runs.append(sorted(set(run)))
+        if not full:
+            break
+        runfile = os.path.join(dirname, "query{:d}.bin".format(len(runs)))
+        with open(runfile, "wb") as fh:
+            array("q", runs[-1]).tofile(fh)
+        runs[-1] = read_rsids(runfile)
+    previous = None
+    for rsid in merge(*runs):
+        if rsid != previous:
+            yield rsid
+            previous = rsid
+
+
+def read_rsids(runfile, blocksize=1 << 16):
+    with open(runfile, "rb") as fh:
+        while True:
+            block = array("q")
+            try:
+                block.fromfile(fh, blocksize)
+            except EOFError:
+                pass
+            if len(block) == 0:
+                break
+            yield from block
+
+
+Matches = namedtuple("Matches", ["rows", "unmatched", "nquery"])
+
+
+@contextmanager
+def matches(dbconn, rsidlist, extra="", metrics=None, buffer_size=1e6):
+    """Resolve query rsIDs against an index of either format.
+
+    Yields a `Matches` tuple. `rows` iterates over (chrom, coord, current rsID, ..., query
+    rsID) for each indexed query rsID, sorted by coordinate and query rsID; `extra` is a
+    string of additional index columns to select from an SQLite index, such as ", r.source".
+    Once the rows are consumed, `unmatched()` yields the query rsIDs not in the index and
+    `nquery()` returns the number of distinct query rsIDs.
+
+    SQLite indexes are joined against a temporary query table (see `query_table`). Binary
+    indexes are resolved with a merge join of the sorted query rsIDs against the rsID column
+    (see `rsidx.binary.BinaryIndex.lookup`), without staging the query in a database. The
+    query rsIDs and the matches are sorted in runs of `buffer_size` and spilled to temporary
+    files, so memory use does not depend on the number of query rsIDs.
+    """
+    metrics = metrics if metrics is not None else Metrics(on_progress=None)
+    if isinstance(dbconn, BinaryIndex):
+        with TemporaryDirectory() as dirname:
+            yield binary_matches(dbconn, rsidlist, dirname, metrics, buffer_size)
+        return
+    with query_table(dbconn, rsidlist, metrics=metrics) as (conn, table, indextable):
+        query = (
+            "SELECT r.chrom, r.coord, q.current{:s}, q.rsid FROM {:s} AS q "
+            "JOIN {:s} AS r ON r.rsid = q.current WHERE q.present "
+            "ORDER BY r.chrom, r.coord, q.rsid"
+        ).format(extra, table, indextable)
+        c = conn.cursor()
+        try:
+            yield Matches(
+                c.execute(query),
+                lambda: unindexed(conn, table, indextable),
+                lambda: conn.execute("SELECT COUNT(*) FROM {:s}".format(table)).fetchone()[0],
+            )
+        finally:
+            c.close()
+
+
+def binary_matches(binindex, rsidlist, dirname, metrics, buffer_size=1e6):
+    """Resolve query rsIDs against a binary index; see `matches`."""
+    rsids = (rsid for rsid in map(parse_rsid, rsidlist) if rsid is not None)
+    rsids = metrics.timed(sort_rsids(rsids, dirname, buffer_size=buffer_size), "load_query")
+    missfile = os.path.join(dirname, "missing.bin")
+    nquery = 0
+    runs = list()
+    run = list()
+    misses = array("q")
+    with metrics.timer("lookup"), open(missfile, "wb") as missfh:
+        for rsid, chrom, coord in binindex.lookup(rsids, outer=True):
+            nquery += 1
+            if chrom is None:
+                misses.append(rsid)
+                if len(misses) >= buffer_size:
+                    misses.tofile(missfh)
+                    del misses[:]
+                continue
+            run.append((rsid, chrom, coord))
+            if len(run) >= buffer_size:
+                run.sort(key=coord_key)
+                runs.append(write_run(run, dirname, len(runs)))
+                run = list()
+        misses.tofile(missfh)
+    run.sort(key=coord_key)
+    runs = [read_run(runfile) for runfile in runs] + [run]
+    rows = ((chrom, coord, rsid, rsid) for rsid, chrom, coord in merge(*runs, key=coord_key))
+    return Matches(rows, lambda: read_rsids(missfile), lambda: nquery)
+
+
+def coord_key(row):
+    rsid, chrom, coord = row
+    return chrom, coord, rsid
+
+
+def lookup(dbconn, rsidlist):
+    """Yield the distinct (chrom, coord) of the specified rsIDs, sorted by coordinate."""
+    with matches(dbconn, rsidlist) as result:
+        previous = None
+        for row in result.rows:
+            coord = tuple(row[:2])
+            if coord != previous:
+                yield coord
+                previous = coord
+
+
+def batch_rows(rows, batch_size=None):
+    """Group sorted (chrom, coord, rsid) rows into batches of approximately `batch_size` rows.
+
+    Rows for a single coordinate are never split across batches.
+    """
+    batch = list()
+    for coord, group in groupby(rows, key=lambda row: row[:2]):
+        if batch_size and len(batch) >= batch_size:
+            yield batch
+            batch = list()
+        batch.extend(group)
+    if len(batch) > 0:
+        yield batch
+
+
+def plan_regions(coords, gap=1000):
+    """Merge sorted (chrom, coord) pairs into (chrom, start, end) regions for the VCF fetch.
+
+    Coordinates on the same chromosome are merged into a single region if they are within
+    `gap` bp of each other. Larger gaps mean fewer, longer regions to scan; records in the
+    merged regions are filtered back down to the query rsIDs at their indexed coordinates.
+    """
+    region = None
+    for chrom, coord in coords:
+        if region is not None and chrom == region[0] and coord <= region[2] + gap + 1:
+            region[2] = max(region[2], coord)
+            continue
+        if region is not None:
+            yield tuple(region)
+        region = [chrom, coord, coord]
+    if region is not None:
+        yield tuple(region)
+
+
+def filter_by_rsid(instream, rsidlist, header=False, found=None):
+    """Yield header lines and each VCF record containing one or more of the specified rsIDs.
+
+    The rsIDs are matched as integers against a hashed set; only the first three columns of
+    each record are split. `rsidlist` may be a set of integer rsIDs, any iterable of rsIDs, or
+    a string of comma-separated rsIDs. If `found` is a set, the query rsIDs observed in the
+    records are added to it.
+    """
+    if isinstance(rsidlist, str):
+        rsidlist = [rsid.strip() for rsid in rsidlist.split(",") if rsid.strip()]
+    if not isinstance(rsidlist, (set, frozenset)):
+        rsidlist = set(rsid for rsid in map(parse_rsid, rsidlist) if rsid is not None)
     for line in instream:
         if line.startswith("#"):
             yield line
             continue
-        chrom, coord, rsids, *values = line.split("\t")
-        for rsid in rsids.split(";"):
-            if rsid[2:] in rsidlist:
-                yield line
+        rsids = line.split("\t", 3)[2]
+        matches = [
+            int(rsid[2:])
+            for rsid in rsids.split(";")
+            if rsid.startswith("rs") and rsid[2:].isdigit() and int(rsid[2:]) in rsidlist
+        ]
+        if len(matches) > 0:
+            if found is not None:
+                found.update(matches)
+            yield line
+
+
+def filter_by_coord(instream, keys, found=None):
+    """Yield each VCF record at the indexed coordinate of one of its rsIDs.
+
+    `keys` is a set of (chrom, coord, rsid) tuples, one for each coordinate at which a query
+    rsID is indexed. Records in a merged region that carry a query rsID at a different
+    coordinate are dropped, so that the records returned for an rsID do not depend on the
+    other rsIDs in the same query. If `found` is a set, the matching rsIDs are added to it.
+    """
+    for line in instream:
+        chrom, pos, rsids = line.split("\t", 3)[:3]
+        if not pos.isdigit():
+            continue
+        pos = int(pos)
+        matches = [
+            int(rsid[2:])
+            for rsid in rsids.split(";")
+            if rsid.startswith("rs") and rsid[2:].isdigit() and (chrom, pos, int(rsid[2:])) in keys
+        ]
+        if len(matches) > 0:
+            if found is not None:
+                found.update(matches)
+            yield line
+
+
+def report_missing(nmissing, nquery, examples, maxlist=10):
+    if nmissing == 0:
+        return
+    message = "[rsidx::search] WARNING: {:d} of {:d} rsIDs not found: ".format(nmissing, nquery)
+    message += ", ".join("rs{:d}".format(rsid) for rsid in sorted(examples)[:maxlist])
+    if nmissing > maxlist:
+        message += ", ..."
+    print(message, file=sys.stderr)
+
+
+def report_aliases(aliases, maxlist=10):
+    """Report query rsIDs that were resolved to the rsIDs they were merged into."""
+    if len(aliases) == 0:
+        return
+    message = "[rsidx::search] resolved {:d} merged rsIDs: ".format(len(aliases))
+    message += ", ".join(
+        "rs{:d} -> rs{:d}".format(rsid, aliases[rsid]) for rsid in sorted(aliases)[:maxlist]
+    )
+    if len(aliases) > maxlist:
+        message += ", ..."
+    print(message, file=sys.stderr)
+
+
+def fetch_batch(tbx, batch, gap=1000):
+    """Fetch the VCF records for a batch of (chrom, coord, rsid, ...) rows.
+
+    Returns the matching records, sorted by genomic coordinate, and the set of rsIDs observed.
+    Records are matched against the indexed coordinates of the rsIDs (see `filter_by_coord`).
+    """
+    keys = set(tuple(row[:3]) for row in batch)
+    coords = [row[:2] for row in batch]
+    batchfound = set()
+    lines = tbx.query(plan_regions(coords, gap=gap))
+    lines = (line.decode() for line in lines)
+    return list(filter_by_coord(lines, keys, found=batchfound)), batchfound
+
+
+def fetch_offsets(reader, batch):
+    """Fetch the VCF records for a batch of (chrom, coord, rsid, voffset) rows.
+
+    Each record is read by seeking directly to its virtual file offset, along with any
+    following records at the same position. Returns the matching records, sorted by genomic
+    coordinate, and the set of rsIDs observed.
+    """
+    keys = set(tuple(row[:3]) for row in batch)
+    batchfound = set()
+    seen = set()
+    lines = list()
+    for chrom, vo in sorted(set((row[0], row[3]) for row in batch)):
+        position = None
+        for start, line in reader.offset_lines(vo):
+            values = line.split(b"\t", 2)[:2]
+            if position is not None and values != position:
                 break
+            position = values
+            if start not in seen:
+                seen.add(start)
+                lines.append(line.decode())
+    return list(filter_by_coord(lines, keys, found=batchfound)), batchfound
+
 
+def record_key(line):
+    chrom, pos = line.split("\t", 2)[:2]
+    return chrom, int(pos)
 
-def search(rsidlist, dbconn, vcffile, header=False):
+
+def unindexed(dbconn, table, indextable):
+    """Yield the rsIDs in the query table that are not in the index."""
+    query = (
+        "SELECT rsid FROM {0:s} WHERE NOT present UNION ALL "
+        "SELECT q.rsid FROM {0:s} AS q LEFT JOIN {1:s} AS r ON r.rsid = q.current "
+        "WHERE q.present AND r.rsid IS NULL"
+    ).format(table, indextable)
     c = dbconn.cursor()
-    rsids = ", ".join(map(trim_rsid, rsidlist))
-    query = "SELECT DISTINCT chrom,coord FROM rsid_to_coord WHERE rsid IN ({:s})".format(rsids)
+    try:
+        for (rsid,) in c.execute(query):
+            yield rsid
+    finally:
+        c.close()
+
+
+def search(
+    rsidlist,
+    dbconn,
+    vcffile,
+    header=False,
+    found=None,
+    gap=1000,
+    batch_size=100000,
+    threads=4,
+    metrics=None,
+    aliases=None,
+    tbicache=None,
+    report=True,
+):
+    """Yield VCF records for the specified rsIDs, sorted by genomic coordinate.
+
+    The query rsIDs are resolved to coordinates and the records are fetched from the VCF in
+    batches of `batch_size` coordinates, so that memory use is bounded by the batch size
+    rather than the number of query rsIDs. The index may be an open database connection, a
+    binary index, or the path of an index file in either format. If `found` is a set, the
+    query rsIDs observed in the VCF are added to it. rsIDs not found are reported on stderr.
+    See `plan_regions` for a description of `gap`.
+
+    For an index of multiple VCF files, `vcffile` is the directory containing the VCF files,
+    or None to use the paths recorded in the index. Each batch is fetched from up to `threads`
+    VCF files at a time, and the records are merged in sorted order. For an index built with
+    record offsets (see `rsidx.index.index_offsets`), each record is read by seeking directly
+    to its offset, and the tabix index is only used for rsIDs added by `rsidx update`. If the
+    VCF file is not the one the offsets were recorded from (see `rsidx.index.offsets_match`),
+    the tabix index is used for all rsIDs.
+
+    If `metrics` (a `rsidx.metrics.Metrics` object) is given, counts of query rsIDs, matches,
+    records, and VCF blocks and bytes read are recorded in it, along with the time spent
+    loading the query rsIDs, looking them up in the index, fetching VCF records, and finding
+    missing rsIDs.
 
-    def fmt(row):
-        return "{chr:s}:{coord:d}-{coord:d}".format(chr=row[0], coord=row[1])
+    If the index has a merge history, query rsIDs that were merged into another rsID are
+    resolved to the current rsID in the same query, and its records are returned. The
+    resolved rsIDs are reported on stderr, and if `aliases` is a dict, each query rsID is
+    mapped to its current rsID in it.
 
-    coords = [fmt(result) for result in c.execute(query)]
-    if len(coords) == 0:
-        print("[rsidx::search] WARNING: no rsID matches", file=sys.stderr)
+    Each search loads the tabix index of each VCF file it reads, unless a
+    `rsidx.tabix.TabixIndexCache` is given as `tbicache` to share parsed indexes between
+    searches. With `report=False`, nothing is printed to stderr.
+    """
+    if isinstance(dbconn, str):
+        with closing(connect(dbconn, readonly=True)) as conn:
+            yield from search(
+                rsidlist,
+                conn,
+                vcffile,
+                header,
+                found,
+                gap,
+                batch_size,
+                threads,
+                metrics,
+                aliases,
+                tbicache,
+                report,
+            )
         return
-    coords.sort(key=lambda x: (x.split(":")[0], int(x.split(":")[1].split("-")[0])))
-    tabixcmd = ["tabix", vcffile]
-    if header:
-        tabixcmd.append("-h")
-    tabixcmd.extend(coords)
-    proc = Popen(tabixcmd, stdout=PIPE, universal_newlines=True)
-    for line in filter_by_rsid(proc.stdout, rsids, header=header):
-        yield line
+    metrics = metrics if metrics is not None else Metrics(on_progress=None)
+    sharded = not isinstance(dbconn, BinaryIndex) and is_sharded(dbconn)
+    offsets = not isinstance(dbconn, BinaryIndex) and not sharded and has_offsets(dbconn)
+    if offsets and not offsets_match(dbconn, vcffile):
+        offsets = False
+        if report:
+            message = 'VCF file "{}" differs from the indexed file, ignoring record offsets'
+            print("[rsidx::search] WARNING:", message.format(vcffile), file=sys.stderr)
+    extra = ", r.source" if sharded else ", r.voffset" if offsets else ""
+    buffer_size = batch_size if batch_size else 1e6
+    with matches(dbconn, rsidlist, extra, metrics, buffer_size) as result:
+        batches = batch_rows(result.rows, batch_size=batch_size)
+        batches = metrics.timed(batches, "lookup")
+        first = next(batches, None)
+        if first is None:
+            if report:
+                print("[rsidx::search] WARNING: no rsID matches", file=sys.stderr)
+            return
+        observed = set()
+        pending = dict()
+        resolved = dict()
+        with ExitStack() as stack:
+            if sharded:
+                vcfdir = vcffile if vcffile and os.path.isdir(vcffile) else None
+                paths = source_paths(dbconn, vcfdir=vcfdir)
+                pool = stack.enter_context(ThreadPoolExecutor(max_workers=threads))
+            else:
+                paths = {None: vcffile}
+            files = dict()
+            readers = list()
 
+            def vcf(source):
+                if source not in files:
+                    path = paths[source]
+                    index = tbicache.get(path) if tbicache is not None else None
+                    files[source] = stack.enter_context(TabixFile(path, index=index))
+                    readers.append(files[source].reader)
+                return files[source]
 
-def parse_rsids(rsidlist, fromfile):
+            def direct():
+                if "direct" not in files:
+                    files["direct"] = stack.enter_context(BgzfReader(vcffile))
+                    readers.append(files["direct"])
+                return files["direct"]
+
+            if header and offsets:
+                for line in direct().lines():
+                    if not line.startswith(b"#"):
+                        break
+                    yield line.decode()
+            elif header:
+                for line in vcf(min(paths)).header():
+                    yield line.decode()
+            for batch in chain([first], batches):
+                queried = {row[-1]: row[2] for row in batch}
+                with metrics.timer("fetch"):
+                    if sharded:
+                        bysource = dict()
+                        for row in batch:
+                            bysource.setdefault(row[3], list()).append(row)
+                        tasks = [
+                            pool.submit(fetch_batch, vcf(source), rows, gap)
+                            for source, rows in sorted(bysource.items())
+                        ]
+                        results = [task.result() for task in tasks]
+                    elif offsets:
+                        seekable = [row for row in batch if row[3] is not None]
+                        unseekable = [row for row in batch if row[3] is None]
+                        results = list()
+                        if seekable:
+                            results.append(fetch_offsets(direct(), seekable))
+                        if unseekable:
+                            results.append(fetch_batch(vcf(None), unseekable, gap=gap))
+                    else:
+                        results = [fetch_batch(vcf(None), batch, gap=gap)]
+                    lines = merge(*[lines for lines, _ in results], key=record_key)
+                    lines = list(lines) if len(results) > 1 else results[0][0]
+                    batchfound = set().union(*[rsids for _, rsids in results])
+                metrics.add("batches")
+                metrics.add("matches", len(batch))
+                metrics.add("records", len(lines))
+                yield from lines
+                observed.update(batchfound)
+                for rsid, current in queried.items():
+                    if current in batchfound:
+                        pending.pop(rsid, None)
+                        if found is not None:
+                            found.add(rsid)
+                        if rsid != current:
+                            resolved[rsid] = current
+                    elif current not in observed:
+                        pending[rsid] = current
+        nmissing = len(pending)
+        examples = sorted(pending)[:10]
+        for reader in readers:
+            metrics.add("vcf_blocks", reader.nblocks)
+            metrics.add("vcf_bytes", reader.nbytes)
+        with metrics.timer("missing"):
+            for rsid in result.unmatched():
+                nmissing += 1
+                if len(examples) < 10:
+                    examples.append(rsid)
+            nquery = result.nquery()
+    metrics.add("queries", nquery)
+    metrics.add("missing", nmissing)
+    metrics.add("aliases", len(resolved))
+    if aliases is not None:
+        aliases.update(resolved)
+    if report:
+        report_aliases(resolved)
+        report_missing(nmissing, nquery, examples)
+
+
+def coords(rsidlist, dbconn, aliases=None, report=True):
+    """Yield (rsid, chrom, coord) for the specified rsIDs, sorted by genomic coordinate.
+
+    The coordinates are read from the index alone, without reading the VCF. The index may be
+    an open database connection, a binary index, or the path of an index file in either
+    format. rsIDs not in the index are reported on stderr. Merged rsIDs are reported with the
+    coordinate of their current rsID; see `search` for a description of `aliases` and
+    `report`.
+    """
+    if isinstance(dbconn, str):
+        with closing(connect(dbconn, readonly=True)) as conn:
+            yield from coords(rsidlist, conn, aliases, report)
+        return
+    resolved = dict()
+    with matches(dbconn, rsidlist) as result:
+        for chrom, coord, current, rsid in result.rows:
+            if rsid != current:
+                resolved[rsid] = current
+            yield rsid, chrom, coord
+        nmissing = 0
+        examples = list()
+        for rsid in result.unmatched():
+            nmissing += 1
+            if len(examples) < 10:
+                examples.append(rsid)
+        nquery = result.nquery()
+    if aliases is not None:
+        aliases.update(resolved)
+    if report:
+        report_aliases(resolved)
+        report_missing(nmissing, nquery, examples)
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry and counts hits and misses."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+MISSING = object()
+
+
+class RsidIndex:
+    """Long-lived handle for repeated searches of a VCF file and its rsidx index.
+
+    The index database is opened read-only and the VCF tabix index is loaded once, and both
+    remain open until the handle is closed. Results of rsID to coordinate lookups and rsID to
+    VCF record lookups are kept in bounded LRU caches, so that repeated lookups of the same
+    rsIDs do not touch the disk. A handle may be passed between threads if it is created with
+    `check_same_thread=False`, but must only be used by one thread at a time.
+    """
+
+    def __init__(
+        self,
+        vcf,
+        idx,
+        cache_size=None,
+        mmap_size=None,
+        immutable=False,
+        maxsize=100000,
+        check_same_thread=True,
+    ):
+        check_index(idx)
+        self.dbconn = connect(
+            idx,
+            readonly=True,
+            immutable=immutable,
+            cache_size=cache_size,
+            mmap_size=mmap_size,
+            check_same_thread=check_same_thread,
+        )
+        self.presence = load_presence(idx)
+        binary = isinstance(self.dbconn, BinaryIndex)
+        self.merges = not binary and has_table(self.dbconn, "rsid_merges")
+        self.coord_query = "SELECT chrom, coord FROM rsid_to_coord WHERE rsid = ?"
+        if not binary and has_table(self.dbconn, "rsid_alt_coord"):
+            self.coord_query = (
+                "SELECT chrom, coord, 0 AS alt FROM rsid_to_coord WHERE rsid = ? UNION ALL "
+                "SELECT chrom, coord, 1 AS alt FROM rsid_alt_coord WHERE rsid = ? ORDER BY alt"
+            )
+        self.vcf = TabixFile(vcf)
+        self.coord_cache = LRUCache(maxsize=maxsize)
+        self.record_cache = LRUCache(maxsize=maxsize)
+
+    def close(self):
+        self.dbconn.close()
+        self.vcf.close()
+        if self.presence is not None:
+            self.presence.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def stats(self):
+        return {
+            "coord_hits": self.coord_cache.hits,
+            "coord_misses": self.coord_cache.misses,
+            "record_hits": self.record_cache.hits,
+            "record_misses": self.record_cache.misses,
+        }
+
+    def _coords(self, rsid):
+        if isinstance(self.dbconn, BinaryIndex):
+            coord = self.dbconn.get(rsid)
+            return tuple() if coord is None else (tuple(coord),)
+        params = (rsid,) * self.coord_query.count("?")
+        return tuple(row[:2] for row in self.dbconn.execute(self.coord_query, params))
+
+    def _lookup(self, rsid):
+        """Return (current rsID, coordinates) for the specified rsID, or None if not indexed.
+
+        The indexed coordinate comes first, followed by any alternate coordinates recorded by
+        `rsidx update --policy record-both`. Invalid rsIDs (see `parse_rsid`) are not indexed.
+        """
+        rsid = parse_rsid(rsid)
+        if rsid is None:
+            return None
+        result = self.coord_cache.get(rsid, MISSING)
+        if result is MISSING:
+            current, coords = rsid, tuple()
+            if self.presence is None or rsid in self.presence:
+                coords = self._coords(rsid)
+            if len(coords) == 0 and self.merges:
+                query = "SELECT current FROM rsid_merges WHERE old = ?"
+                row = self.dbconn.execute(query, (rsid,)).fetchone()
+                if row is not None:
+                    current, coords = row[0], self._coords(row[0])
+            result = (current, coords) if len(coords) > 0 else None
+            self.coord_cache.put(rsid, result)
+        return result
+
+    def resolve(self, rsid):
+        """Return (current rsID, chrom, coord) for the specified rsID, or None if not indexed.
+
+        The current rsID differs from the specified rsID only if the index has a merge history
+        and the specified rsID was merged into another, indexed rsID.
+        """
+        result = self._lookup(rsid)
+        return None if result is None else (result[0],) + result[1][0]
+
+    def coord(self, rsid):
+        """Return the (chrom, coord) of the specified rsID, or None if it is not indexed."""
+        result = self._lookup(rsid)
+        return None if result is None else result[1][0]
+
+    def coords(self, rsid):
+        """Return a tuple of the indexed and alternate (chrom, coord) of the specified rsID."""
+        result = self._lookup(rsid)
+        return tuple() if result is None else result[1]
+
+    def _records(self, rsid):
+        """Return ((chrom, coord), records) pairs for each coordinate of the specified rsID."""
+        rsid = parse_rsid(rsid)
+        if rsid is None:
+            return tuple()
+        result = self.record_cache.get(rsid, MISSING)
+        if result is MISSING:
+            result = tuple()
+            resolved = self._lookup(rsid)
+            if resolved is not None:
+                current, coords = resolved
+                fetched = list()
+                for chrom, pos in coords:
+                    lines = (line.decode() for line in self.vcf.fetch(chrom, [(pos, pos)]))
+                    fetched.append(((chrom, pos), tuple(filter_by_rsid(lines, {current}))))
+                result = tuple(fetched)
+            self.record_cache.put(rsid, result)
+        return result
+
+    def records(self, rsid):
+        """Return a tuple of all VCF records for the specified rsID at its indexed coordinates.
+
+        For a merged rsID, these are the records of the rsID it was merged into.
+        """
+        lines = (line for coord, records in self._records(rsid) for line in records)
+        return tuple(dict.fromkeys(lines))
+
+    def search(self, rsidlist, header=False):
+        """Yield VCF records for the specified rsIDs, sorted by genomic coordinate."""
+        bycoord = dict()
+        for rsid in rsidlist:
+            for coord in self.coords(rsid):
+                bycoord.setdefault(coord, list()).append(rsid)
+        if len(bycoord) == 0:
+            print("[rsidx::search] WARNING: no rsID matches", file=sys.stderr)
+            return
+        if header:
+            for line in self.vcf.header():
+                yield line.decode()
+        seen = set()
+        for coord in sorted(bycoord):
+            for rsid in bycoord[coord]:
+                for line in dict(self._records(rsid)).get(coord, ()):
+                    if line not in seen:
+                        seen.add(line)
+                        yield line
+
+
+def iter_rsids(rsidlist, fromfile):
     if fromfile is False:
-        return rsidlist
-    rsids = list()
+        yield from rsidlist
+        return
     for filename in rsidlist:
         with open(filename, "r") as fh:
             for line in fh:
-                rsids.extend(line.strip().split())
-    return rsids
+                yield from line.strip().split()
+
+
+def parse_rsids(rsidlist, fromfile):
+    if fromfile is False:
+        return rsidlist
+    return list(iter_rsids(rsidlist, fromfile))
+
+
+def print_coords(rows, out, fmt="tsv"):
+    """Print (rsid, chrom, coord) rows as tab-separated values or as BED intervals."""
+    for rsid, chrom, coord in rows:
+        if fmt == "bed":
+            print(chrom, coord - 1, coord, "rs{:d}".format(rsid), sep="\t", file=out)
+        else:
+            print("rs{:d}".format(rsid), chrom, coord, sep="\t", file=out)
+
+
+def write_aliases(aliases, filename):
+    """Write (query rsID, current rsID) pairs of resolved merged rsIDs as tab-separated values."""
+    with rsidx.open(filename, "w") as out:
+        for rsid in sorted(aliases):
+            print("rs{:d}".format(rsid), "rs{:d}".format(aliases[rsid]), sep="\t", file=out)
 
 
 def main(args):
-    rsidlist = parse_rsids(args.rsid, args.file)
-    conn = sqlite3.connect(args.idx)
-    with rsidx.open(args.out, "w") as out:
-        for line in search(rsidlist, conn, args.vcf, header=args.header):
-            print(line, end="", file=out)
+    if args.tabix and (args.coords_only or not args.out or not args.out.endswith(".gz")):
+        message = "--tabix requires VCF output to a file ending in .gz (--out FILE.gz)"
+        print("[rsidx] ERROR:", message, file=sys.stderr)
+        raise SystemExit(1)
+    if args.server:
+        rsidx.serve.client_main(args)
+        return
+    rsidlist = iter_rsids(args.rsid, args.file)
+    try:
+        check_index(args.idx)
+    except ValueError as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    conn = connect(
+        args.idx,
+        readonly=True,
+        immutable=args.immutable,
+        cache_size=args.cache_size,
+        mmap_size=args.mmap_size,
+    )
+    metrics = Metrics(on_progress=None)
+    aliases = dict()
+    if args.coords_only:
+        with rsidx.open(args.out, "w") as out, metrics.timer("lookup"):
+            print_coords(coords(rsidlist, conn, aliases), out, fmt=args.coords_format)
+        conn.close()
+        if args.aliases:
+            write_aliases(aliases, args.aliases)
+        if args.stats:
+            metrics.report(fmt=args.stats, prefix="[rsidx::search]")
+        return
+    lines = search(
+        rsidlist,
+        conn,
+        args.vcf,
+        header=args.header,
+        gap=args.gap,
+        batch_size=args.batch_size,
+        threads=args.threads,
+        metrics=metrics,
+        aliases=aliases,
+    )
+    if args.tabix:
+        rsidx.tabix.write_bgzf(lines, args.out, threads=args.threads, tbifile=args.out + ".tbi")
+    else:
+        with rsidx.open(args.out, "w", threads=args.threads) as out:
+            for line in lines:
+                print(line, end="", file=out)
     conn.close()
+    if args.aliases:
+        write_aliases(aliases, args.aliases)
+    if args.stats:
+        metrics.report(fmt=args.stats, prefix="[rsidx::search]")
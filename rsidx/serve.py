@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from contextlib import contextmanager
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from queue import Empty, LifoQueue
+import rsidx
+from rsidx.index import check_index, connect
+from rsidx.search import parse_rsid
+from rsidx.tabix import TabixIndexCache
+import socket
+from socketserver import ThreadingMixIn, UnixStreamServer
+import sys
+import threading
+
+
+def parse_address(address):
+    """Parse a server address: "unix:PATH" for a Unix socket, or "[http://]HOST:PORT"."""
+    if address.startswith("unix:"):
+        return "unix", address[5:]
+    if address.startswith("http://"):
+        address = address[7:]
+    host, sep, port = address.rstrip("/").rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError('invalid server address "{}"'.format(address))
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def dataset_key(vcf, idx):
+    """Identify a dataset by the real paths of its VCF file (or "-") and its index."""
+    return (vcf if vcf == "-" else os.path.realpath(vcf), os.path.realpath(idx))
+
+
+class Dataset:
+    """A VCF file and its rsidx index, with a pool of warm read-only index connections.
+
+    Requests are answered with the same `rsidx.search.search` and `rsidx.search.coords` code
+    as a local `rsidx search`, so the daemon returns the same records for any index: with
+    alternate coordinates, multiple VCF files, or record offsets. Connections are not
+    thread-safe, so each request borrows one from the pool and returns it when finished. At
+    most `workers` connections are open at a time; additional requests wait for a free
+    connection. The tabix indexes of the VCF files are parsed once and shared.
+    """
+
+    def __init__(self, vcf, idx, workers=8, threads=4, **options):
+        check_index(idx)
+        self.vcf = vcf
+        self.idx = idx
+        self.threads = threads
+        self.options = options
+        self.tbicache = TabixIndexCache()
+        self._handles = LifoQueue()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._open = list()
+        self.release(self.acquire())
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._handles.get_nowait()
+        except Empty:
+            pass
+        try:
+            handle = connect(self.idx, readonly=True, check_same_thread=False, **self.options)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._open.append(handle)
+        return handle
+
+    def release(self, handle):
+        self._handles.put(handle)
+        self._slots.release()
+
+    @contextmanager
+    def handle(self):
+        handle = self.acquire()
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def close(self):
+        with self._lock:
+            for handle in self._open:
+                handle.close()
+            self._open.clear()
+
+    def search(self, rsidlist, header=False):
+        """Return the VCF records for the specified rsIDs, the rsIDs not found, and aliases.
+
+        Aliases are [rsid, current] pairs of merged query rsIDs resolved to current rsIDs.
+        """
+        found = set()
+        aliases = dict()
+        with self.handle() as dbconn:
+            records = list(
+                rsidx.search.search(
+                    rsidlist,
+                    dbconn,
+                    self.vcf,
+                    header=header,
+                    found=found,
+                    threads=self.threads,
+                    aliases=aliases,
+                    tbicache=self.tbicache,
+                    report=False,
+                )
+            )
+        missing = [rsid for rsid in dict.fromkeys(rsidlist) if rsid not in found]
+        return records, missing, sorted(aliases.items())
+
+    def lookup(self, rsidlist):
+        """Return (rsid, chrom, coord) rows, the rsIDs not found, and aliases."""
+        aliases = dict()
+        with self.handle() as dbconn:
+            rows = list(rsidx.search.coords(rsidlist, dbconn, aliases=aliases, report=False))
+        indexed = set(row[0] for row in rows)
+        missing = [rsid for rsid in dict.fromkeys(rsidlist) if rsid not in indexed]
+        return rows, missing, sorted(aliases.items())
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Answer JSON requests against the datasets of an `rsidx serve` daemon.
+
+    GET /status lists the datasets being served. POST /search and POST /lookup take a JSON
+    object with the paths of a VCF file (`vcf`) and its index (`idx`) and a list of rsIDs
+    (`rsids`); /search also takes a `header` flag. Datasets are identified by real paths;
+    /lookup reads only the index, so its `vcf` is optional. Responses list the query rsIDs
+    resolved through the index's merge history as [rsid, current] pairs.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.reply(404, {"error": 'unknown endpoint "{}"'.format(self.path)})
+            return
+        datasets = [{"vcf": d.vcf, "idx": d.idx} for d in self.server.datasets.values()]
+        self.reply(200, {"version": rsidx.cli.get_version(), "datasets": datasets})
+
+    def dataset(self, request):
+        if self.path == "/lookup" and request.get("vcf") is None:
+            idx = os.path.realpath(request["idx"])
+            for key, dataset in self.server.datasets.items():
+                if key[1] == idx:
+                    return dataset
+            message = 'index "{}" is not served'.format(request["idx"])
+        else:
+            dataset = self.server.datasets.get(dataset_key(request["vcf"], request["idx"]))
+            if dataset is not None:
+                return dataset
+            message = 'index "{}" is not served with VCF "{}"'.format(
+                request["idx"], request["vcf"]
+            )
+        self.reply(404, {"error": message})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            rsidlist = [rsid for rsid in map(parse_rsid, request["rsids"]) if rsid is not None]
+            if self.path not in ("/search", "/lookup"):
+                self.reply(404, {"error": 'unknown endpoint "{}"'.format(self.path)})
+                return
+            dataset = self.dataset(request)
+        except (KeyError, TypeError, ValueError) as error:
+            self.reply(400, {"error": "invalid request: {}".format(error)})
+            return
+        if dataset is None:
+            return
+        if self.path == "/search":
+            records, missing, aliases = dataset.search(rsidlist, request.get("header", False))
+            payload = {"records": records}
+        else:
+            rows, missing, aliases = dataset.lookup(rsidlist)
+            payload = {"coords": rows}
+        payload.update(missing=missing, nquery=len(set(rsidlist)), aliases=aliases)
+        self.reply(200, payload)
+
+
+class DatasetServer:
+    """Server mixin that closes the datasets, and removes a Unix socket, on `server_close`."""
+
+    def server_close(self):
+        super().server_close()
+        for dataset in self.datasets.values():
+            dataset.close()
+        if isinstance(self.server_address, str) and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class UnixHTTPServer(DatasetServer, ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPHTTPServer(DatasetServer, ThreadingHTTPServer):
+    pass
+
+
+def make_server(datasets, address, workers=8, threads=4, **options):
+    """Open the (vcf, idx) datasets and return a threaded HTTP server listening on `address`.
+
+    The address is "unix:PATH" for a Unix socket, or "HOST:PORT" for TCP; use a port of 0 to
+    pick a free port. Call `serve_forever` to handle requests and `server_close` to close the
+    datasets. Additional keyword arguments are passed to `rsidx.index.connect`.
+    """
+    kind, location = parse_address(address)
+    opened = dict()
+    try:
+        for vcf, idx in datasets:
+            dataset = Dataset(vcf, idx, workers=workers, threads=threads, **options)
+            opened[dataset_key(vcf, idx)] = dataset
+        if kind == "unix":
+            if os.path.exists(location):
+                os.unlink(location)
+            server = UnixHTTPServer(location, RequestHandler)
+            server.address = "unix:" + location
+        else:
+            server = TCPHTTPServer(location, RequestHandler)
+            server.address = "{}:{}".format(*server.server_address[:2])
+    except BaseException:
+        for dataset in opened.values():
+            dataset.close()
+        raise
+    server.datasets = opened
+    return server
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socketpath = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketpath)
+
+
+def request(address, endpoint, payload=None, timeout=None):
+    """Send a request to an `rsidx serve` daemon and return the decoded JSON response.
+
+    Raises ValueError if the daemon rejects the request, and OSError if it cannot be reached.
+    """
+    kind, location = parse_address(address)
+    if kind == "unix":
+        conn = UnixHTTPConnection(location, timeout=timeout)
+    else:
+        conn = HTTPConnection(*location, timeout=timeout)
+    try:
+        if payload is None:
+            conn.request("GET", endpoint)
+        else:
+            body = json.dumps(payload).encode()
+            headers = {"Content-Type": "application/json"}
+            conn.request("POST", endpoint, body=body, headers=headers)
+        response = conn.getresponse()
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise ValueError(result.get("error", "server error {}".format(response.status)))
+    return result
+
+
+def client_main(args):
+    """Forward an `rsidx search` invocation to a running `rsidx serve` daemon."""
+    vcf, idx = dataset_key(args.vcf, args.idx)
+    payload = {
+        "vcf": vcf,
+        "idx": idx,
+        "rsids": list(rsidx.search.iter_rsids(args.rsid, args.file)),
+    }
+    if args.coords_only:
+        payload["vcf"] = None
+    try:
+        if args.coords_only:
+            result = request(args.server, "/lookup", payload)
+        else:
+            payload["header"] = args.header
+            result = request(args.server, "/search", payload)
+    except ValueError as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    except OSError as error:
+        message = 'cannot reach rsidx server at "{}": {}'.format(args.server, error)
+        print("[rsidx] ERROR:", message, file=sys.stderr)
+        raise SystemExit(1)
+    if not args.coords_only and all(line.startswith("#") for line in result["records"]):
+        print("[rsidx::search] WARNING: no rsID matches", file=sys.stderr)
+    if args.tabix:
+        tbifile = args.out + ".tbi"
+        rsidx.tabix.write_bgzf(result["records"], args.out, threads=args.threads, tbifile=tbifile)
+    else:
+        with rsidx.open(args.out, "w", threads=args.threads) as out:
+            if args.coords_only:
+                rsidx.search.print_coords(result["coords"], out, fmt=args.coords_format)
+            for line in result.get("records", []):
+                print(line, end="", file=out)
+    aliases = dict(result.get("aliases", []))
+    rsidx.search.report_aliases(aliases)
+    if args.aliases:
+        rsidx.search.write_aliases(aliases, args.aliases)
+    missing = result["missing"]
+    rsidx.search.report_missing(len(missing), result["nquery"], missing)
+
+
+def main(args):
+    options = dict(
+        immutable=args.immutable,
+        cache_size=args.cache_size,
+        mmap_size=args.mmap_size,
+    )
+    try:
+        server = make_server(
+            args.dataset, args.listen, workers=args.workers, threads=args.threads, **options
+        )
+    except (ValueError, OSError) as error:
+        print("[rsidx] ERROR:", error, file=sys.stderr)
+        raise SystemExit(1)
+    message = "serving {:d} index(es) at {:s}".format(len(server.datasets), server.address)
+    print("[rsidx::serve]", message, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        print("[rsidx::serve] shutting down", file=sys.stderr)
+    finally:
+        server.server_close()
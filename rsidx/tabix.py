@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from bisect import bisect_right
+import builtins
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from gzip import open as gzopen
+import io
+from itertools import groupby
+import struct
+import threading
+import zlib
+
+
+BGZF_HEADER = struct.Struct("<4BI2BH")
+TBI_HEADER = struct.Struct("<4s8i")
+PSEUDO_BIN = 37450
+MIN_SHIFT = 14
+MAX_COORD = (1 << 31) - 1
+TBX_VCF = 2
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BGZF_BLOCK_SIZE = 0xFF00
+
+
+def voffset(coffset, uoffset):
+    return (coffset << 16) | uoffset
+
+
+def split_voffset(vo):
+    return vo >> 16, vo & 0xFFFF
+
+
+def reg2bins(beg, end):
+    """List the bins that may contain records overlapping the 0-based interval [beg, end)."""
+    bins = [0]
+    end -= 1
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+def reg2bin(beg, end):
+    """Return the smallest bin that contains the 0-based interval [beg, end)."""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def parse_region(regionstr):
+    """Parse a region string such as "chr1", "chr1:1000", or "chr1:1,000-2,000".
+
+    Returns a (chrom, start, end) tuple of 1-based closed coordinates.
+    """
+    chrom, _, interval = regionstr.rpartition(":")
+    if chrom == "" or not interval.replace(",", "").replace("-", "").isdigit():
+        return regionstr, 1, MAX_COORD
+    start, _, end = interval.replace(",", "").partition("-")
+    start = int(start)
+    end = int(end) if end else MAX_COORD
+    if start < 1 or end < start:
+        raise ValueError('invalid region "{}"'.format(regionstr))
+    return chrom, start, end
+
+
+def merge_chunks(chunks, gap=65536):
+    """Merge overlapping chunks and chunks whose compressed offsets are within `gap` bytes.
+
+    Reading through a short run of unneeded records is cheaper than seeking to and inflating
+    the same BGZF block more than once.
+    """
+    merged = list()
+    for beg, end in sorted(chunks):
+        if merged and (beg >> 16) <= (merged[-1][1] >> 16) + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([beg, end])
+    return merged
+
+
+def read_raw_block(fh, filename=None):
+    """Read the next BGZF block from a binary file handle without decompressing it.
+
+    Returns the compressed data, the CRC32 and size of the decompressed data, and the total
+    size of the block, or None at the end of the file.
+    """
+    offset = fh.tell()
+    header = fh.read(BGZF_HEADER.size)
+    if len(header) == 0:
+        return None
+    if len(header) < BGZF_HEADER.size:
+        raise ValueError('truncated BGZF block at offset {:d} of "{}"'.format(offset, filename))
+    id1, id2, cm, flg, mtime, xfl, ostype, xlen = BGZF_HEADER.unpack(header)
+    if (id1, id2, cm, flg) != (31, 139, 8, 4):
+        raise ValueError('invalid BGZF block at offset {:d} of "{}"'.format(offset, filename))
+    extra = fh.read(xlen)
+    bsize = None
+    pos = 0
+    while pos < xlen:
+        si1, si2, slen = struct.unpack_from("<2BH", extra, pos)
+        if (si1, si2) == (66, 67):
+            bsize = struct.unpack_from("<H", extra, pos + 4)[0]
+        pos += 4 + slen
+    if bsize is None:
+        raise ValueError('invalid BGZF block at offset {:d} of "{}"'.format(offset, filename))
+    cdata = fh.read(bsize - xlen - 19)
+    crc, isize = struct.unpack("<2I", fh.read(8))
+    return cdata, crc, isize, bsize + 1
+
+
+def inflate_block(cdata, crc=None, isize=None):
+    data = zlib.decompress(cdata, -15)
+    if isize is not None and (len(data) != isize or zlib.crc32(data) != crc):
+        raise ValueError("corrupted BGZF block: CRC32 or size mismatch")
+    return data
+
+
+def deflate_block(data, level=6):
+    """Compress data (at most BGZF_BLOCK_SIZE bytes) into a single BGZF block."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = BGZF_HEADER.size + 6 + len(cdata) + 8
+    if bsize > 65536:  # incompressible data
+        return deflate_block(data, level=0)
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6)
+    header += struct.pack("<2BHH", 66, 67, 2, bsize - 1)
+    return header + cdata + struct.pack("<2I", zlib.crc32(data), len(data))
+
+
+def is_bgzf(filename):
+    with builtins.open(filename, "rb") as fh:
+        header = fh.read(BGZF_HEADER.size + 6)
+    if len(header) < BGZF_HEADER.size + 6:
+        return False
+    id1, id2, cm, flg, mtime, xfl, ostype, xlen = BGZF_HEADER.unpack_from(header)
+    return (id1, id2, cm, flg) == (31, 139, 8, 4) and header[12:14] == b"BC"
+
+
+class ThreadedBgzfReader(io.RawIOBase):
+    """Binary stream of the decompressed contents of a BGZF file.
+
+    BGZF blocks are independent, so blocks are read ahead of the consumer and decompressed
+    on a pool of threads (zlib releases the GIL while inflating). Decompressed blocks are
+    handed to the consumer in file order.
+    """
+
+    def __init__(self, filename, threads=4, readahead=None):
+        self.filename = filename
+        self._fh = builtins.open(filename, "rb")
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._readahead = readahead or threads * 16
+        self._pending = deque()
+        self._eof = False
+        self._data = b""
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while not self._eof and len(self._pending) < self._readahead:
+            block = read_raw_block(self._fh, self.filename)
+            if block is None:
+                self._eof = True
+                break
+            cdata, crc, isize, bsize = block
+            self._pending.append(self._pool.submit(inflate_block, cdata, crc, isize))
+
+    def readinto(self, buffer):
+        while self._pos >= len(self._data):
+            self._fill()
+            if len(self._pending) == 0:
+                return 0
+            self._data = self._pending.popleft().result()
+            self._pos = 0
+        n = min(len(buffer), len(self._data) - self._pos)
+        buffer[:n] = self._data[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._pool.shutdown(wait=True)
+            self._fh.close()
+        super().close()
+
+
+class BgzfReader:
+    """Minimal reader for BGZF compressed files with support for virtual file offsets.
+
+    A BGZF file is a series of independent gzip blocks. A virtual file offset combines the
+    offset of a block in the compressed file with an offset into the decompressed block, so
+    that any line can be reached with a single seek and a single block decompression.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = builtins.open(filename, "rb")
+        self._blockstart = 0
+        self._nextblock = 0
+        self._data = b""
+        self._within = 0
+        self.nblocks = 0
+        self.nbytes = 0
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_block(self, offset):
+        """Decompress the block at the specified offset; return the data and the next offset."""
+        self._fh.seek(offset)
+        block = read_raw_block(self._fh, self.filename)
+        if block is None:
+            return None, offset
+        cdata, crc, isize, bsize = block
+        self.nblocks += 1
+        self.nbytes += bsize
+        return inflate_block(cdata, crc, isize), offset + bsize
+
+    def _load(self, offset):
+        if offset == self._blockstart and self._nextblock > offset:
+            self._within = 0
+            return True
+        data, nextblock = self.read_block(offset)
+        self._blockstart = offset
+        self._nextblock = nextblock
+        self._data = data if data is not None else b""
+        self._within = 0
+        return data is not None
+
+    def seek(self, vo):
+        coffset, uoffset = split_voffset(vo)
+        self._load(coffset)
+        self._within = uoffset
+
+    def tell(self):
+        """Return the virtual offset of the next byte to be read.
+
+        As with htslib, the offset of a fully consumed block is reported as the start of the
+        following block.
+        """
+        if self._within >= len(self._data):
+            return voffset(self._nextblock, 0)
+        return voffset(self._blockstart, self._within)
+
+    def readline(self):
+        pieces = list()
+        while True:
+            if self._within >= len(self._data):
+                if not self._load(self._nextblock):
+                    break
+                continue
+            end = self._data.find(b"\n", self._within)
+            if end >= 0:
+                pieces.append(self._data[self._within : end + 1])
+                self._within = end + 1
+                break
+            pieces.append(self._data[self._within :])
+            self._within = len(self._data)
+        return b"".join(pieces)
+
+    def lines(self, start=0, end=None):
+        """Yield each line beginning at a virtual offset in the interval [start, end)."""
+        for vo, line in self.offset_lines(start, end):
+            yield line
+
+    def offset_lines(self, start=0, end=None):
+        """Yield (virtual offset, line) for each line beginning in the interval [start, end)."""
+        self.seek(start)
+        while True:
+            vo = self.tell()
+            if end is not None and vo >= end:
+                break
+            line = self.readline()
+            if line == b"":
+                break
+            yield vo, line
+
+
+class BgzfWriter:
+    """Minimal writer for BGZF compressed files with support for virtual file offsets."""
+
+    def __init__(self, filename, level=6):
+        self.filename = filename
+        self.level = level
+        self._fh = builtins.open(filename, "wb")
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def tell(self):
+        """Return the virtual offset of the next byte to be written."""
+        return voffset(self._offset, len(self._buffer))
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+
+    def _write_block(self, data):
+        block = deflate_block(data, level=self.level)
+        self._fh.write(block)
+        self._offset += len(block)
+
+    def flush(self):
+        """Compress any buffered data into a block, so that the next write starts a new block."""
+        if len(self._buffer) > 0:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        if self._fh.closed:
+            return
+        self.flush()
+        self._fh.write(BGZF_EOF)
+        self._fh.close()
+
+
+class ThreadedBgzfWriter(io.RawIOBase):
+    """Binary stream that writes a BGZF file, compressing blocks on a pool of threads.
+
+    BGZF blocks are independent, so each full block is deflated on one of `threads` threads
+    (zlib releases the GIL while deflating) and compressed blocks are written in order. At
+    most `backlog` blocks are in flight at a time.
+
+    The compressed offset of a block is not known until the blocks before it are compressed,
+    so `block_tell` reports virtual offsets with the block number in place of the compressed
+    offset. These preserve the order of virtual offsets; convert them with `resolve` once the
+    blocks have been written, such as after the writer is closed.
+    """
+
+    def __init__(self, filename, threads=4, level=6, backlog=None):
+        self.filename = filename
+        self.level = level
+        self._fh = builtins.open(filename, "wb")
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._backlog = backlog or threads * 16
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._sizes = list()
+        self._offsets = [0]
+
+    def writable(self):
+        return True
+
+    def block_tell(self):
+        """Return the block number and offset of the next byte as a virtual offset."""
+        return voffset(len(self._sizes), len(self._buffer))
+
+    def resolve(self, vo):
+        """Convert a virtual offset from `block_tell` into a true BGZF virtual offset.
+
+        As with `BgzfReader.tell`, the end of a block is reported as the start of the next.
+        """
+        blocknum, uoffset = split_voffset(vo)
+        if blocknum < len(self._sizes) and uoffset >= self._sizes[blocknum]:
+            blocknum, uoffset = blocknum + 1, 0
+        return voffset(self._offsets[blocknum], uoffset)
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, data):
+        self._sizes.append(len(data))
+        self._pending.append(self._pool.submit(deflate_block, data, self.level))
+        self._drain(self._backlog)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            block = self._pending.popleft().result()
+            self._fh.write(block)
+            self._offsets.append(self._offsets[-1] + len(block))
+
+    def close(self):
+        if not self.closed:
+            try:
+                if len(self._buffer) > 0:
+                    self._submit(bytes(self._buffer))
+                    self._buffer.clear()
+                self._drain(0)
+                self._fh.write(BGZF_EOF)
+            finally:
+                self._pool.shutdown(wait=True)
+                self._fh.close()
+        super().close()
+
+
+def write_bgzf(lines, filename, threads=4, tbifile=None, level=6):
+    """Write text lines to a BGZF file, compressing blocks on a pool of threads.
+
+    If `tbifile` is given, the lines must be a sorted VCF, and its tabix index is built in
+    the same pass.
+    """
+    builder = TabixIndexBuilder() if tbifile else None
+    with ThreadedBgzfWriter(filename, threads=threads, level=level) as writer:
+        for line in lines:
+            data = line.encode()
+            start = writer.block_tell()
+            writer.write(data)
+            if builder is not None:
+                builder.add_line(data, start, writer.block_tell())
+    if builder is not None:
+        builder.write(tbifile, remap=writer.resolve)
+
+
+class TabixIndexBuilder:
+    """Accumulate the tabix index of a sorted VCF file record by record."""
+
+    def __init__(self):
+        self.names = list()
+        self.bins = list()
+        self.linear = list()
+        self.extents = list()
+        self.counts = list()
+
+    def add(self, chrom, beg, end, start_vo, end_vo):
+        """Add a record spanning the 0-based interval [beg, end) at [start_vo, end_vo)."""
+        if len(self.names) == 0 or self.names[-1] != chrom:
+            if chrom in self.names:
+                raise ValueError('VCF is not sorted: "{}" is not contiguous'.format(chrom))
+            self.names.append(chrom)
+            self.bins.append(dict())
+            self.linear.append(list())
+            self.extents.append([start_vo, end_vo])
+            self.counts.append(0)
+        chunks = self.bins[-1].setdefault(reg2bin(beg, end), list())
+        if chunks and chunks[-1][1] == start_vo:
+            chunks[-1][1] = end_vo
+        else:
+            chunks.append([start_vo, end_vo])
+        linear = self.linear[-1]
+        last = (max(end, beg + 1) - 1) >> MIN_SHIFT
+        if len(linear) <= last:
+            linear.extend([None] * (last + 1 - len(linear)))
+        for window in range(beg >> MIN_SHIFT, last + 1):
+            if linear[window] is None:
+                linear[window] = start_vo
+        self.extents[-1][1] = end_vo
+        self.counts[-1] += 1
+
+    def add_line(self, line, start_vo, end_vo):
+        """Add a VCF record line (bytes); header lines are ignored."""
+        if line.startswith(b"#"):
+            return
+        chrom, pos, rsid, ref = line.split(b"\t", 4)[:4]
+        beg = int(pos) - 1
+        self.add(chrom.decode(), beg, beg + len(ref), start_vo, end_vo)
+
+    def write(self, filename, remap=None):
+        """Write the tabix index.
+
+        If given, `remap` is applied to every virtual offset, as when the offsets were taken
+        from `ThreadedBgzfWriter.block_tell`.
+        """
+        remap = remap if remap is not None else (lambda vo: vo)
+        names = b"".join(name.encode() + b"\x00" for name in self.names)
+        nref = len(self.names)
+        header = TBI_HEADER.pack(b"TBI\x01", nref, TBX_VCF, 1, 2, 0, ord("#"), 0, len(names))
+        data = [header, names]
+        for bins, linear, extent, count in zip(self.bins, self.linear, self.extents, self.counts):
+            data.append(struct.pack("<i", len(bins) + 1))
+            for binnum in sorted(bins):
+                chunks = bins[binnum]
+                data.append(struct.pack("<Ii", binnum, len(chunks)))
+                data.extend(struct.pack("<QQ", remap(beg), remap(end)) for beg, end in chunks)
+            data.append(struct.pack("<Ii", PSEUDO_BIN, 2))
+            data.append(struct.pack("<QQQQ", remap(extent[0]), remap(extent[1]), count, 0))
+            previous = 0
+            filled = list()
+            for vo in linear:
+                previous = previous if vo is None else remap(vo)
+                filled.append(previous)
+            data.append(struct.pack("<i{:d}Q".format(len(filled)), len(filled), *filled))
+        data.append(struct.pack("<Q", 0))
+        with BgzfWriter(filename) as writer:
+            writer.write(b"".join(data))
+
+
+def write_tabix(vcffile, tbifile=None):
+    """Build the tabix index of a sorted and bgzipped VCF file, without the `tabix` program."""
+    builder = TabixIndexBuilder()
+    with BgzfReader(vcffile) as reader:
+        while True:
+            start_vo = reader.tell()
+            line = reader.readline()
+            if line == b"":
+                break
+            builder.add_line(line, start_vo, reader.tell())
+    builder.write(tbifile or vcffile + ".tbi")
+
+
+class TabixIndex:
+    """Parsed contents of a tabix (.tbi) index file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with gzopen(filename, "rb") as fh:
+            data = fh.read()
+        magic, nref, fmt, colseq, colbeg, colend, meta, skip, lnm = TBI_HEADER.unpack_from(data)
+        if magic != b"TBI\x01":
+            raise ValueError('invalid tabix index "{}"'.format(filename))
+        self.format = fmt
+        self.columns = (colseq, colbeg, colend)
+        self.meta = chr(meta)
+        self.skip = skip
+        pos = TBI_HEADER.size
+        self.names = [name.decode() for name in data[pos : pos + lnm].split(b"\x00") if name]
+        pos += lnm
+        self.bins = list()
+        self.linear = list()
+        self.extents = list()
+        for _ in range(nref):
+            bins = dict()
+            extent = None
+            (nbin,) = struct.unpack_from("<i", data, pos)
+            pos += 4
+            for _ in range(nbin):
+                binnum, nchunk = struct.unpack_from("<Ii", data, pos)
+                pos += 8
+                chunks = list(struct.iter_unpack("<QQ", data[pos : pos + 16 * nchunk]))
+                pos += 16 * nchunk
+                if binnum == PSEUDO_BIN:
+                    extent = chunks[0]
+                else:
+                    bins[binnum] = chunks
+            (nintv,) = struct.unpack_from("<i", data, pos)
+            pos += 4
+            linear = list(struct.unpack_from("<{:d}Q".format(nintv), data, pos))
+            pos += 8 * nintv
+            if extent is None and len(bins) > 0:
+                chunks = [chunk for binchunks in bins.values() for chunk in binchunks]
+                extent = (min(c[0] for c in chunks), max(c[1] for c in chunks))
+            self.bins.append(bins)
+            self.linear.append(linear)
+            self.extents.append(extent)
+
+    def boundaries(self):
+        """Return the sorted virtual offsets at which records may safely be split.
+
+        These include the first record of each sequence and the first record of each 16 kb
+        window of the linear index.
+        """
+        offsets = set()
+        for extent, linear in zip(self.extents, self.linear):
+            if extent is not None:
+                offsets.add(extent[0])
+            offsets.update(vo for vo in linear if vo > 0)
+        return sorted(offsets)
+
+
+class TabixIndexCache:
+    """Parsed tabix indexes keyed by the path of the indexed file, shared between threads.
+
+    A `TabixIndex` is not modified once it is loaded, so many `TabixFile` objects, each with
+    its own file handle, can share it. Each index is loaded on first use.
+    """
+
+    def __init__(self):
+        self._indexes = dict()
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        with self._lock:
+            index = self._indexes.get(filename)
+            if index is None:
+                index = TabixIndex(filename + ".tbi")
+                self._indexes[filename] = index
+        return index
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+class TabixFile:
+    """Random access to a bgzipped and tabix-indexed file without the `tabix` program.
+
+    The tabix index is loaded once when the file is opened, unless a parsed `index` is
+    given. Each query computes the BGZF chunks that may contain overlapping records,
+    coalesces nearby chunks so that each block is inflated at most once, and scans only
+    those chunks.
+    """
+
+    def __init__(self, filename, indexfile=None, index=None):
+        self.filename = filename
+        self.index = index if index is not None else TabixIndex(indexfile or filename + ".tbi")
+        self.reader = BgzfReader(filename)
+        self.refids = {name: i for i, name in enumerate(self.index.names)}
+        colseq, colbeg, colend = self.index.columns
+        self._colseq = colseq - 1
+        self._colbeg = colbeg - 1
+        self._colend = colend - 1
+        self._ncols = max(self.index.columns) + (2 if self.index.format & 0xFFFF == TBX_VCF else 0)
+        self._meta = self.index.meta.encode()
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def header(self):
+        """Yield the header lines at the beginning of the file."""
+        for n, line in enumerate(self.reader.lines()):
+            if n >= self.index.skip and not line.startswith(self._meta):
+                break
+            yield line
+
+    def chunks(self, chrom, beg, end):
+        """List the BGZF chunks that may contain records overlapping [beg, end) (0-based)."""
+        refid = self.refids.get(chrom)
+        if refid is None:
+            return list()
+        bins = self.index.bins[refid]
+        linear = self.index.linear[refid]
+        window = beg >> MIN_SHIFT
+        minoffset = linear[window] if window < len(linear) else 0
+        chunks = list()
+        for binnum in reg2bins(beg, end):
+            for chunk in bins.get(binnum, []):
+                if chunk[1] > minoffset:
+                    chunks.append(chunk)
+        return chunks
+
+    def interval(self, line):
+        """Return the chromosome and 1-based closed interval spanned by a record."""
+        values = line.split(b"\t", self._ncols)
+        start = int(values[self._colbeg])
+        if self.index.format & 0xFFFF == TBX_VCF:
+            end = start + len(values[3]) - 1
+        elif self._colend >= 0:
+            end = int(values[self._colend])
+        else:
+            end = start
+        return values[self._colseq].decode(), start, end
+
+    def fetch(self, chrom, intervals, gap=65536):
+        """Yield each record overlapping any of the given 1-based closed intervals.
+
+        The intervals are on a single chromosome. Each record is reported at most once and
+        in file order.
+        """
+        merged = list()
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        if len(merged) == 0:
+            return
+        starts = [start for start, end in merged]
+        ends = [end for start, end in merged]
+        chunks = list()
+        for start, end in merged:
+            chunks.extend(self.chunks(chrom, start - 1, end))
+        for beg, end in merge_chunks(chunks, gap=gap):
+            for line in self.reader.lines(beg, end):
+                if line.startswith(self._meta):
+                    continue
+                seqid, recstart, recend = self.interval(line)
+                if seqid != chrom:
+                    continue
+                if recstart > ends[-1]:
+                    return
+                i = bisect_right(starts, recend) - 1
+                if i >= 0 and ends[i] >= recstart:
+                    yield line
+
+    def query(self, regions, header=False, gap=65536):
+        """Yield records overlapping the given (chrom, start, end) regions.
+
+        Regions are grouped by chromosome in the order they are given; records from each
+        chromosome are reported in file order.
+        """
+        if header:
+            yield from self.header()
+        for chrom, group in groupby(regions, key=lambda region: region[0]):
+            intervals = [(start, end) for _, start, end in group]
+            yield from self.fetch(chrom, intervals, gap=gap)
@@ -25,3 +25,29 @@ def TempFileName(*args, **kwds):
             yield tf.name
         finally:
             pass
+
+
+RECORD_BOTH_VCF = (
+    "##fileformat=VCFv4.1\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    "17\t100\trs7\tA\tG\t.\t.\t.\n"
+    "17\t200\trs7\tC\tT\t.\t.\t.\n"
+    "17\t300\trs8\tG\tA\t.\t.\t.\n"
+)
+
+
+def record_both_index(dirname):
+    """Build an index in which rs7 has an alternate coordinate recorded by `rsidx update`."""
+    import rsidx
+
+    vcffile = os.path.join(dirname, "record-both.vcf.gz")
+    idxfile = os.path.join(dirname, "record-both.rsidx")
+    lines = RECORD_BOTH_VCF.splitlines(keepends=True)
+    rsidx.tabix.write_bgzf(lines, vcffile, threads=1, tbifile=vcffile + ".tbi")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", vcffile, idxfile]))
+    updatefile = os.path.join(dirname, "update.vcf")
+    with open(updatefile, "w") as fh:
+        fh.writelines(lines[:2] + lines[3:4])
+    arglist = ["update", "--policy", "record-both", updatefile, idxfile]
+    rsidx.index.update_main(rsidx.cli.get_parser().parse_args(arglist))
+    return vcffile, idxfile
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import asyncio
+import pytest
+import rsidx
+import rsidx.aio
+from rsidx.tests import data_file
+
+
+RSIDS = ["rs544992196", "rs1335948438", "rs182553373", "rs1245348147", "rs1440788236"]
+
+
+def expected_records():
+    vcffile = data_file("chr17-sample.vcf.gz")
+    return list(rsidx.search.search(RSIDS, data_file("chr17-sample.rsidx"), vcffile))
+
+
+def test_aio_search():
+    async def run():
+        lines = rsidx.aio.search(
+            RSIDS, data_file("chr17-sample.rsidx"), data_file("chr17-sample.vcf.gz")
+        )
+        return [line async for line in lines]
+
+    assert asyncio.run(run()) == expected_records()
+
+
+def test_aio_concurrent_searches():
+    async def consume(index, rsidlist):
+        return [line async for line in index.search(rsidlist)]
+
+    async def run():
+        vcffile, idxfile = data_file("chr17-sample.vcf.gz"), data_file("chr17-sample.rsidx")
+        async with rsidx.aio.AsyncIndex(vcffile, idxfile, max_workers=3, queue_size=2) as index:
+            tasks = [consume(index, RSIDS) for _ in range(20)]
+            results = await asyncio.gather(*tasks)
+            coords = await index.lookup(["rs1245348147"])
+        return results, coords
+
+    results, coords = asyncio.run(run())
+    assert results == [expected_records()] * 20
+    assert coords == [("17", 1946968)]
+
+
+def test_aio_tabix_index_loaded_once(monkeypatch):
+    expected = expected_records()
+    loaded = list()
+
+    class CountingTabixIndex(rsidx.tabix.TabixIndex):
+        def __init__(self, filename):
+            loaded.append(filename)
+            super().__init__(filename)
+
+    monkeypatch.setattr(rsidx.tabix, "TabixIndex", CountingTabixIndex)
+
+    async def consume(index, rsidlist):
+        return [line async for line in index.search(rsidlist)]
+
+    async def run():
+        vcffile, idxfile = data_file("chr17-sample.vcf.gz"), data_file("chr17-sample.rsidx")
+        async with rsidx.aio.AsyncIndex(vcffile, idxfile, max_workers=4) as index:
+            return await asyncio.gather(*[consume(index, RSIDS) for _ in range(16)])
+
+    results = asyncio.run(run())
+    assert results == [expected] * 16
+    assert loaded == [data_file("chr17-sample.vcf.gz") + ".tbi"]
+
+
+def test_aio_early_exit():
+    async def run():
+        vcffile, idxfile = data_file("chr17-sample.vcf.gz"), data_file("chr17-sample.rsidx")
+        async with rsidx.aio.AsyncIndex(vcffile, idxfile, max_workers=1, queue_size=1) as index:
+            lines = index.search(RSIDS, header=True)
+            first = await lines.__anext__()
+            await lines.aclose()
+            rest = [line async for line in index.search(RSIDS)]
+        return first, rest
+
+    first, rest = asyncio.run(run())
+    assert first.startswith("##fileformat=VCF")
+    assert rest == expected_records()
+
+
+def test_aio_bad_index(tmp_path):
+    with pytest.raises(ValueError, match=r"does not exist"):
+        rsidx.aio.AsyncIndex(data_file("chr17-sample.vcf.gz"), str(tmp_path / "bogus.rsidx"))
+
+
+def test_aio_error():
+    async def run():
+        idxfile = data_file("chr17-sample.rsidx")
+        async with rsidx.aio.AsyncIndex("bogus.vcf.gz", idxfile) as index:
+            return [line async for line in index.search(RSIDS)]
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(run())
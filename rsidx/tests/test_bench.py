@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from itertools import islice
+import json
+import random
+import rsidx
+from rsidx.bench import synthetic_records, synthetic_rsids, write_synthetic_vcf
+from rsidx.tabix import TabixFile
+
+
+def test_synthetic_records():
+    records = list(synthetic_records(1000, nchroms=3, multi_rate=0.1, seed=1))
+    assert len(records) == 1000
+    assert [chrom for chrom, *values in records[::334]] == ["1", "2", "3"]
+    rsids = [rsid for record in records for rsid in record[2]]
+    assert len(rsids) == len(set(rsids))
+    assert 50 < sum(len(record[2]) == 2 for record in records) < 150
+    assert records == list(synthetic_records(1000, nchroms=3, multi_rate=0.1, seed=1))
+
+
+def test_synthetic_rsids_density():
+    rng = random.Random(1)
+    rsids = list(islice(synthetic_rsids(rng, density=0.25, block=100), 10000))
+    assert len(set(rsids)) == 10000
+    assert 0.22 < 10000 / max(rsids) < 0.28
+    assert rsids[:100] != sorted(rsids[:100])
+    assert max(rsids[:100]) < min(rsids[100:200])
+
+
+def test_write_synthetic_vcf(tmp_path):
+    vcffile = str(tmp_path / "test.vcf.gz")
+    sample = write_synthetic_vcf(vcffile, 5000, nchroms=2, seed=1, nsample=100)
+    with rsidx.open(vcffile, "r") as fh:
+        records = [line for line in fh if not line.startswith("#")]
+    assert len(records) == 5000
+    rsids = [int(rsid[2:]) for line in records for rsid in line.split("\t")[2].split(";")]
+    assert len(sample) == 100
+    assert set(sample) <= set(rsids)
+    assert max(rsids.index(rsid) for rsid in sample) > len(rsids) / 2
+    with TabixFile(vcffile) as tbx:
+        chrom, pos = records[2600].split("\t")[:2]
+        lines = list(tbx.fetch(chrom, [(int(pos), int(pos))]))
+        assert lines == [records[2600].encode()]
+    idxfile = str(tmp_path / "test.rsidx")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", vcffile, idxfile]))
+    observed = list(rsidx.search.search(["rs{:d}".format(rsids[-1])], idxfile, vcffile))
+    assert observed == records[-1:]
+
+
+def test_bench_cli(capsys, tmp_path):
+    arglist = ["bench", "-n", "2000", "-q", "50", "--workdir", str(tmp_path)]
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    report = json.loads(terminal.out)
+    assert report["params"]["nrecords"] == 2000
+    results = report["results"]
+    assert list(results) == [
+        "generate",
+        "index",
+        "binary_index",
+        "single_lookup",
+        "batch_lookup",
+        "fetch",
+        "binary_batch_lookup",
+    ]
+    assert results["batch_lookup"]["matches"] == 50
+    assert results["binary_batch_lookup"]["matches"] == 50
+    assert results["binary_index"]["bytes"] < results["index"]["bytes"]
+    assert results["fetch"]["records"] == 50
+    assert (tmp_path / "bench.rsidx").exists()
+    assert "[rsidx::bench] fetch" in terminal.err
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    report = json.loads(capsys.readouterr().out)
+    assert report["results"]["fetch"]["records"] == 50
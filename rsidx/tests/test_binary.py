@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from contextlib import closing
+import os
+import pytest
+import rsidx
+from rsidx.bench import write_synthetic_vcf
+from rsidx.binary import BinaryIndex
+from rsidx.tests import data_file
+import sqlite3
+
+
+def build_binary(vcf, idxfile):
+    arglist = ["index", "--format", "bin", data_file(vcf), idxfile]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.index.main(args)
+
+
+@pytest.mark.parametrize(
+    "vcf,idx",
+    [
+        ("chr17-sample.vcf.gz", "chr17-sample.rsidx"),
+        ("chr9-multi.vcf.gz", "chr9-multi.rsidx"),
+        ("multiple_id.vcf.gz", "multiple_id.rsidx"),
+        ("chr4-sample-corrupted-ids.vcf.gz", "chr4-sample-corrupted-ids.rsidx"),
+    ],
+)
+def test_binary_index(vcf, idx, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary(vcf, idxfile)
+    conn = sqlite3.connect(data_file(idx))
+    expected = list(conn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    conn.close()
+    rsidx.index.check_index(idxfile)
+    with rsidx.index.connect(idxfile, readonly=True) as binindex:
+        assert isinstance(binindex, BinaryIndex)
+        assert list(binindex.rows()) == expected
+        assert binindex.get(expected[-1][0]) == expected[-1][1:]
+        assert binindex.get(expected[-1][0] + 1) is None
+        rsids = [0] + [row[0] for row in expected[::3]] + [2**40]
+        assert list(binindex.lookup(rsids)) == expected[::3]
+
+
+def test_binary_index_smaller(tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary("chr17-sample.vcf.gz", idxfile)
+    assert os.path.getsize(idxfile) < os.path.getsize(data_file("chr17-sample.rsidx"))
+
+
+def test_binary_index_smaller_than_sqlite(tmp_path):
+    vcffile = str(tmp_path / "test.vcf.gz")
+    sample = write_synthetic_vcf(vcffile, 20000, seed=1, nsample=5000)
+    queries = ["rs{:d}".format(rsid) for rsid in sample]
+    sizes, results = dict(), dict()
+    for fmt in ("sqlite", "bin"):
+        idxfile = str(tmp_path / "test.{:s}.rsidx".format(fmt))
+        arglist = ["index", "--format", fmt, vcffile, idxfile]
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+        sizes[fmt] = os.path.getsize(idxfile)
+        with closing(rsidx.index.connect(idxfile, readonly=True)) as dbconn:
+            results[fmt] = list(rsidx.search.coords(queries, dbconn))
+    assert results["bin"] == results["sqlite"]
+    assert sizes["bin"] < 0.7 * sizes["sqlite"]
+
+
+def test_binary_index_incomplete(tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary("chr17-sample.vcf.gz", idxfile)
+    with open(idxfile, "rb") as fh:
+        data = fh.read()
+    with open(idxfile, "wb") as fh:
+        fh.write(data[:-1000])
+    with pytest.raises(ValueError, match=r"is incomplete"):
+        rsidx.index.check_index(idxfile)
+
+
+@pytest.mark.parametrize(
+    "vcf,idx,rsidlist",
+    [
+        (
+            "chr17-sample.vcf.gz",
+            "chr17-sample.rsidx",
+            ["rs1472751972", "rs1287502205", "rs897983471", "rs123", "rs189123651"],
+        ),
+        ("chr9-multi.vcf.gz", "chr9-multi.rsidx", ["rs60995877"]),
+        ("multiple_id.vcf.gz", "multiple_id.rsidx", ["rs145742571", "rs72634902"]),
+    ],
+)
+def test_binary_search(vcf, idx, rsidlist, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary(vcf, idxfile)
+    vcffile = data_file(vcf)
+    conn = sqlite3.connect(data_file(idx))
+    expected = list(rsidx.search.search(rsidlist, conn, vcffile, header=True))
+    conn.close()
+    assert list(rsidx.search.search(rsidlist, idxfile, vcffile, header=True)) == expected
+    conn = sqlite3.connect(data_file(idx))
+    coords = list(rsidx.search.lookup(conn, rsidlist))
+    conn.close()
+    with BinaryIndex(idxfile) as binindex:
+        assert list(rsidx.search.lookup(binindex, rsidlist)) == coords
+    with rsidx.RsidIndex(vcffile, idxfile) as index:
+        assert list(index.search(rsidlist, header=True)) == expected
+
+
+def test_binary_search_cli(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary("chr17-sample.vcf.gz", idxfile)
+    arglist = ["search", data_file("chr17-sample.vcf.gz"), idxfile, "rs1472751972", "rs123"]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.search.main(args)
+    terminal = capsys.readouterr()
+    assert terminal.out.startswith("17\t132359\trs1472751972\t")
+    assert "1 of 2 rsIDs not found: rs123" in terminal.err
+
+
+def test_sort_rsids(tmp_path):
+    rsids = [5, 3, 9, 3, 1, 7, 9, 2, 8]
+    expected = sorted(set(rsids))
+    for buffer_size in (1, 2, 4, 100):
+        assert list(rsidx.search.sort_rsids(rsids, str(tmp_path), buffer_size)) == expected
+    assert list(rsidx.search.sort_rsids([], str(tmp_path), 2)) == []
+
+
+def test_binary_matches_spilled(tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    build_binary("chr17-sample.vcf.gz", idxfile)
+    conn = sqlite3.connect(data_file("chr17-sample.rsidx"))
+    rsids = [row[0] for row in conn.execute("SELECT rsid FROM rsid_to_coord")][::7]
+    conn.close()
+    rsidlist = ["rs{:d}".format(rsid) for rsid in reversed(rsids)] + ["rs123", "rs124"]
+    with BinaryIndex(idxfile) as binindex:
+        with rsidx.search.matches(binindex, rsidlist, buffer_size=1e6) as result:
+            expected = list(result.rows)
+            assert sorted(result.unmatched()) == [123, 124]
+        with rsidx.search.matches(binindex, rsidlist, buffer_size=3) as result:
+            assert list(result.rows) == expected
+            assert sorted(result.unmatched()) == [123, 124]
+            assert result.nquery() == len(rsids) + 2
+    assert [row[:2] for row in expected] == sorted(row[:2] for row in expected)
+    assert len(expected) == len(rsids)
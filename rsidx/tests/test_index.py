@@ -7,10 +7,12 @@
 # and is licensed under the BSD license: see LICENSE.txt.
 # -----------------------------------------------------------------------------
 
+import json
 import os
 import pytest
 import rsidx
 from rsidx.tests import data_file, TempFileName
+import shutil
 import sqlite3
 from tempfile import NamedTemporaryFile
 
@@ -122,3 +124,669 @@ def test_index_force_reindex(capsys):
         rsidx.index.main(args)
     terminal = capsys.readouterr()
     assert ", overwriting" in terminal.err
+
+
+@pytest.mark.parametrize(
+    "vcf,buffersize",
+    [
+        ("chr17-sample.vcf.gz", 1e7),
+        ("chr17-sample.vcf.gz", 100),
+        ("chr9-multi.vcf.gz", 2),
+        ("multiple_id.vcf.gz", 3),
+    ],
+)
+def test_index_bulk(vcf, buffersize):
+    vcffile = data_file(vcf)
+    with TempFileName(suffix=".rsidx") as idx1, TempFileName(suffix=".rsidx") as idx2:
+        with sqlite3.connect(idx1) as dbconn, rsidx.open(vcffile, "r") as vcffh:
+            rsidx.index.index(dbconn, vcffh)
+            expected = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+        with sqlite3.connect(idx2) as dbconn, rsidx.open(vcffile, "r") as vcffh:
+            rsidx.index.index(dbconn, vcffh, bulk=True, buffer_size=buffersize)
+            observed = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    assert len(observed) > 0
+    assert observed == expected
+
+
+def test_sort_rows_first_occurrence(tmp_path):
+    rows = [(5, "1", 100), (3, "1", 200), (5, "2", 300), (1, "2", 400), (3, "3", 500)]
+    observed = list(rsidx.index.sort_rows(rows, str(tmp_path), buffer_size=2))
+    assert observed == [(1, "2", 400), (3, "1", 200), (5, "1", 100)]
+
+
+def test_index_bulk_cli():
+    with TempFileName(suffix=".rsidx") as idxfile:
+        arglist = [
+            "index",
+            "--bulk",
+            "--buffer-size",
+            "50",
+            data_file("chr17-sample.vcf.gz"),
+            idxfile,
+        ]
+        args = rsidx.cli.get_parser().parse_args(arglist)
+        rsidx.index.main(args)
+        conn = sqlite3.connect(idxfile)
+        query = "SELECT * FROM rsid_to_coord WHERE rsid IN (548749810, 956322221)"
+        results = list(conn.execute(query))
+        assert sorted(results) == sorted([(548749810, "17", 1098730), (956322221, "17", 1227227)])
+
+
+@pytest.mark.parametrize(
+    "vcf,threads",
+    [
+        ("chr17-sample.vcf.gz", 2),
+        ("chr17-sample.vcf.gz", 4),
+        ("chr9-multi.vcf.gz", 2),
+        ("multiple_id.vcf.gz", 3),
+        ("chr4-sample-corrupted-ids.vcf.gz", 2),
+    ],
+)
+def test_index_parallel(vcf, threads):
+    vcffile = data_file(vcf)
+    with TempFileName(suffix=".rsidx") as idx1, TempFileName(suffix=".rsidx") as idx2:
+        with sqlite3.connect(idx1) as dbconn, rsidx.open(vcffile, "r") as vcffh:
+            rsidx.index.index(dbconn, vcffh)
+            expected = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+        with sqlite3.connect(idx2) as dbconn:
+            rsidx.index.index_parallel(dbconn, vcffile, threads)
+            observed = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    assert len(observed) > 0
+    assert observed == expected
+
+
+def test_partition_covers_all_lines():
+    vcffile = data_file("chr17-sample.vcf.gz")
+    tbi = rsidx.tabix.TabixIndex(vcffile + ".tbi")
+    intervals = rsidx.index.partition(tbi, 8)
+    assert len(intervals) > 2
+    with rsidx.tabix.BgzfReader(vcffile) as reader:
+        observed = [line for start, end in intervals for line in reader.lines(start, end)]
+    with rsidx.open(vcffile, "r") as fh:
+        expected = [line.encode() for line in fh]
+    assert observed == expected
+
+
+def test_index_parallel_cli(capsys):
+    with TempFileName(suffix=".rsidx") as idxfile:
+        arglist = ["index", "--threads", "2", data_file("chr17-sample.vcf.gz"), idxfile]
+        args = rsidx.cli.get_parser().parse_args(arglist)
+        rsidx.index.main(args)
+        conn = sqlite3.connect(idxfile)
+        query = "SELECT * FROM rsid_to_coord WHERE rsid IN (548749810, 956322221)"
+        results = list(conn.execute(query))
+        assert sorted(results) == sorted([(548749810, "17", 1098730), (956322221, "17", 1227227)])
+    terminal = capsys.readouterr()
+    assert "[rsidx::index] merged shard" in terminal.err
+
+
+@pytest.mark.parametrize("readonly,immutable", [(False, False), (True, False), (True, True)])
+def test_connect(readonly, immutable):
+    idxfile = data_file("chr17-sample.rsidx")
+    dbconn = rsidx.index.connect(
+        idxfile, readonly=readonly, immutable=immutable, cache_size=4000, mmap_size=4000000
+    )
+    assert dbconn.execute("PRAGMA cache_size").fetchone() == (-4000,)
+    assert dbconn.execute("PRAGMA mmap_size").fetchone() == (4000000,)
+    query = "SELECT * FROM rsid_to_coord WHERE rsid = 1472751972"
+    assert list(dbconn.execute(query)) == [(1472751972, "17", 132359)]
+    if readonly:
+        with pytest.raises(sqlite3.OperationalError, match=r"readonly"):
+            dbconn.execute("DELETE FROM rsid_to_coord")
+    dbconn.close()
+
+
+def test_check_index(tmp_path):
+    rsidx.index.check_index(data_file("chr17-sample.rsidx"))
+    with pytest.raises(ValueError, match=r"does not exist"):
+        rsidx.index.check_index(str(tmp_path / "bogus.rsidx"))
+    with pytest.raises(ValueError, match=r"is not an rsidx index"):
+        rsidx.index.check_index(data_file("five-rsids.txt"))
+    idxfile = str(tmp_path / "empty.rsidx")
+    with sqlite3.connect(idxfile) as dbconn:
+        dbconn.execute("CREATE TABLE bogus (id INTEGER)")
+    dbconn.close()
+    with pytest.raises(ValueError, match=r"is not an rsidx index"):
+        rsidx.index.check_index(idxfile)
+    idxfile = str(tmp_path / "incomplete.rsidx")
+    with sqlite3.connect(idxfile) as dbconn:
+        rsidx.index.create_table(dbconn)
+        dbconn.execute("INSERT INTO rsid_to_coord VALUES (1, '1', 100)")
+        dbconn.commit()
+    dbconn.close()
+    with pytest.raises(ValueError, match=r"is incomplete"):
+        rsidx.index.check_index(idxfile)
+    for sources in (False, True):
+        idxfile = str(tmp_path / "nometa{:d}.rsidx".format(sources))
+        with sqlite3.connect(idxfile) as dbconn:
+            rsidx.index.create_table(dbconn, sources=sources)
+            dbconn.execute("DROP TABLE rsidx_meta")
+        dbconn.close()
+        if sources:
+            with pytest.raises(ValueError, match=r"is incomplete"):
+                rsidx.index.check_index(idxfile)
+        else:
+            rsidx.index.check_index(idxfile)
+
+
+@pytest.mark.parametrize("mode", ["default", "bulk", "threads", "multi", "offsets"])
+def test_index_interrupted_is_incomplete(mode, monkeypatch, tmp_path):
+    monkeypatch.setattr(rsidx.index, "finalize", finalize_or_interrupt(rsidx.index.finalize))
+    idxfile = str(tmp_path / "test.rsidx")
+    vcffiles = [data_file("chr17-sample.vcf.gz")]
+    options = {"bulk": ["--bulk"], "threads": ["--threads", "2"], "offsets": ["--offsets"]}
+    if mode == "multi":
+        vcffiles.append(data_file("chr9-multi.vcf.gz"))
+    arglist = ["index"] + options.get(mode, []) + vcffiles + [idxfile]
+    with pytest.raises(Interrupted):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    with pytest.raises(ValueError, match=r"is incomplete"):
+        rsidx.index.check_index(idxfile)
+
+
+def test_index_finalized():
+    with TempFileName(suffix=".rsidx") as idxfile:
+        arglist = ["index", data_file("chr9-multi.vcf.gz"), idxfile]
+        args = rsidx.cli.get_parser().parse_args(arglist)
+        rsidx.index.main(args)
+        rsidx.index.check_index(idxfile)
+        conn = sqlite3.connect(idxfile)
+        assert list(conn.execute("SELECT * FROM rsidx_meta")) == [("complete", "1")]
+        conn.close()
+
+
+@pytest.mark.parametrize(
+    "vcf", ["chr17-sample.vcf.gz", "chr9-multi.vcf.gz", "chr4-sample-corrupted-ids.vcf.gz"]
+)
+@pytest.mark.parametrize("bufsize,batchsize", [(1 << 22, 10000), (100, 7), (1, 1)])
+def test_parse_vcf_bytes(vcf, bufsize, batchsize):
+    vcffile = data_file(vcf)
+    with rsidx.open(vcffile, "r") as fh:
+        expected = list(rsidx.index.parse_vcf(fh))
+    with rsidx.open(vcffile, "rb") as fh:
+        batches = list(rsidx.index.parse_vcf_bytes(fh, batch_size=batchsize, bufsize=bufsize))
+    assert all(len(batch) > 0 for batch in batches)
+    observed = [row for batch in batches for row in batch]
+    assert observed == expected
+
+
+def test_parse_vcf_throughput(capsys):
+    with rsidx.open(data_file("chr17-sample.vcf.gz"), "rb") as fh:
+        rows = list(rsidx.index.parse(fh, updateint=100))
+    with rsidx.open(data_file("chr17-sample.vcf.gz"), "r") as fh:
+        assert list(rsidx.index.parse(fh, updateint=100)) == rows
+    terminal = capsys.readouterr()
+    assert "rsIDs per second" in terminal.err
+    assert len(terminal.err.strip().split("\n")) >= 10
+
+
+def test_index_binary_handle():
+    with NamedTemporaryFile(suffix=".sqlite3") as db:
+        with sqlite3.connect(db.name) as dbconn:
+            with rsidx.open(data_file("chr17-sample.vcf.gz"), "rb") as vcffh:
+                rsidx.index.index(dbconn, vcffh)
+            query = "SELECT * FROM rsid_to_coord WHERE rsid IN " "(1238461543, 1472751972)"
+            results = list(dbconn.execute(query))
+            assert sorted(results) == sorted(
+                [(1238461543, "17", 624973), (1472751972, "17", 132359)]
+            )
+
+
+@pytest.mark.parametrize(
+    "extraargs", [["--bulk"], ["--format", "bin"], ["--bulk", "--buffer-size", "100"]]
+)
+def test_index_decompression_threads(extraargs):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    with TempFileName(suffix=".rsidx") as idxfile:
+        arglist = ["index", "--threads", "4", *extraargs, vcffile, idxfile]
+        args = rsidx.cli.get_parser().parse_args(arglist)
+        rsidx.index.main(args)
+        rsidx.index.check_index(idxfile)
+        outlines = list(rsidx.search.search(["rs548749810", "rs956322221"], idxfile, vcffile))
+    positions = [line.split("\t")[1] for line in outlines]
+    assert positions == ["1098730", "1227227"]
+
+
+UPDATE_VCF = (
+    "##fileformat=VCFv4.1\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    "17\t100\trs1238461543\tA\tG\t.\t.\t.\n"
+    "17\t200\trs1238461543\tA\tT\t.\t.\t.\n"
+    "17\t300\trs5\tA\tG\t.\t.\t.\n"
+    "17\t132359\trs1472751972\tA\tG\t.\t.\t.\n"
+)
+
+
+def build_chr17_index(idxfile):
+    arglist = ["index", data_file("chr17-sample.vcf.gz"), idxfile]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.index.main(args)
+
+
+@pytest.mark.parametrize(
+    "policy,expected,alts",
+    [
+        ("keep-old", ("17", 624973), []),
+        ("take-new", ("17", 100), []),
+        ("record-both", ("17", 624973), [(1238461543, "17", 100)]),
+    ],
+)
+def test_update_policies(policy, expected, alts, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    vcffile = str(tmp_path / "update.vcf")
+    build_chr17_index(idxfile)
+    with open(vcffile, "w") as fh:
+        fh.write(UPDATE_VCF)
+    with sqlite3.connect(idxfile) as dbconn, rsidx.open(vcffile, "r") as vcffh:
+        nnew, nconflicts = rsidx.index.update(dbconn, vcffh, policy=policy)
+        assert (nnew, nconflicts) == (1, 1)
+        query = "SELECT chrom, coord FROM rsid_to_coord WHERE rsid = ?"
+        assert dbconn.execute(query, (1238461543,)).fetchone() == expected
+        assert dbconn.execute(query, (5,)).fetchone() == ("17", 300)
+        assert dbconn.execute(query, (1472751972,)).fetchone() == ("17", 132359)
+        if alts:
+            assert list(dbconn.execute("SELECT * FROM rsid_alt_coord")) == alts
+    dbconn.close()
+    rsidx.index.check_index(idxfile)
+    coords = list(rsidx.search.lookup(sqlite3.connect(idxfile), ["rs1238461543"]))
+    assert coords == sorted(set([expected] + [alt[1:] for alt in alts]))
+
+
+def test_update_invalid_policy(tmp_path):
+    with sqlite3.connect(str(tmp_path / "test.rsidx")) as dbconn:
+        with pytest.raises(ValueError, match=r'invalid conflict policy "bogus"'):
+            rsidx.index.update(dbconn, [], policy="bogus")
+
+
+def test_update_cli(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    arglist = ["update", data_file("chr9-multi.vcf.gz"), idxfile]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.__main__.main(args)
+    rsidx.__main__.main(args)
+    arglist = ["update", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx::update] added 3 new rsIDs" in terminal.err
+    assert terminal.err.count("is unchanged since it was indexed, skipping") == 2
+    conn = sqlite3.connect(idxfile)
+    assert conn.execute("SELECT COUNT(*) FROM rsid_to_coord").fetchone() == (5,)
+    assert conn.execute("SELECT COUNT(*) FROM rsidx_sources").fetchone() == (2,)
+    conn.close()
+
+
+def test_update_checksums(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    with sqlite3.connect(idxfile) as conn:
+        query = "SELECT vcf_md5, tbi_md5 FROM rsidx_sources"
+        assert conn.execute(query).fetchall() == [(None, None)]
+    conn.close()
+    vcffile = str(tmp_path / "chr9.vcf.gz")
+    shutil.copyfile(data_file("chr9-multi.vcf.gz"), vcffile)
+    shutil.copyfile(data_file("chr9-multi.vcf.gz.tbi"), vcffile + ".tbi")
+    arglist = ["update", vcffile, idxfile]
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    with sqlite3.connect(idxfile) as conn:
+        query = "SELECT vcf_md5 FROM rsidx_sources WHERE path = ?"
+        (vcfsum,) = conn.execute(query, (os.path.abspath(vcffile),)).fetchone()
+        assert vcfsum == rsidx.index.checksum(vcffile)
+    conn.close()
+    copyfile = str(tmp_path / "copy.vcf.gz")
+    shutil.copyfile(vcffile, copyfile)
+    shutil.copyfile(vcffile + ".tbi", copyfile + ".tbi")
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(["update", copyfile, idxfile]))
+    terminal = capsys.readouterr()
+    assert terminal.err.count("is unchanged since it was indexed, skipping") == 1
+
+
+def test_update_region(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    arglist = ["update", "--region", "17:1-200000", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.update_main(rsidx.cli.get_parser().parse_args(arglist))
+    conn = sqlite3.connect(idxfile)
+    query = "SELECT MAX(coord) FROM rsid_to_coord WHERE chrom = '17'"
+    assert conn.execute(query).fetchone()[0] <= 200000
+    query = "SELECT * FROM rsid_to_coord WHERE rsid = 1472751972"
+    assert conn.execute(query).fetchone() == (1472751972, "17", 132359)
+    conn.close()
+
+
+def test_update_failed_leaves_index_complete(tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    vcffile = str(tmp_path / "bad.vcf")
+    with open(vcffile, "w") as fh:
+        print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO", file=fh)
+        print("1\t10\trs1\tA\tG\t.\t.\t.", file=fh)
+        print("1\tabc\trs2\tA\tG\t.\t.\t.", file=fh)
+    with pytest.raises(ValueError):
+        rsidx.index.update_main(rsidx.cli.get_parser().parse_args(["update", vcffile, idxfile]))
+    rsidx.index.check_index(idxfile)
+    conn = sqlite3.connect(idxfile)
+    assert conn.execute("SELECT COUNT(*) FROM rsid_to_coord").fetchone() == (2,)
+    conn.close()
+
+
+def test_update_binary_index(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", "--format", "bin", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    arglist = ["update", data_file("chr9-multi.vcf.gz"), idxfile]
+    with pytest.raises(SystemExit):
+        rsidx.index.update_main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "binary indexes cannot be updated" in terminal.err
+
+
+def test_index_multi(capsys, tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffiles = [data_file("chr9-multi.vcf.gz"), data_file("chr17-sample.vcf.gz")]
+    arglist = ["index", "--threads", "2"] + vcffiles + [idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    rsidx.index.check_index(idxfile)
+    expected = set()
+    for vcffile in vcffiles:
+        with sqlite3.connect(":memory:") as dbconn, rsidx.open(vcffile, "r") as vcffh:
+            rsidx.index.index(dbconn, vcffh)
+            expected.update(dbconn.execute("SELECT * FROM rsid_to_coord"))
+    conn = sqlite3.connect(idxfile)
+    assert rsidx.index.is_sharded(conn)
+    assert set(conn.execute("SELECT rsid, chrom, coord FROM rsid_to_coord")) == expected
+    query = "SELECT DISTINCT chrom, source FROM rsid_to_coord ORDER BY source"
+    assert list(conn.execute(query)) == [("9", 1), ("17", 2)]
+    assert rsidx.index.source_paths(conn) == {
+        1: os.path.join(str(tmp_path), os.path.relpath(vcffiles[0], str(tmp_path))),
+        2: os.path.join(str(tmp_path), os.path.relpath(vcffiles[1], str(tmp_path))),
+    }
+    assert conn.execute("SELECT COUNT(*) FROM rsidx_sources").fetchone() == (2,)
+    conn.close()
+    terminal = capsys.readouterr()
+    assert terminal.err.count("[rsidx::index] indexed") == 2
+
+
+def test_index_multi_binary(capsys, tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffiles = [data_file("chr9-multi.vcf.gz"), data_file("chr17-sample.vcf.gz")]
+    arglist = ["index", "--format", "bin"] + vcffiles + [idxfile]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "binary indexes support a single VCF file" in terminal.err
+
+
+def test_update_multi(tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffile = data_file("chr9-multi.vcf.gz")
+    with sqlite3.connect(idxfile) as dbconn:
+        rsidx.index.index_multi(dbconn, [data_file("overlap.vcf.gz"), vcffile])
+        with rsidx.open(vcffile, "r") as vcffh:
+            with pytest.raises(ValueError, match=r"VCF file path required"):
+                rsidx.index.update(dbconn, vcffh)
+        with rsidx.open(data_file("chr17-sample.vcf.gz"), "r") as vcffh:
+            vcf = data_file("chr17-sample.vcf.gz")
+            nnew, nconflicts = rsidx.index.update(dbconn, vcffh, vcffile=vcf)
+        assert nnew > 0
+        query = "SELECT source FROM rsid_to_coord WHERE rsid = 1472751972"
+        assert dbconn.execute(query).fetchone() == (3,)
+        assert len(rsidx.index.source_paths(dbconn)) == 3
+    dbconn.close()
+
+
+@pytest.mark.parametrize("mode", ["r", "rb"])
+def test_index_metrics(mode):
+    events = list()
+    metrics = rsidx.metrics.Metrics(on_progress=events.append)
+    vcffile = data_file("chr17-sample.vcf.gz")
+    with sqlite3.connect(":memory:") as dbconn, rsidx.open(vcffile, mode) as vcffh:
+        rsidx.index.index(dbconn, vcffh, logint=500, metrics=metrics)
+        (nrows,) = dbconn.execute("SELECT COUNT(*) FROM rsid_to_coord").fetchone()
+    with rsidx.open(vcffile, "rb") as fh:
+        nbytes = len(fh.read())
+    values = metrics.as_dict()
+    assert values["counters"]["rsids"] >= nrows
+    assert values["counters"]["bytes"] == nbytes
+    assert set(values["timings"]) == {"parse", "insert", "commit", "finalize"}
+    assert values["rates"]["rsids_per_second"] > 0
+    assert len(events) > 2
+    assert [event["done"] for event in events] == [False] * (len(events) - 1) + [True]
+    assert events[-1]["rsids"] == values["counters"]["rsids"]
+
+
+def test_index_stats_cli(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", "--stats", "json", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    values = json.loads(terminal.err.strip().split("\n")[-1])
+    assert values["counters"]["rsids"] > 0
+    assert "record_source" in values["timings"]
+    arglist = ["index", "-f", "--stats", "text", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx::index] parse: " in terminal.err
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_index_offsets(threads, tmp_path):
+    vcffile = data_file("chr9-multi.vcf.gz")
+    idxfile = str(tmp_path / "offsets.rsidx")
+    arglist = ["index", "--offsets", "--threads", str(threads), vcffile, idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    with sqlite3.connect(idxfile) as dbconn:
+        assert rsidx.index.has_offsets(dbconn)
+        rows = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    dbconn.close()
+    with sqlite3.connect(data_file("chr9-multi.rsidx")) as dbconn:
+        assert not rsidx.index.has_offsets(dbconn)
+        expected = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    dbconn.close()
+    assert [row[:3] for row in rows] == expected
+    with rsidx.tabix.BgzfReader(vcffile) as reader:
+        for rsid, chrom, coord, vo in rows:
+            reader.seek(vo)
+            values = reader.readline().decode().split("\t")
+            assert values[:2] == [chrom, str(coord)]
+            assert "rs{:d}".format(rsid) in values[2].split(";")
+
+
+@pytest.mark.parametrize(
+    "options,message",
+    [
+        (["--format", "bin"], "binary indexes do not support --offsets"),
+        (["--bulk"], "--offsets is not supported in bulk mode"),
+    ],
+)
+def test_index_offsets_unsupported(options, message, capsys, tmp_path):
+    idxfile = str(tmp_path / "offsets.rsidx")
+    arglist = ["index", "--offsets"] + options + [data_file("chr17-sample.vcf.gz"), idxfile]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert message in terminal.err
+
+
+def test_index_offsets_not_bgzipped(capsys, tmp_path):
+    vcffile = str(tmp_path / "update.vcf")
+    with open(vcffile, "w") as fh:
+        fh.write(UPDATE_VCF)
+    arglist = ["index", "--offsets", vcffile, str(tmp_path / "offsets.rsidx")]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "--offsets requires a bgzipped VCF file" in terminal.err
+
+
+def test_update_offsets(tmp_path):
+    idxfile = str(tmp_path / "offsets.rsidx")
+    vcffile = str(tmp_path / "update.vcf")
+    arglist = ["index", "--offsets", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    with open(vcffile, "w") as fh:
+        fh.write(UPDATE_VCF)
+    with sqlite3.connect(idxfile) as dbconn, rsidx.open(vcffile, "r") as vcffh:
+        nnew, nconflicts = rsidx.index.update(dbconn, vcffh, policy="take-new")
+        assert (nnew, nconflicts) == (1, 1)
+        query = "SELECT chrom, coord, voffset FROM rsid_to_coord WHERE rsid = ?"
+        assert dbconn.execute(query, (1238461543,)).fetchone() == ("17", 100, None)
+        assert dbconn.execute(query, (548749810,)).fetchone()[2] is not None
+    dbconn.close()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(nevents):
+    events = list()
+
+    def on_progress(event):
+        events.append(event)
+        if len(events) >= nevents:
+            raise Interrupted()
+
+    return on_progress
+
+
+def finalize_or_interrupt(finalize):
+    def wrapper(dbconn, complete=True):
+        if complete:
+            raise Interrupted()
+        finalize(dbconn, complete=False)
+
+    return wrapper
+
+
+@pytest.mark.parametrize("compressed", [True, False])
+def test_index_checkpointed_resume(compressed, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    if not compressed:
+        vcffile = str(tmp_path / "chr17-sample.vcf")
+        with rsidx.open(data_file("chr17-sample.vcf.gz"), "r") as fh, open(vcffile, "w") as out:
+            out.write(fh.read())
+    idxfile = str(tmp_path / "test.rsidx")
+    metrics = rsidx.metrics.Metrics(on_progress=interrupt_after(3))
+    dbconn = sqlite3.connect(idxfile)
+    with pytest.raises(Interrupted):
+        rsidx.index.index_checkpointed(dbconn, vcffile, checkpoint=50, logint=200, metrics=metrics)
+    dbconn.close()
+    assert metrics.counters["checkpoints"] > 2
+    with pytest.raises(ValueError, match=r"is incomplete"):
+        rsidx.index.check_index(idxfile)
+    with sqlite3.connect(idxfile) as dbconn:
+        (nrows,) = dbconn.execute("SELECT COUNT(*) FROM rsid_to_coord").fetchone()
+        assert nrows > 0
+        rsidx.index.index_checkpointed(dbconn, vcffile, checkpoint=50, resume=True)
+        observed = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+        assert not rsidx.index.has_table(dbconn, "rsidx_checkpoint")
+    dbconn.close()
+    rsidx.index.check_index(idxfile)
+    assert not os.path.exists(idxfile + "-wal")
+    with sqlite3.connect(data_file("chr17-sample.rsidx")) as dbconn:
+        expected = list(dbconn.execute("SELECT * FROM rsid_to_coord ORDER BY rsid"))
+    dbconn.close()
+    assert len(observed) > nrows
+    assert observed == expected
+
+
+def test_index_checkpointed_changed_vcf(tmp_path):
+    vcffile = str(tmp_path / "update.vcf")
+    with open(vcffile, "w") as fh:
+        fh.write(UPDATE_VCF)
+    idxfile = str(tmp_path / "test.rsidx")
+    dbconn = sqlite3.connect(idxfile)
+    metrics = rsidx.metrics.Metrics(on_progress=interrupt_after(1))
+    with pytest.raises(Interrupted):
+        rsidx.index.index_checkpointed(dbconn, vcffile, checkpoint=1, logint=1, metrics=metrics)
+    with open(vcffile, "a") as fh:
+        fh.write("17\t400\trs6\tA\tG\t.\t.\t.\n")
+    with pytest.raises(ValueError, match=r"has changed since"):
+        rsidx.index.index_checkpointed(dbconn, vcffile, resume=True)
+    dbconn.close()
+
+
+def test_index_resume_cli(capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", "--resume", "--offsets", "--stats", "json", vcffile, idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    values = json.loads(terminal.err.strip().split("\n")[-1])
+    assert values["counters"]["checkpoints"] == 1
+    with sqlite3.connect(idxfile) as dbconn:
+        assert rsidx.index.has_offsets(dbconn)
+    dbconn.close()
+    arglist = ["search", vcffile, idxfile, "rs548749810"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "\trs548749810\t" in terminal.out
+    with pytest.raises(SystemExit):
+        rsidx.index.main(
+            rsidx.cli.get_parser().parse_args(["index", "--resume", vcffile, idxfile])
+        )
+    terminal = capsys.readouterr()
+    assert "[rsidx] ERROR: index has no checkpoint to resume from" in terminal.err
+    arglist = ["index", "--checkpoint", "10", "--bulk", vcffile, idxfile]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "not supported in bulk mode" in terminal.err
+
+
+def test_load_merges(capsys):
+    merges = [
+        "# old\tcurrent\n",
+        "rs1\trs548749810\n",
+        "2 1\n",
+        "rs3\trs2\textra columns\n",
+        "\n",
+        "rs10\trs11\n",
+        "rs11\trs10\n",
+        "rs13\trs11\n",
+        "rs12\trs12\n",
+    ]
+    with sqlite3.connect(":memory:") as dbconn:
+        assert rsidx.index.load_merges(dbconn, merges) == 3
+        rows = dbconn.execute("SELECT old, current FROM rsid_merges ORDER BY old").fetchall()
+        assert rows == [(1, 548749810), (2, 548749810), (3, 548749810)]
+    dbconn.close()
+    terminal = capsys.readouterr()
+    assert "dropped 3 merged rsIDs with circular merge histories" in terminal.err
+    with pytest.raises(ValueError, match=r'invalid merge history line "rs1 bogus"'):
+        list(rsidx.index.read_merges(["rs1 bogus\n"]))
+
+
+def test_load_merges_invalid_leaves_index_complete(tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    rsidx.index.main(
+        rsidx.cli.get_parser().parse_args(["index", data_file("overlap.vcf.gz"), idxfile])
+    )
+    with sqlite3.connect(idxfile) as dbconn:
+        with pytest.raises(ValueError, match=r"invalid merge history line"):
+            rsidx.index.load_merges(dbconn, ["rs1 rs2\n", "foo bar\n"])
+    dbconn.close()
+    rsidx.index.check_index(idxfile)
+    conn = sqlite3.connect(idxfile)
+    assert not rsidx.index.has_table(conn, "rsid_merges")
+    conn.close()
+
+
+def test_index_merges_invalid_cli(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    mergefile = str(tmp_path / "merges.txt")
+    with open(mergefile, "w") as fh:
+        print("rs1 rs2", file=fh)
+        print("foo bar", file=fh)
+    arglist = ["index", "--merges", mergefile, data_file("overlap.vcf.gz"), idxfile]
+    with pytest.raises(SystemExit) as excinfo:
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    assert excinfo.value.code == 1
+    terminal = capsys.readouterr()
+    assert '[rsidx] ERROR: invalid merge history line "foo bar"' in terminal.err
+    assert not os.path.exists(idxfile)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import os
+import pytest
+import rsidx
+from rsidx.presence import BITMAP, BLOOM, PresenceFilter, load_presence, presence_file
+from rsidx.tests import data_file
+import sqlite3
+
+
+@pytest.mark.parametrize(
+    "rsids,kind",
+    [
+        (list(range(1, 5000, 3)), BITMAP),
+        ([1000003 * i for i in range(1, 2000)], BLOOM),
+    ],
+)
+def test_write_presence(rsids, kind, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    with open(idxfile, "w"):
+        pass
+    rsidx.presence.write_presence(idxfile, rsids, len(rsids), max(rsids))
+    with PresenceFilter(presence_file(idxfile)) as presence:
+        assert presence.kind == kind
+        assert all(rsid in presence for rsid in rsids)
+        absent = [rsid + 1 for rsid in rsids]
+        assert sum(rsid in presence for rsid in absent) < len(absent) * 0.05
+        assert 10**12 not in presence
+
+
+@pytest.mark.parametrize("fmt", ["sqlite", "bin"])
+def test_index_presence(fmt, capsys, tmp_path):
+    idxfile = str(tmp_path / "chr17.rsidx")
+    vcffile = data_file("chr17-sample.vcf.gz")
+    arglist = ["index", "--presence", "--format", fmt, vcffile, idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    presence = load_presence(idxfile)
+    assert 1472751972 in presence
+    presence.close()
+    rsidlist = ["rs1", "rs2", "rs1472751972", "rs548749810"]
+    observed = list(rsidx.search.search(rsidlist, idxfile, vcffile))
+    expected = list(rsidx.search.search(rsidlist, data_file("chr17-sample.rsidx"), vcffile))
+    assert len(observed) == 2
+    assert observed == expected
+    terminal = capsys.readouterr()
+    assert terminal.err.count("2 of 4 rsIDs not found: rs1, rs2") == 2
+    with rsidx.RsidIndex(vcffile, idxfile) as idx:
+        assert idx.coord("rs1472751972") == ("17", 132359)
+        assert idx.coord("rs1") is None
+
+
+def test_query_table_presence(tmp_path):
+    idxfile = str(tmp_path / "chr17.rsidx")
+    arglist = ["index", "--presence", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    conn = rsidx.index.connect(idxfile, readonly=True)
+    with rsidx.search.query_table(conn, ["rs1", "rs1472751972"]) as (dbconn, table, _):
+        rows = list(dbconn.execute("SELECT * FROM {:s} ORDER BY rsid".format(table)))
+    assert rows == [(1, 0, 1), (1472751972, 1, 1472751972)]
+    conn.close()
+
+
+def test_presence_update(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    arglist = ["index", "--presence", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    arglist = ["update", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.update_main(rsidx.cli.get_parser().parse_args(arglist))
+    presence = load_presence(idxfile)
+    assert 1472751972 in presence
+    presence.close()
+    with sqlite3.connect(idxfile) as dbconn:
+        dbconn.execute("DELETE FROM rsid_to_coord WHERE rsid = 1472751972")
+    dbconn.close()
+    assert load_presence(idxfile) is None
+    terminal = capsys.readouterr()
+    assert "is out of date, ignoring" in terminal.err
+    arglist = ["index", "--force", data_file("overlap.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    assert not os.path.exists(presence_file(idxfile))
+
+
+def test_presence_bad_file(capsys, tmp_path):
+    idxfile = str(tmp_path / "test.rsidx")
+    with open(idxfile, "w") as fh:
+        print("not an index", file=fh)
+    with open(presence_file(idxfile), "wb") as fh:
+        fh.write(b"RSIDXPRE" + b"\0" * 100)
+    assert load_presence(idxfile) is None
+    with open(presence_file(idxfile), "wb"):
+        pass
+    assert load_presence(idxfile) is None
+    terminal = capsys.readouterr()
+    assert "is not an rsidx presence filter" in terminal.err
+    assert "is incomplete" in terminal.err
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import pytest
+import rsidx
+from rsidx.reverse import lookup_regions, merge_regions, read_bed
+from rsidx.tests import data_file
+import sqlite3
+
+
+def test_read_bed():
+    bed = ["track name=test\n", "# comment\n", "\n", "17\t99\t100\n", "17\t200\t300\tname\n"]
+    assert list(read_bed(bed)) == [("17", 100, 100), ("17", 201, 300)]
+    with pytest.raises(ValueError, match=r'invalid BED line "17\t200"'):
+        list(read_bed(["17\t200\n"]))
+
+
+def test_merge_regions():
+    regions = [("2", 5, 10), ("1", 20, 30), ("1", 1, 10), ("1", 11, 15), ("1", 12, 14)]
+    assert merge_regions(regions) == [("1", 1, 15), ("1", 20, 30), ("2", 5, 10)]
+
+
+def scan(dbconn, regions):
+    expected = list()
+    for chrom, start, end in regions:
+        query = "SELECT chrom, coord, rsid FROM rsid_to_coord WHERE chrom = ? AND coord >= ? AND coord <= ?"
+        expected.extend(dbconn.execute(query, (chrom, start, end)))
+    return sorted(set(expected), key=lambda row: (row[0], row[1], row[2]))
+
+
+def test_lookup_regions(capsys, tmp_path):
+    idxfile = str(tmp_path / "chr17.rsidx")
+    arglist = ["index", "--reverse", data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    dbconn = rsidx.index.connect(idxfile, readonly=True)
+    assert rsidx.reverse.has_coord_index(dbconn)
+    plan = dbconn.execute(
+        "EXPLAIN QUERY PLAN SELECT rsid FROM rsid_to_coord WHERE chrom = '17' AND coord < 10"
+    ).fetchall()
+    assert "rsid_by_coord" in str(plan)
+    regions = [("17", 100000, 200000), ("17", 150000, 250000), ("17", 1098730, 1098730)]
+    observed = list(lookup_regions(dbconn, regions))
+    assert len(observed) > 10
+    assert observed == scan(dbconn, regions)
+    assert (("17", 1098730, 548749810)) in observed
+    assert list(lookup_regions(dbconn, [("9", 1, 1000000)])) == []
+    dbconn.close()
+    terminal = capsys.readouterr()
+    assert "[rsidx::index] built coordinate index" in terminal.err
+
+
+def test_lookup_cli(capsys, tmp_path):
+    bedfile = str(tmp_path / "regions.bed")
+    with open(bedfile, "w") as fh:
+        print("17", 1098729, 1098730, sep="\t", file=fh)
+        print("17", 1227226, 1227227, sep="\t", file=fh)
+    arglist = [
+        "lookup",
+        "--bed",
+        bedfile,
+        "-r",
+        "17:132359-132359",
+        data_file("chr17-sample.rsidx"),
+    ]
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert terminal.out == (
+        "17\t132359\trs1472751972\n17\t1098730\trs548749810\n17\t1227227\trs956322221\n"
+    )
+    assert "index has no coordinate index" in terminal.err
+
+
+def test_lookup_cli_errors(capsys, tmp_path):
+    idxfile = data_file("chr17-sample.rsidx")
+    for arglist in (["lookup", idxfile], ["lookup", "-r", "17:10-5", idxfile]):
+        with pytest.raises(SystemExit):
+            rsidx.reverse.main(rsidx.cli.get_parser().parse_args(arglist))
+    binfile = str(tmp_path / "chr17.rsidx")
+    arglist = ["index", "--reverse", "--format", "bin", data_file("chr17-sample.vcf.gz"), binfile]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    arglist = ["index", "--format", "bin", data_file("chr17-sample.vcf.gz"), binfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    with pytest.raises(SystemExit):
+        rsidx.reverse.main(rsidx.cli.get_parser().parse_args(["lookup", "-r", "17", binfile]))
+    terminal = capsys.readouterr()
+    assert "no regions specified" in terminal.err
+    assert 'invalid region "17:10-5"' in terminal.err
+    assert terminal.err.count("binary indexes do not support reverse lookups") == 2
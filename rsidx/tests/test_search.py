@@ -7,9 +7,13 @@
 # and is licensed under the BSD license: see LICENSE.txt.
 # -----------------------------------------------------------------------------
 
+from itertools import chain
+import json
+import os
 import pytest
 import rsidx
-from rsidx.tests import data_file
+from rsidx.tests import RECORD_BOTH_VCF, data_file, record_both_index
+import shutil
 import sqlite3
 from tempfile import NamedTemporaryFile
 
@@ -211,3 +215,559 @@ def test_search_multi():
     assert len(outlines) == 7
     for line in outlines:
         assert line.split("\t")[2] == "rs60995877"
+
+
+@pytest.mark.parametrize(
+    "vcf,idx,rsidlist",
+    [
+        (
+            "chr17-sample.vcf.gz",
+            "chr17-sample.rsidx",
+            ["rs544992196", 1335948438, "182553373", "rs1245348147", "rs1440788236"],
+        ),
+        ("chr9-multi.vcf.gz", "chr9-multi.rsidx", ["rs60995877"]),
+        ("multiple_id.vcf.gz", "multiple_id.rsidx", ["rs145742571", "rs72634902"]),
+        ("overlap.vcf.gz", "overlap.sqlite3", ["rs8051733"]),
+    ],
+)
+def test_rsid_index(vcf, idx, rsidlist):
+    vcffile, idxfile = data_file(vcf), data_file(idx)
+    conn = sqlite3.connect(idxfile)
+    expected = list(rsidx.search.search(rsidlist, conn, vcffile, header=True))
+    conn.close()
+    with rsidx.RsidIndex(vcffile, idxfile) as index:
+        assert list(index.search(rsidlist, header=True)) == expected
+        assert list(index.search(rsidlist, header=True)) == expected
+        stats = index.stats
+    assert stats["coord_misses"] == len(rsidlist)
+    assert stats["coord_hits"] >= len(rsidlist)
+    assert stats["record_misses"] == len(rsidlist)
+    assert stats["record_hits"] == len(rsidlist)
+
+
+def test_rsid_index_cache_bounded(capsys):
+    vcffile, idxfile = data_file("chr17-sample.vcf.gz"), data_file("chr17-sample.rsidx")
+    with rsidx.RsidIndex(vcffile, idxfile, maxsize=2) as index:
+        assert index.coord("rs123456789") is None
+        assert index.records("rs123456789") == tuple()
+        assert list(index.search(["rs123456789"])) == []
+        assert index.coord("rs1238461543") == ("17", 624973)
+        assert index.coord(1472751972) == ("17", 132359)
+        assert len(index.coord_cache) == 2
+        assert index.stats["coord_hits"] == 2
+    terminal = capsys.readouterr()
+    assert "[rsidx::search] WARNING: no rsID matches" in terminal.err
+
+
+def test_lru_cache():
+    cache = rsidx.search.LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lookup_sorted_distinct():
+    conn = sqlite3.connect(data_file("chr17-sample.rsidx"))
+    rsidlist = ["rs1227227", "rs1238461543", 1472751972, "rs1238461543", 548749810]
+    observed = list(rsidx.search.lookup(conn, rsidlist))
+    assert observed == [("17", 132359), ("17", 624973), ("17", 1098730)]
+    assert list(conn.execute("SELECT name FROM temp.sqlite_master")) == []
+    conn.close()
+
+
+def test_lookup_many_rsids():
+    conn = sqlite3.connect(data_file("chr17-sample.rsidx"))
+    rsidlist = ("rs{:d}".format(n) for n in range(2000000000, 2000100000))
+    assert list(rsidx.search.lookup(conn, rsidlist)) == []
+    rsidlist = chain(range(2000000000, 2000100000), ["rs1472751972"])
+    assert list(rsidx.search.lookup(conn, rsidlist)) == [("17", 132359)]
+    conn.close()
+
+
+def test_search_invalid_rsids(capsys):
+    rsidlist = ["rs1472751972", "rsABC", "1238461543;", "rs1238461543"]
+    conn = sqlite3.connect(data_file("chr17-sample.rsidx"))
+    outlines = list(rsidx.search.search(rsidlist, conn, data_file("chr17-sample.vcf.gz")))
+    conn.close()
+    assert len(outlines) == 2
+    terminal = capsys.readouterr()
+    assert 'WARNING: skipping invalid rsID "rsABC"' in terminal.err
+    assert 'WARNING: skipping invalid rsID "1238461543;"' in terminal.err
+
+
+def test_search_out_of_range_rsids(capsys):
+    rsidlist = ["rs1472751972", "rs9223372036854775808", "rs-5", 2**64]
+    idxfile = data_file("chr17-sample.rsidx")
+    outlines = list(rsidx.search.search(rsidlist, idxfile, data_file("chr17-sample.vcf.gz")))
+    assert len(outlines) == 1
+    assert list(rsidx.search.coords(rsidlist, idxfile)) == [(1472751972, "17", 132359)]
+    terminal = capsys.readouterr()
+    assert 'WARNING: skipping invalid rsID "rs9223372036854775808"' in terminal.err
+    assert 'WARNING: skipping invalid rsID "rs-5"' in terminal.err
+    assert rsidx.search.parse_rsid("rs9223372036854775807") == 2**63 - 1
+    assert rsidx.search.parse_rsid(2**64) is None
+
+
+def test_filter_by_rsid_exact_match():
+    lines = [
+        "#CHROM\tPOS\tID\tREF\tALT\n",
+        "1\t100\trs123\tA\tG\n",
+        "1\t200\trs12;rs99\tA\tG\n",
+        "1\t300\t.\tA\tG\n",
+        "1\t400\trs1234\tA\tG\n",
+    ]
+    found = set()
+    observed = list(rsidx.search.filter_by_rsid(lines, {12, 123, 555}, found=found))
+    assert observed == lines[:3]
+    assert found == {12, 123}
+    assert list(rsidx.search.filter_by_rsid(lines, ["rs1234"])) == [lines[0], lines[4]]
+    assert list(rsidx.search.filter_by_rsid(lines, "1234")) == [lines[0], lines[4]]
+    assert list(rsidx.search.filter_by_rsid(lines, "123, rs99")) == lines[:3]
+
+
+def test_search_found_and_missing(capsys):
+    conn = sqlite3.connect(data_file("chr4-sample-corrupted-ids.rsidx"))
+    found = set()
+    vcffile = data_file("chr4-sample-corrupted-ids.vcf.gz")
+    outlines = list(
+        rsidx.search.search(["rs1234497371", "rs538736078"], conn, vcffile, found=found)
+    )
+    conn.close()
+    assert len(outlines) == 1
+    assert found == {1234497371}
+    terminal = capsys.readouterr()
+    assert "WARNING: 1 of 2 rsIDs not found: rs538736078" in terminal.err
+
+
+def test_plan_regions():
+    coords = [("1", 100), ("1", 101), ("1", 150), ("1", 5000), ("2", 100), ("2", 100)]
+    assert list(rsidx.search.plan_regions(coords, gap=0)) == [
+        ("1", 100, 101),
+        ("1", 150, 150),
+        ("1", 5000, 5000),
+        ("2", 100, 100),
+    ]
+    assert list(rsidx.search.plan_regions(coords, gap=1000)) == [
+        ("1", 100, 150),
+        ("1", 5000, 5000),
+        ("2", 100, 100),
+    ]
+    assert list(rsidx.search.plan_regions([], gap=1000)) == []
+
+
+@pytest.mark.parametrize("gap", [0, 1000, 100000, 10000000])
+def test_search_gap(gap):
+    with open(data_file("five-rsids.txt"), "r") as fh:
+        rsidlist = fh.read().split() + ["rs544992196", "rs1335948438", "rs182553373"]
+    conn = sqlite3.connect(data_file("chr17-sample.rsidx"))
+    vcffile = data_file("chr17-sample.vcf.gz")
+    outlines = list(rsidx.search.search(rsidlist, conn, vcffile, gap=gap))
+    conn.close()
+    positions = [int(line.split("\t")[1]) for line in outlines]
+    assert positions == [
+        132359,
+        567599,
+        611663,
+        944196,
+        1313935,
+        1458046,
+        1521873,
+        1895904,
+    ]
+
+
+@pytest.mark.parametrize(
+    "vcf,idx,rsidlist",
+    [
+        (
+            "chr17-sample.vcf.gz",
+            "chr17-sample.rsidx",
+            ["rs1472751972", "rs1287502205", "rs897983471", "rs1172219431", "rs189123651"],
+        ),
+        ("chr9-multi.vcf.gz", "chr9-multi.rsidx", ["rs60995877", "rs542911533"]),
+        ("multiple_id.vcf.gz", "multiple_id.rsidx", ["rs145742571", "rs72634902"]),
+    ],
+)
+@pytest.mark.parametrize("batchsize", [1, 2, 3, None])
+def test_search_batches(vcf, idx, rsidlist, batchsize):
+    vcffile, idxfile = data_file(vcf), data_file(idx)
+    conn = sqlite3.connect(idxfile)
+    expected = list(rsidx.search.search(rsidlist, conn, vcffile, header=True, batch_size=1000))
+    observed = list(
+        rsidx.search.search(iter(rsidlist), conn, vcffile, header=True, batch_size=batchsize)
+    )
+    conn.close()
+    assert observed == expected
+
+
+def test_batch_rows():
+    rows = [("1", 100, 5), ("1", 100, 6), ("1", 200, 7), ("2", 50, 8), ("2", 60, 9)]
+    batches = list(rsidx.search.batch_rows(rows, batch_size=1))
+    assert batches == [rows[:2], rows[2:3], rows[3:4], rows[4:]]
+    batches = list(rsidx.search.batch_rows(rows, batch_size=3))
+    assert batches == [rows[:3], rows[3:]]
+    assert list(rsidx.search.batch_rows(iter(rows))) == [rows]
+
+
+def test_search_with_file_batches(tmp_path):
+    outfile = str(tmp_path / "out.vcf")
+    arglist = [
+        "search",
+        data_file("chr17-sample.vcf.gz"),
+        data_file("chr17-sample.rsidx"),
+        "--file",
+        data_file("five-rsids.txt"),
+        "--batch-size",
+        "2",
+        "--out",
+        outfile,
+    ]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.search.main(args)
+    with open(outfile, "r") as fh:
+        positions = [line.split()[1] for line in fh]
+    assert positions == ["132359", "1313935", "1458046", "1521873", "1895904"]
+
+
+def test_search_immutable(capsys):
+    arglist = [
+        "search",
+        "--immutable",
+        "--cache-size",
+        "4000",
+        "--mmap-size",
+        "4000000",
+        data_file("chr17-sample.vcf.gz"),
+        data_file("chr17-sample.rsidx"),
+        "rs1472751972",
+        "rs1287502205",
+    ]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    rsidx.search.main(args)
+    terminal = capsys.readouterr()
+    assert len(terminal.out.strip().split("\n")) == 2
+
+
+def test_search_bad_index(capsys, tmp_path):
+    idxfile = str(tmp_path / "missing.rsidx")
+    arglist = ["search", data_file("chr17-sample.vcf.gz"), idxfile, "rs1472751972"]
+    args = rsidx.cli.get_parser().parse_args(arglist)
+    with pytest.raises(SystemExit):
+        rsidx.search.main(args)
+    terminal = capsys.readouterr()
+    assert "[rsidx] ERROR: index file" in terminal.err
+    assert "does not exist" in terminal.err
+
+
+def test_search_multi(capsys, tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffiles = [data_file("chr9-multi.vcf.gz"), data_file("chr17-sample.vcf.gz")]
+    with sqlite3.connect(idxfile) as dbconn:
+        rsidx.index.index_multi(dbconn, vcffiles)
+    dbconn.close()
+    rsidlist = ["rs60995877", "rs956322221", "rs542911533", "rs548749810", "rs1"]
+    expected = list()
+    for vcffile in vcffiles:
+        idx = vcffile.replace(".vcf.gz", ".rsidx")
+        expected.extend(rsidx.search.search(rsidlist, idx, vcffile))
+    expected = sorted(expected, key=rsidx.search.record_key)
+    observed = list(rsidx.search.search(rsidlist, idxfile, None, batch_size=1, threads=2))
+    assert len(observed) > 4
+    assert observed == expected
+    found = set()
+    lines = rsidx.search.search(rsidlist, idxfile, data_file(""), header=True, found=found)
+    assert [line for line in lines if not line.startswith("#")] == expected
+    assert found == {60995877, 956322221, 542911533, 548749810}
+    terminal = capsys.readouterr()
+    assert "1 of 5 rsIDs not found: rs1" in terminal.err
+
+
+def test_search_multi_cli(capsys, tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffiles = [data_file("chr9-multi.vcf.gz"), data_file("chr17-sample.vcf.gz")]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index"] + vcffiles + [idxfile]))
+    arglist = ["search", "--header", "-", idxfile, "rs60995877", "rs548749810"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    records = [line for line in terminal.out.split("\n") if line and not line.startswith("#")]
+    assert [line.split("\t")[2] for line in records] == ["rs548749810"] + ["rs60995877"] * 7
+    assert "##fileformat=VCF" in terminal.out
+
+
+@pytest.mark.parametrize("fmt", ["sqlite", "bin"])
+def test_coords(fmt, capsys, tmp_path):
+    idxfile = str(tmp_path / "chr17.rsidx")
+    arglist = ["index", "--format", fmt, data_file("chr17-sample.vcf.gz"), idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    rsidlist = ["rs956322221", "rs1", "548749810", "rs1472751972", "bogus", "rs548749810"]
+    observed = list(rsidx.search.coords(rsidlist, idxfile))
+    assert observed == [
+        (1472751972, "17", 132359),
+        (548749810, "17", 1098730),
+        (956322221, "17", 1227227),
+    ]
+    terminal = capsys.readouterr()
+    assert "1 of 4 rsIDs not found: rs1" in terminal.err
+
+
+@pytest.mark.parametrize(
+    "fmt,expected",
+    [
+        ("tsv", "rs548749810\t17\t1098730\nrs956322221\t17\t1227227\n"),
+        ("bed", "17\t1098729\t1098730\trs548749810\n17\t1227226\t1227227\trs956322221\n"),
+    ],
+)
+def test_coords_cli(fmt, expected, capsys):
+    arglist = [
+        "search",
+        "--coords-only",
+        "--coords-format",
+        fmt,
+        "bogus.vcf.gz",
+        data_file("chr17-sample.rsidx"),
+        "rs956322221",
+        "rs548749810",
+    ]
+    rsidx.__main__.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert terminal.out == expected
+
+
+def test_search_metrics():
+    metrics = rsidx.metrics.Metrics(on_progress=None)
+    rsidlist = ["rs1", "rs548749810", "rs956322221"]
+    idxfile = data_file("chr17-sample.rsidx")
+    lines = list(
+        rsidx.search.search(
+            rsidlist, idxfile, data_file("chr17-sample.vcf.gz"), batch_size=1, metrics=metrics
+        )
+    )
+    values = metrics.as_dict()
+    assert values["counters"] == {
+        "batches": 2,
+        "matches": 2,
+        "records": len(lines),
+        "queries": 3,
+        "missing": 1,
+        "aliases": 0,
+        "vcf_blocks": values["counters"]["vcf_blocks"],
+        "vcf_bytes": values["counters"]["vcf_bytes"],
+    }
+    assert values["counters"]["vcf_bytes"] > 0
+    assert set(values["timings"]) == {"load_query", "lookup", "fetch", "missing"}
+
+
+def test_search_stats_cli(capsys):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    idxfile = data_file("chr17-sample.rsidx")
+    arglist = ["search", "--stats", "json", vcffile, idxfile, "rs548749810"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    values = json.loads(terminal.err.strip().split("\n")[-1])
+    assert values["counters"]["records"] == 1
+    arglist = ["search", "--coords-only", "--stats", "text", vcffile, idxfile, "rs548749810"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx::search] lookup: " in terminal.err
+
+
+@pytest.mark.parametrize("vcf", ["chr17-sample.vcf.gz", "chr9-multi.vcf.gz", "multiple_id.vcf.gz"])
+def test_search_offsets(vcf, tmp_path):
+    vcffile = data_file(vcf)
+    idxfile = str(tmp_path / "offsets.rsidx")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", "--offsets", vcffile, idxfile]))
+    with sqlite3.connect(idxfile) as dbconn:
+        rsidlist = [rsid for (rsid,) in dbconn.execute("SELECT rsid FROM rsid_to_coord")]
+    dbconn.close()
+    expected = list(
+        rsidx.search.search(rsidlist, vcffile.replace(".vcf.gz", ".rsidx"), vcffile, header=True)
+    )
+    metrics = rsidx.metrics.Metrics(on_progress=None)
+    observed = list(
+        rsidx.search.search(rsidlist, idxfile, vcffile, header=True, batch_size=7, metrics=metrics)
+    )
+    assert len(observed) > 0
+    assert observed == expected
+    assert metrics.counters["vcf_blocks"] > 0
+
+
+def test_search_offsets_fallback(capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    idxfile = str(tmp_path / "offsets.rsidx")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", "--offsets", vcffile, idxfile]))
+    with sqlite3.connect(idxfile) as dbconn:
+        dbconn.execute("UPDATE rsid_to_coord SET voffset = NULL WHERE rsid = 548749810")
+    dbconn.close()
+    rsidlist = ["rs956322221", "rs548749810", "rs1472751972", "rs1"]
+    expected = list(rsidx.search.search(rsidlist, data_file("chr17-sample.rsidx"), vcffile))
+    observed = list(rsidx.search.search(rsidlist, idxfile, vcffile))
+    assert len(observed) == 3
+    assert observed == expected
+    terminal = capsys.readouterr()
+    assert "1 of 4 rsIDs not found: rs1" in terminal.err
+
+
+def test_search_offsets_stale(capsys, tmp_path):
+    vcffile = str(tmp_path / "test.vcf.gz")
+    idxfile = str(tmp_path / "offsets.rsidx")
+    shutil.copyfile(data_file("chr17-sample.vcf.gz"), vcffile)
+    shutil.copyfile(data_file("chr17-sample.vcf.gz.tbi"), vcffile + ".tbi")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", "--offsets", vcffile, idxfile]))
+    rsidlist = ["rs956322221", "rs548749810", "rs1472751972"]
+    expected = list(rsidx.search.search(rsidlist, idxfile, vcffile))
+    assert "ignoring record offsets" not in capsys.readouterr().err
+    with rsidx.open(vcffile, "r") as fh:
+        lines = list(fh)
+    rsidx.tabix.write_bgzf(lines, vcffile, threads=1, tbifile=vcffile + ".tbi", level=1)
+    observed = list(rsidx.search.search(rsidlist, idxfile, vcffile))
+    assert len(observed) == 3
+    assert observed == expected
+    terminal = capsys.readouterr()
+    assert "differs from the indexed file, ignoring record offsets" in terminal.err
+
+
+def test_search_tabix_output(capsys, tmp_path):
+    vcffile = data_file("chr9-multi.vcf.gz")
+    idxfile = data_file("chr9-multi.rsidx")
+    outfile = str(tmp_path / "out.vcf.gz")
+    arglist = ["search", "--header", "--tabix", "-o", outfile, vcffile, idxfile, "rs60995877"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    expected = list(rsidx.search.search(["rs60995877"], idxfile, vcffile, header=True))
+    with rsidx.tabix.TabixFile(outfile) as tbx:
+        assert [line.decode() for line in tbx.header()] == [l for l in expected if l[0] == "#"]
+        chrom, pos = rsidx.search.record_key(expected[-1])
+        records = [line.decode() for line in tbx.fetch(chrom, [(pos, pos)])]
+    assert len(records) == 7
+    assert records == [line for line in expected if not line.startswith("#")]
+    arglist = ["search", "--tabix", "-o", str(tmp_path / "out.vcf"), vcffile, idxfile, "rs1"]
+    with pytest.raises(SystemExit):
+        rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "--tabix requires VCF output to a file ending in .gz" in terminal.err
+
+
+@pytest.mark.parametrize("presence", [False, True])
+def test_search_merged(presence, capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    mergefile = str(tmp_path / "merges.tsv")
+    with open(mergefile, "w") as fh:
+        fh.write("rs1\trs548749810\nrs2\trs1\nrs3\trs4\n")
+    idxfile = str(tmp_path / "merges.rsidx")
+    arglist = ["index", "--merges", mergefile, vcffile, idxfile]
+    arglist += ["--presence"] if presence else []
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx::index] loaded 3 merged rsIDs" in terminal.err
+    rsidlist = ["rs2", "rs956322221", "rs3", "rs548749810"]
+    aliases = dict()
+    observed = list(rsidx.search.search(rsidlist, idxfile, vcffile, aliases=aliases))
+    expected = list(rsidx.search.search(["rs548749810", "rs956322221"], idxfile, vcffile))
+    assert observed == expected
+    assert aliases == {2: 548749810}
+    terminal = capsys.readouterr()
+    assert "resolved 1 merged rsIDs: rs2 -> rs548749810" in terminal.err
+    assert "1 of 4 rsIDs not found: rs3" in terminal.err
+    aliases = dict()
+    observed = list(rsidx.search.coords(["rs1", "rs956322221"], idxfile, aliases=aliases))
+    assert observed == [(1, "17", 1098730), (956322221, "17", 1227227)]
+    assert aliases == {1: 548749810}
+    with rsidx.RsidIndex(vcffile, idxfile) as index:
+        assert index.resolve("rs2") == (548749810, "17", 1098730)
+        assert index.coord("rs1") == ("17", 1098730)
+        assert index.records("rs1") == tuple(expected[:1])
+        assert index.resolve("rs3") is None
+
+
+def test_search_merged_cli(capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    mergefile = str(tmp_path / "merges.tsv")
+    with open(mergefile, "w") as fh:
+        fh.write("rs1 rs548749810\n")
+    idxfile = str(tmp_path / "merges.rsidx")
+    arglist = ["index", "--merges", mergefile, vcffile, idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    aliasfile = str(tmp_path / "aliases.tsv")
+    arglist = ["search", "--aliases", aliasfile, vcffile, idxfile, "rs1"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "\trs548749810\t" in terminal.out
+    with open(aliasfile, "r") as fh:
+        assert fh.read() == "rs1\trs548749810\n"
+    os.unlink(aliasfile)
+    arglist = ["search", "--coords-only", "--aliases", aliasfile, vcffile, idxfile, "rs1"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert terminal.out == "rs1\t17\t1098730\n"
+    with open(aliasfile, "r") as fh:
+        assert fh.read() == "rs1\trs548749810\n"
+    arglist = ["index", "--format", "bin", "--merges", mergefile, vcffile, idxfile + ".bin"]
+    with pytest.raises(SystemExit):
+        rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx] ERROR:" in terminal.err
+
+
+@pytest.mark.parametrize("rsid", ["rs12abc", "rs9223372036854775808", "rs-1", "bogus"])
+def test_rsid_index_invalid_rsid(rsid, capsys):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    with rsidx.RsidIndex(vcffile, data_file("chr17-sample.rsidx")) as index:
+        assert index.coord(rsid) is None
+        assert index.coords(rsid) == ()
+        assert index.resolve(rsid) is None
+        assert index.records(rsid) == ()
+        assert list(index.search([rsid, "rs1472751972"])) == list(index.records("rs1472751972"))
+    terminal = capsys.readouterr()
+    assert 'skipping invalid rsID "{}"'.format(rsid) in terminal.err
+
+
+def test_rsid_index_alt_coords(capsys, tmp_path):
+    vcffile, idxfile = record_both_index(str(tmp_path))
+    rsidlist = ["rs8", "rs7"]
+    expected = list(rsidx.search.search(rsidlist, idxfile, vcffile, header=True))
+    assert [line.split("\t")[1] for line in expected if not line.startswith("#")] == [
+        "100",
+        "200",
+        "300",
+    ]
+    with rsidx.RsidIndex(vcffile, idxfile) as index:
+        assert index.coord("rs7") == ("17", 100)
+        assert index.coords("rs7") == (("17", 100), ("17", 200))
+        assert len(index.records("rs7")) == 2
+        assert list(index.search(rsidlist, header=True)) == expected
+
+
+@pytest.mark.parametrize("gap", [0, 1000])
+def test_search_merged_region_indexed_coords(gap, tmp_path):
+    vcffile = str(tmp_path / "test.vcf.gz")
+    idxfile = str(tmp_path / "test.rsidx")
+    lines = RECORD_BOTH_VCF.splitlines(keepends=True)
+    rsidx.tabix.write_bgzf(lines, vcffile, threads=1, tbifile=vcffile + ".tbi")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", vcffile, idxfile]))
+    alone = list(rsidx.search.search(["rs7"], idxfile, vcffile, gap=gap))
+    assert alone == lines[2:3]
+    together = list(rsidx.search.search(["rs7", "rs8"], idxfile, vcffile, gap=gap))
+    assert together == lines[2:3] + lines[4:5]
+    with rsidx.RsidIndex(vcffile, idxfile) as index:
+        assert list(index.search(["rs7", "rs8"])) == together
+
+
+@pytest.mark.parametrize("batchsize", [1, None])
+def test_search_alt_coord_missing_from_vcf(batchsize, capsys, tmp_path):
+    vcffile, idxfile = record_both_index(str(tmp_path))
+    conn = sqlite3.connect(idxfile)
+    conn.execute("UPDATE rsid_alt_coord SET coord = 250 WHERE rsid = 7")
+    conn.commit()
+    conn.close()
+    found = set()
+    outlines = list(
+        rsidx.search.search(["rs7"], idxfile, vcffile, found=found, batch_size=batchsize)
+    )
+    assert [line.split("\t")[1] for line in outlines] == ["100"]
+    assert found == {7}
+    terminal = capsys.readouterr()
+    assert "not found" not in terminal.err
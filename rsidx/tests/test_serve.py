@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import pytest
+import rsidx
+from rsidx.tests import data_file, record_both_index
+import threading
+
+
+DATASETS = [
+    (data_file("chr17-sample.vcf.gz"), data_file("chr17-sample.rsidx")),
+    (data_file("chr9-multi.vcf.gz"), data_file("chr9-multi.rsidx")),
+]
+
+
+@contextmanager
+def running_server(address, datasets=DATASETS, **kwargs):
+    server = rsidx.serve.make_server(datasets, address, **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "address,expected",
+    [
+        ("unix:/tmp/rsidx.sock", ("unix", "/tmp/rsidx.sock")),
+        ("localhost:8877", ("tcp", ("localhost", 8877))),
+        ("http://127.0.0.1:80/", ("tcp", ("127.0.0.1", 80))),
+        (":0", ("tcp", ("127.0.0.1", 0))),
+    ],
+)
+def test_parse_address(address, expected):
+    assert rsidx.serve.parse_address(address) == expected
+
+
+def test_parse_address_invalid():
+    with pytest.raises(ValueError, match=r'invalid server address "localhost"'):
+        rsidx.serve.parse_address("localhost")
+
+
+@pytest.mark.parametrize("kind", ["unix", "tcp"])
+def test_serve_search(kind, tmp_path):
+    address = "unix:" + str(tmp_path / "rsidx.sock") if kind == "unix" else "127.0.0.1:0"
+    rsidlist = ["rs548749810", "rs956322221", "rs1", "rs1472751972"]
+    vcffile, idxfile = DATASETS[0]
+    expected = list(rsidx.search.search(rsidlist, idxfile, vcffile, header=True))
+    with running_server(address) as server:
+        status = rsidx.serve.request(server.address, "/status")
+        assert [dataset["idx"] for dataset in status["datasets"]] == [idx for _, idx in DATASETS]
+        payload = {"vcf": vcffile, "idx": idxfile, "rsids": rsidlist, "header": True}
+        result = rsidx.serve.request(server.address, "/search", payload)
+        assert result["records"] == expected
+        assert result["missing"] == [1]
+        assert result["nquery"] == 4
+        payload = {"vcf": DATASETS[1][0], "idx": DATASETS[1][1], "rsids": ["rs60995877"]}
+        result = rsidx.serve.request(server.address, "/search", payload)
+        assert len(result["records"]) == 7
+        result = rsidx.serve.request(
+            server.address, "/lookup", {"idx": idxfile, "rsids": rsidlist}
+        )
+        assert result["coords"] == [list(row) for row in rsidx.search.coords(rsidlist, idxfile)]
+    if kind == "unix":
+        assert not os.path.exists(str(tmp_path / "rsidx.sock"))
+
+
+def test_serve_concurrent(tmp_path):
+    vcffile, idxfile = DATASETS[0]
+    queries = [["rs548749810"], ["rs956322221", "rs1472751972"], ["rs1245348147"]] * 10
+    expected = [list(rsidx.search.search(rsidlist, idxfile, vcffile)) for rsidlist in queries]
+
+    def search(rsidlist):
+        payload = {"vcf": vcffile, "idx": idxfile, "rsids": rsidlist}
+        return rsidx.serve.request(server.address, "/search", payload)["records"]
+
+    with running_server("unix:" + str(tmp_path / "rsidx.sock"), workers=2) as server:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            observed = list(pool.map(search, queries))
+        assert len(server.datasets[rsidx.serve.dataset_key(vcffile, idxfile)]._open) <= 2
+    assert observed == expected
+
+
+def test_serve_errors(tmp_path):
+    with running_server("unix:" + str(tmp_path / "rsidx.sock")) as server:
+        vcffile, idxfile = data_file("multiple_id.vcf.gz"), data_file("multiple_id.rsidx")
+        payload = {"vcf": vcffile, "idx": idxfile, "rsids": ["rs1"]}
+        with pytest.raises(ValueError, match=r"multiple_id.rsidx\" is not served with VCF"):
+            rsidx.serve.request(server.address, "/search", payload)
+        payload = {"vcf": vcffile, "idx": DATASETS[0][1], "rsids": ["rs1"]}
+        with pytest.raises(ValueError, match=r"chr17-sample.rsidx\" is not served with VCF"):
+            rsidx.serve.request(server.address, "/search", payload)
+        del payload["vcf"]
+        with pytest.raises(ValueError, match=r"invalid request"):
+            rsidx.serve.request(server.address, "/search", payload)
+        payload = {"idx": idxfile, "rsids": ["rs1"]}
+        with pytest.raises(ValueError, match=r"multiple_id.rsidx\" is not served"):
+            rsidx.serve.request(server.address, "/lookup", payload)
+        with pytest.raises(ValueError, match=r"invalid request"):
+            rsidx.serve.request(server.address, "/search", {"rsids": ["rs1"]})
+        with pytest.raises(ValueError, match=r'unknown endpoint "/bogus"'):
+            rsidx.serve.request(server.address, "/bogus")
+
+
+@pytest.mark.parametrize("coords", [False, True])
+def test_search_server_cli(coords, capsys, tmp_path):
+    vcffile, idxfile = DATASETS[0]
+    options = ["--coords-only"] if coords else ["--header"]
+    arglist = ["search"] + options + [vcffile, idxfile, "rs548749810", "rs956322221", "rs1"]
+    rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    expected = capsys.readouterr()
+    address = "unix:" + str(tmp_path / "rsidx.sock")
+    with running_server(address):
+        arglist = ["search", "--server", address] + arglist[1:]
+        rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    observed = capsys.readouterr()
+    assert observed.out == expected.out
+    assert "1 of 3 rsIDs not found: rs1" in observed.err
+
+
+def test_search_server_unreachable(capsys, tmp_path):
+    vcffile, idxfile = DATASETS[0]
+    address = "unix:" + str(tmp_path / "missing.sock")
+    arglist = ["search", "--server", address, vcffile, idxfile, "rs548749810"]
+    with pytest.raises(SystemExit):
+        rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+    terminal = capsys.readouterr()
+    assert "[rsidx] ERROR: cannot reach rsidx server" in terminal.err
+
+
+def test_serve_merged(capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    mergefile = str(tmp_path / "merges.tsv")
+    with open(mergefile, "w") as fh:
+        fh.write("rs1 rs548749810\n")
+    idxfile = str(tmp_path / "merges.rsidx")
+    arglist = ["index", "--merges", mergefile, vcffile, idxfile]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(arglist))
+    address = "unix:" + str(tmp_path / "rsidx.sock")
+    with running_server(address, datasets=[(vcffile, idxfile)]):
+        aliasfile = str(tmp_path / "aliases.tsv")
+        arglist = ["search", "--server", address, "--aliases", aliasfile, vcffile, idxfile]
+        rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist + ["rs1", "rs956322221"]))
+        terminal = capsys.readouterr()
+        records = list(rsidx.search.search(["rs548749810", "rs956322221"], idxfile, vcffile))
+        assert terminal.out == "".join(records)
+        assert "resolved 1 merged rsIDs: rs1 -> rs548749810" in terminal.err
+        with open(aliasfile, "r") as fh:
+            assert fh.read() == "rs1\trs548749810\n"
+
+
+def served_and_local(datasets, vcffile, idxfile, rsidlist, tmp_path, capsys):
+    outputs = list()
+    for options in (["--header"], ["--coords-only"]):
+        arglist = ["search"] + options + [vcffile, idxfile] + rsidlist
+        rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+        local = capsys.readouterr()
+        address = "unix:" + str(tmp_path / "rsidx.sock")
+        with running_server(address, datasets=datasets):
+            arglist = ["search", "--server", address] + arglist[1:]
+            rsidx.search.main(rsidx.cli.get_parser().parse_args(arglist))
+        served = capsys.readouterr()
+        outputs.append((local.out, served.out))
+    return outputs
+
+
+def test_serve_record_both(capsys, tmp_path):
+    vcffile, idxfile = record_both_index(str(tmp_path))
+    capsys.readouterr()
+    datasets = [(vcffile, idxfile)]
+    outputs = served_and_local(datasets, vcffile, idxfile, ["rs7", "rs8"], tmp_path, capsys)
+    for local, served in outputs:
+        assert served == local
+    records = [line for line in outputs[0][0].split("\n") if line and line[0] != "#"]
+    assert [line.split("\t")[1] for line in records] == ["100", "200", "300"]
+
+
+def test_serve_multi(capsys, tmp_path):
+    idxfile = str(tmp_path / "multi.rsidx")
+    vcffiles = [data_file("chr9-multi.vcf.gz"), data_file("chr17-sample.vcf.gz")]
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index"] + vcffiles + [idxfile]))
+    capsys.readouterr()
+    rsidlist = ["rs60995877", "rs548749810", "rs1"]
+    datasets = [("-", idxfile)]
+    outputs = served_and_local(datasets, "-", idxfile, rsidlist, tmp_path, capsys)
+    for local, served in outputs:
+        assert served == local
+    records = [line for line in outputs[0][0].split("\n") if line and line[0] != "#"]
+    assert [line.split("\t")[2] for line in records] == ["rs548749810"] + ["rs60995877"] * 7
+
+
+def test_serve_offsets(capsys, tmp_path):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    idxfile = str(tmp_path / "offsets.rsidx")
+    rsidx.index.main(rsidx.cli.get_parser().parse_args(["index", "--offsets", vcffile, idxfile]))
+    rsidlist = ["rs956322221", "rs548749810", "rs1472751972", "rs1"]
+    datasets = [(vcffile, idxfile)]
+    for local, served in served_and_local(datasets, vcffile, idxfile, rsidlist, tmp_path, capsys):
+        assert served == local
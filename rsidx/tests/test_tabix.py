@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#
+# -----------------------------------------------------------------------------
+# Copyright (c) 2019, Battelle National Biodefense Institute.
+#
+# This file is part of rsidx (https://github.com/bioforensics/rsidx)
+# and is licensed under the BSD license: see LICENSE.txt.
+# -----------------------------------------------------------------------------
+
+import gzip
+import pytest
+import rsidx
+from rsidx.tabix import (
+    BgzfReader,
+    BgzfWriter,
+    TabixFile,
+    TabixIndex,
+    ThreadedBgzfReader,
+    ThreadedBgzfWriter,
+    is_bgzf,
+    write_bgzf,
+    write_tabix,
+)
+from rsidx.tests import data_file
+import zlib
+
+
+def vcf_records(vcffile):
+    with rsidx.open(vcffile, "r") as fh:
+        for line in fh:
+            if line.startswith("#"):
+                continue
+            chrom, pos, rsid, ref, *values = line.split("\t")
+            yield line.encode(), chrom, int(pos), int(pos) + len(ref) - 1
+
+
+def test_tabix_index():
+    tbi = TabixIndex(data_file("chr17-sample.vcf.gz.tbi"))
+    assert tbi.names == ["17"]
+    assert tbi.columns == (1, 2, 0)
+    assert tbi.meta == "#"
+
+
+def test_bgzf_reader_lines():
+    vcffile = data_file("chr4-sample-corrupted-ids.vcf.gz")
+    with BgzfReader(vcffile) as reader:
+        observed = list(reader.lines())
+    with rsidx.open(vcffile, "r") as fh:
+        expected = [line.encode() for line in fh]
+    assert observed == expected
+
+
+@pytest.mark.parametrize(
+    "vcf,positions",
+    [
+        ("chr17-sample.vcf.gz", [132359, 624973, 1098730, 1227227]),
+        ("chr17-sample.vcf.gz", [1, 624973, 624974, 99999999]),
+        ("overlap.vcf.gz", [89957798]),
+        ("chr9-multi.vcf.gz", [99202640, 99202624]),
+    ],
+)
+def test_tabix_fetch(vcf, positions):
+    vcffile = data_file(vcf)
+    records = list(vcf_records(vcffile))
+    chrom = records[0][1]
+    expected = [
+        line for line, _, start, end in records if any(start <= pos <= end for pos in positions)
+    ]
+    with TabixFile(vcffile) as tbx:
+        observed = list(tbx.fetch(chrom, [(pos, pos) for pos in positions]))
+    assert observed == expected
+
+
+def test_tabix_fetch_overlapping_record():
+    with TabixFile(data_file("overlap.vcf.gz")) as tbx:
+        observed = list(tbx.fetch("16", [(89957798, 89957798)]))
+    assert len(observed) == 2
+    assert b"\trs967556605\t" in observed[0]
+    assert b"\trs8051733\t" in observed[1]
+
+
+def test_tabix_query_header_and_unknown_chrom():
+    with TabixFile(data_file("chr17-sample.vcf.gz")) as tbx:
+        observed = list(tbx.query([("1", 100, 100), ("17", 132359, 132359)], header=True))
+    assert len(observed) == 58
+    assert all(line.startswith(b"#") for line in observed[:-1])
+    assert observed[-1].startswith(b"17\t132359\t")
+
+
+@pytest.mark.parametrize("threads,readahead", [(2, None), (4, 1), (8, 3)])
+@pytest.mark.parametrize("vcf", ["chr17-sample.vcf.gz", "chr9-multi.vcf.gz"])
+def test_threaded_bgzf_reader(vcf, threads, readahead):
+    vcffile = data_file(vcf)
+    with gzip.open(vcffile, "rb") as fh:
+        expected = fh.read()
+    with ThreadedBgzfReader(vcffile, threads=threads, readahead=readahead) as reader:
+        assert reader.read() == expected
+
+
+@pytest.mark.parametrize("mode", ["r", "rb"])
+def test_open_threads(mode):
+    vcffile = data_file("chr17-sample.vcf.gz")
+    with rsidx.open(vcffile, mode) as fh:
+        expected = list(fh)
+    with rsidx.open(vcffile, mode, threads=4) as fh:
+        assert list(fh) == expected
+
+
+def test_open_threads_plain_gzip(tmp_path):
+    gzfile = str(tmp_path / "plain.txt.gz")
+    with gzip.open(gzfile, "wt") as fh:
+        print("not a BGZF file", file=fh)
+    assert not is_bgzf(gzfile)
+    assert is_bgzf(data_file("chr17-sample.vcf.gz"))
+    with rsidx.open(gzfile, "r", threads=4) as fh:
+        assert fh.read() == "not a BGZF file\n"
+
+
+def test_threaded_bgzf_reader_corrupted(tmp_path):
+    with open(data_file("chr17-sample.vcf.gz"), "rb") as fh:
+        data = bytearray(fh.read())
+    data[1000] ^= 0xFF
+    vcffile = str(tmp_path / "corrupt.vcf.gz")
+    with open(vcffile, "wb") as fh:
+        fh.write(data)
+    with pytest.raises((ValueError, zlib.error)):
+        with ThreadedBgzfReader(vcffile, threads=2) as reader:
+            reader.read()
+
+
+def test_bgzf_writer(tmp_path):
+    filename = str(tmp_path / "test.gz")
+    data = b"".join(b"line %d\n" % i for i in range(50000))
+    with BgzfWriter(filename) as writer:
+        writer.write(data[:100])
+        offsets = [writer.tell()]
+        writer.write(data[100:])
+        offsets.append(writer.tell())
+    assert is_bgzf(filename)
+    with gzip.open(filename, "rb") as fh:
+        assert fh.read() == data
+    with BgzfReader(filename) as reader:
+        assert b"".join(reader.lines()) == data
+        reader.seek(offsets[0])
+        assert reader.readline() == data[100:].split(b"\n")[0] + b"\n"
+        reader.seek(offsets[1])
+        assert reader.readline() == b""
+
+
+@pytest.mark.parametrize("vcf", ["chr17-sample.vcf.gz", "chr9-multi.vcf.gz", "overlap.vcf.gz"])
+def test_write_tabix(vcf, tmp_path):
+    vcffile = str(tmp_path / vcf)
+    with gzip.open(data_file(vcf), "rb") as fh, BgzfWriter(vcffile) as writer:
+        writer.write(fh.read())
+    write_tabix(vcffile)
+    expected = TabixIndex(data_file(vcf) + ".tbi")
+    observed = TabixIndex(vcffile + ".tbi")
+    assert observed.names == expected.names
+    assert observed.columns == expected.columns
+    assert [len(linear) for linear in observed.linear] == [len(lin) for lin in expected.linear]
+    with TabixFile(data_file(vcf)) as tbx1, TabixFile(vcffile) as tbx2:
+        for chrom in expected.names:
+            for start in range(1, 3000000, 100000):
+                interval = [(start, start + 50000)]
+                assert list(tbx2.fetch(chrom, interval)) == list(tbx1.fetch(chrom, interval))
+
+
+@pytest.mark.parametrize("threads,backlog", [(1, None), (4, 1), (8, None)])
+def test_threaded_bgzf_writer(threads, backlog, tmp_path):
+    filename1 = str(tmp_path / "serial.gz")
+    filename2 = str(tmp_path / "threaded.gz")
+    data = b"".join(b"line %d\n" % i for i in range(100000))
+    with BgzfWriter(filename1) as writer:
+        writer.write(data[:100])
+        expected = writer.tell()
+        writer.write(data[100:])
+    with ThreadedBgzfWriter(filename2, threads=threads, backlog=backlog) as writer:
+        writer.write(data[:100])
+        vo = writer.block_tell()
+        writer.write(data[100:])
+    assert writer.resolve(vo) == expected
+    with open(filename1, "rb") as fh1, open(filename2, "rb") as fh2:
+        assert fh2.read() == fh1.read()
+
+
+@pytest.mark.parametrize("vcf", ["chr17-sample.vcf.gz", "chr9-multi.vcf.gz", "overlap.vcf.gz"])
+def test_write_bgzf_tabix(vcf, tmp_path):
+    vcffile1 = str(tmp_path / "serial.vcf.gz")
+    vcffile2 = str(tmp_path / "threaded.vcf.gz")
+    with gzip.open(data_file(vcf), "rt") as fh:
+        lines = fh.readlines()
+    with BgzfWriter(vcffile1) as writer:
+        writer.write("".join(lines).encode())
+    write_tabix(vcffile1)
+    write_bgzf(lines, vcffile2, threads=4, tbifile=vcffile2 + ".tbi")
+    with open(vcffile1, "rb") as fh1, open(vcffile2, "rb") as fh2:
+        assert fh2.read() == fh1.read()
+    with open(vcffile1 + ".tbi", "rb") as fh1, open(vcffile2 + ".tbi", "rb") as fh2:
+        assert fh2.read() == fh1.read()
+
+
+def test_open_write_bgzf(tmp_path):
+    filename = str(tmp_path / "out.txt.gz")
+    with rsidx.open(filename, "w", threads=4) as fh:
+        for i in range(100000):
+            print("line", i, file=fh)
+    assert is_bgzf(filename)
+    with gzip.open(filename, "rt") as fh:
+        assert fh.read() == "".join("line {:d}\n".format(i) for i in range(100000))